@@ -0,0 +1,32 @@
+      prompt: .ascii "How many generations? "
+             
+       print: ld %b [%a]
+              jz %b done_print
+              .char %b
+              add %a 1
+              jmp print
+  done_print: ret %c
+             
+              .main 
+              ld %a prompt
+              call %c print
+              .input %1
+              ld %0 0x0100
+             
+  generation: ld %2 0xE0
+      scroll: mv %3 %2
+              add %3 1
+              ld %4 [%3]
+              st [%2] %4
+              mv %2 %3
+              xor %4 %2 0xEF
+              jp %4 scroll
+              st [0xEF] %0
+             
+              mv %4 %0
+              lsh %4 1
+              rsh %0 1
+              xor %0 %4
+              sub %1 1
+              jp %1 generation
+              halt 
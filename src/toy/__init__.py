@@ -1,2 +1,17 @@
 from .lib.toy_computer import ToyComputer
-from .lib.assembler import assemble, format_assembly
+from .lib.assembler import assemble, format_assembly, stream_assembly
+from .lib.sweep import sweep
+from .lib.shared_state import SharedToyComputer, SharedStateReader
+from .lib.framebuffer import Framebuffer
+from .lib.timing import TimingModel, time_run
+from .lib.profiler import profile_run
+from .lib.accelerate import FusedToyComputer
+from .lib.memo import RunCache, memoized_run
+from .lib.superoptimizer import ReplacementTable, superoptimize
+from .lib.compiler import load_compiled, write_compiled
+from .lib.image import ProgramImage
+from .lib.replay import InputLog, recording, replaying
+from .lib.cache import Cache, caching
+from .lib.metrics import Metrics
+from .lib.formatting import format_directory
+from .lib.linker import Linker, ObjectModule, assemble_object, link
@@ -1,10 +1,11 @@
 if __name__ == "__main__":
+    from os.path import dirname
     from re import split
     from sys import argv
 
     from .lib.exception import ToyException
-    from .lib.toy_computer import ToyComputer
-    from .lib.assembler import assemble, format_assembly
+    from .lib.toy_computer import LineReader, ToyComputer
+    from .lib.assembler import AssemblyCache, assemble, stream_assembly
 
     from prompt_toolkit import PromptSession
     from prompt_toolkit.completion import PathCompleter, NestedCompleter
@@ -16,6 +17,7 @@ if __name__ == "__main__":
             "dump": PathCompleter(),
             "machine": PathCompleter(),
             "step": None,
+            "debug": None,
             "clear": None,
             "format": PathCompleter(),
             "quit": None,
@@ -53,11 +55,23 @@ if __name__ == "__main__":
         previous_step = ""
         repeat_previous_step = False
         original_pc = 0
+        # The parse of the loaded assembly, so reloading it after an
+        # edit only reassembles the lines that changed.
+        cache = AssemblyCache()
+        # A background reader left reading a line when a program stopped
+        # (a read cannot be interrupted), so the next line typed is taken
+        # from it rather than competing with the prompt for it.
+        waiting: LineReader | None = None
 
         computer = ToyComputer()
 
+        def release_input() -> None:
+            nonlocal waiting
+            waiting = computer.stop_reader() or waiting
+
         def load_path(path: str) -> bool:
-            nonlocal loaded_path, original_pc
+            nonlocal loaded_path, original_pc, cache
+            release_input()
             try:
                 with open(path) as f:
                     program = f.read()
@@ -70,9 +84,41 @@ if __name__ == "__main__":
 
             try:
                 if ".asm" in path:
-                    assembled = assemble(program)
+                    reloading = path == loaded_path
+                    if not reloading:
+                        cache = AssemblyCache()
+                    assembled = assemble(
+                        program, cache=cache, directory=dirname(path) or "."
+                    )
                     pc, ram = assembled.pc, assembled.words
-                    computer.set_state(pc, ram)
+                    if (
+                        reloading
+                        and not assembled.banks
+                        and computer.banks is None
+                        and assembled.devices == computer.devices
+                        and len(ram) <= 0x100
+                    ):
+                        # Only write the words that differ from memory.
+                        ram = ram + [0] * (0x100 - len(ram))
+                        changed = [
+                            i for i, v in enumerate(ram) if computer.memory[i] != v
+                        ]
+                        for i in changed:
+                            computer.memory[i] = ram[i]
+                        computer.registers[:] = [0 for _ in range(0x10)]
+                        if computer.operands is not None:
+                            computer.operands = [0, 0]
+                        computer.pc = pc
+                        computer.steps = 0
+                        computer.set_timer(0, 0)
+                        print(
+                            f"Reassembled {cache.translated} changed lines, "
+                            f"{len(changed)} words changed."
+                        )
+                    else:
+                        computer.set_state(
+                            pc, ram, banks=assembled.banks, **assembled.devices
+                        )
                     print(f"Compiled {path} as assembly.")
                     print(
                         f"Program counter: {hex(computer.pc)[2:].rjust(2, '0')}"
@@ -105,16 +151,27 @@ if __name__ == "__main__":
                 print()
                 print("* Error")
                 print(e.message)
+            finally:
+                release_input()
 
         while True:
             if repeat_previous_step:
                 repeat_previous_step = False
                 instruction = previous_step
             else:
-                instruction = session.prompt(
-                    f"\n{loaded_path.split('/')[-1]} > ",
-                    completer=ToyComputerCompleter,
-                )
+                instruction = None
+                if waiting is not None:
+                    print(f"\n{loaded_path.split('/')[-1]} > ", end="", flush=True)
+                    reader, waiting = waiting, None
+                    try:
+                        instruction = reader.take()
+                    except EOFError:
+                        pass
+                if instruction is None:
+                    instruction = session.prompt(
+                        f"\n{loaded_path.split('/')[-1]} > ",
+                        completer=ToyComputerCompleter,
+                    )
             match split(r" +", instruction.strip()):
                 case ["help"] | ["h"]:
                     print(
@@ -129,7 +186,9 @@ if __name__ == "__main__":
                             assembly language file p. (If .asm is
                             contained in the file name the language
                             is assumed to be assembly.) If no path is
-                            provided, re-compile loaded file.
+                            provided, re-compile loaded file (only
+                            reassembling lines changed since it was
+                            last loaded).
 
         run                 Run the program from the current position.
 
@@ -141,6 +200,10 @@ if __name__ == "__main__":
 
         step                Step through one fetch-decode-execute cycle.
 
+        debug               Show the computer full screen while running,
+                            pausing and stepping the program (F5 to run,
+                            F6 to pause, F7 to step and Ctrl-Q to return).
+
         {addr}: {val}       Write value val to one-byte memory address addr.
                             (Both addr and val are expected to be in hexadecimal.)
 
@@ -198,11 +261,19 @@ if __name__ == "__main__":
                         else:
                             print("No program loaded...")
 
+                case ["debug"] | ["g"]:
+                    from .lib.debugger import debug
+
+                    debug(computer)
+                    release_input()
+                    lineate("Left Debugger")
+
                 case ["clear"] | ["x"]:
                     loaded_path = ""
                     previous_step = ""
                     repeat_previous_step = False
                     original_pc = 0
+                    release_input()
                     computer.clear()
                     print("Cleared.")
 
@@ -230,6 +301,8 @@ if __name__ == "__main__":
                     except ToyException as e:
                         print("* Error")
                         print(e.message)
+                    finally:
+                        release_input()
 
                 # case ["repeat"] | ["."]:
                 #     if previous_step:
@@ -260,9 +333,14 @@ if __name__ == "__main__":
                         try:
                             with open(loaded_path) as f:
                                 code = f.read()
+                            lines = stream_assembly(
+                                code, directory=dirname(loaded_path) or "."
+                            )
                             with open(path, "w") as f:
-                                f.write(format_assembly(code))
+                                f.writelines(lines)
                             print(f"Written to {path}.")
+                        except ToyException as e:
+                            print(f"* Error\n{e.message}")
                         except FileNotFoundError:
                             print(f"* Error\nFile '{load_path}' not found.")
                     else:
@@ -323,33 +401,368 @@ if __name__ == "__main__":
                         "Not understood. Input 'help' for available instructions."
                     )
 
-    if len(argv) == 1:
-        try:
-            repl()
-        except KeyboardInterrupt:
-            print("\n\nSo long!\n")
-    elif len(argv) == 2:
+    def read_program(
+        path: str,
+    ) -> tuple[int, list[int], dict[int, list[int]], dict[str, bool]]:
+        """
+        Reads and compiles the program at path, exiting on failure.
+        Returns the program counter, memory, banks and the optional
+        devices used (see `Assembled.devices`).
+        """
         try:
-            with open(argv[1]) as f:
+            with open(path) as f:
                 code = f.read()
         except FileNotFoundError:
-            print(f"File '{argv[1]}' not found...")
+            print(f"File '{path}' not found...")
             exit()
 
+        if ".asm" in path:
+            assembled = assemble(
+                code, show_addresses=False, directory=dirname(path) or "."
+            )
+            return (
+                assembled.pc,
+                assembled.words,
+                assembled.banks,
+                assembled.devices,
+            )
         computer = ToyComputer()
-        if ".asm" in argv[1]:
-            assembled = assemble(code, show_addresses=False)
-            pc, ram = assembled.pc, assembled.words
-            computer.set_state(pc, ram)
-        else:
-            computer.compile_machine_language(code)
-        computer.run()
-    else:
-        print(
-            """
+        computer.compile_machine_language(code)
+        return computer.pc, computer.memory, {}, {}
+
+    match argv[1:]:
+        case []:
+            try:
+                repl()
+            except KeyboardInterrupt:
+                print("\n\nSo long!\n")
+
+        case ["sweep", path, *rest] if len(rest) <= 3:
+            from .lib.sweep import sweep, STATUS_NAMES
+
+            try:
+                first, last, max_steps = (
+                    [int(x, 16) for x in rest] + [0x0, 0xFFFF, 0x10000][len(rest) :]
+                )
+            except ValueError:
+                print("Expecting hexadecimal values...")
+                exit()
+            pc, ram, banks, devices = read_program(path)
+            result = sweep(
+                pc,
+                ram,
+                range(first, last + 1),
+                max_steps,
+                banks=banks,
+                devices=devices,
+            )
+            for i, v in enumerate(result.inputs):
+                print(
+                    f"{hex(v)[2:].rjust(4, '0')}: "
+                    f"{hex(result.outputs[i])[2:].rjust(4, '0')} "
+                    f"{str(result.steps[i]).rjust(10)} "
+                    f"{STATUS_NAMES[result.statuses[i]]}"
+                )
+
+        case ["display", path]:
+            from .lib.framebuffer import Framebuffer
+
+            pc, ram, banks, devices = read_program(path)
+            computer = ToyComputer()
+            computer.set_state(pc, ram, banks=banks, **devices)
+            with Framebuffer(computer):
+                computer.run()
+
+        case ["debug", path]:
+            from .lib.debugger import debug
+
+            pc, ram, banks, devices = read_program(path)
+            computer = ToyComputer()
+            computer.set_state(pc, ram, banks=banks, **devices)
+            debug(computer)
+
+        case ["time", path]:
+            from .lib.timing import time_run
+
+            pc, ram, banks, devices = read_program(path)
+            computer = ToyComputer()
+            computer.set_state(pc, ram, banks=banks, **devices)
+            report = time_run(computer)
+            print(report.format(computer))
+
+        case ["cache", path, *rest] if len([x for x in rest if x != "--split"]) <= 4:
+            from .lib.cache import Cache, caching
+
+            split = "--split" in rest
+            options = [x for x in rest if x != "--split"]
+            pc, ram, banks, devices = read_program(path)
+            computer = ToyComputer()
+            computer.set_state(pc, ram, banks=banks, **devices)
+            try:
+                sizes = [int(x) for x in options[:3]]
+                caches = [Cache(*sizes, *options[3:]) for _ in range(1 + split)]
+            except ValueError:
+                print("Sizes must be whole numbers...")
+                exit()
+            except ToyException as e:
+                print(e.message)
+                exit()
+            with caching(computer, *caches):
+                computer.run()
+            for name, cache in zip(
+                ["Instruction", "Data"] if split else ["Unified"], caches
+            ):
+                print(cache.format(name, computer))
+
+        case ["profile", path, *rest] if ".asm" in path and len(rest) <= 1:
+            from .lib.profiler import profile_run
+
+            try:
+                with open(path) as f:
+                    code = f.read()
+            except FileNotFoundError:
+                print(f"File '{path}' not found...")
+                exit()
+            assembled = assemble(
+                code, show_addresses=False, directory=dirname(path) or "."
+            )
+            computer = ToyComputer()
+            computer.set_state(
+                assembled.pc,
+                assembled.words,
+                banks=assembled.banks,
+                **assembled.devices,
+            )
+            profile = profile_run(computer, assembled)
+            print()
+            print(profile.annotate(code))
+            if rest:
+                with open(rest[0], "w") as f:
+                    f.writelines(
+                        stream_assembly(
+                            code, profile.heat, directory=dirname(path) or "."
+                        )
+                    )
+                print(f"Written to {rest[0]}.")
+
+        case ["test", *rest]:
+            from .lib.golden import discover, run_tests, update_goldens
+
+            update = "--update" in rest
+            options = dict[str, str]()
+            paths = list[str]()
+            words = iter(x for x in rest if x != "--update")
+            for word in words:
+                if word in ("--metrics", "--metrics-json"):
+                    options[word] = next(words, "")
+                else:
+                    paths.append(word)
+            metrics = None
+            if options:
+                from .lib.metrics import Metrics
+
+                metrics = Metrics()
+                try:
+                    if "--metrics" in options:
+                        metrics.serve(int(options["--metrics"]))
+                except (ValueError, OSError):
+                    port = options["--metrics"]
+                    print(f"Cannot serve metrics on port '{port}'...")
+                    exit(1)
+                if options.get("--metrics-json"):
+                    metrics.dump_at_exit(options["--metrics-json"])
+            programs = discover(paths or ["."], metrics)
+            failures = 0
+            for program in programs:
+                if program.error:
+                    failures += 1
+                    print(f"ERROR {program.spec}\n{program.error}")
+            results = run_tests(programs, metrics=metrics)
+            names = [f"{r.case.spec}:{r.case.name}" for r in results]
+            width = max(map(len, names), default=0)
+            for result, name in zip(results, names):
+                name = name.ljust(width)
+                timing = f"{result.steps:>10} steps {1000 * result.seconds:>9.1f} ms"
+                if result.passed:
+                    print(f"PASS  {name} {timing}")
+                    continue
+                if not result.error and update:
+                    print(f"NEW   {name} {timing}")
+                    continue
+                failures += 1
+                print(f"{'ERROR' if result.error else 'FAIL '} {name} {timing}")
+                print(result.error or result.diff())
+            if update:
+                for spec in update_goldens(results):
+                    print(f"Updated {spec}.")
+            print(
+                f"\n{len(results)} cases in {len(programs)} programs, "
+                f"{failures} failed."
+            )
+            if failures:
+                exit(1)
+
+        case ["superoptimize", table, *lines]:
+            from os.path import exists
+            from .lib.assembler import translate
+            from .lib.superoptimizer import ReplacementTable, superoptimize
+
+            replacements = (
+                ReplacementTable.load(table) if exists(table) else ReplacementTable()
+            )
+            for line in lines or [
+                "mv %1 %2",
+                "or %1 %2 %3",
+                "or %1 %2",
+                "not %1 %2",
+                "not %1 0",
+                "ld %1 0x100",
+                "ld %1 0x8000",
+                "ld %1 0xFFFF",
+            ]:
+                try:
+                    words, references = translate(line.strip())
+                except ToyException as e:
+                    print(f"{line}: {e.message}")
+                    continue
+                replacement = None if references else superoptimize(words)
+                print(f"{line}: {' '.join(f'{w:04X}' for w in words)}")
+                if replacement is None:
+                    print("  No shorter sequence found.")
+                    continue
+                print(f"  -> {' '.join(f'{w:04X}' for w in replacement)}")
+                replacements.add(words, replacement)
+            replacements.save(table)
+            print(f"\n{len(replacements)} replacements written to {table}.")
+
+        case ["compile", path, *rest] if rest in ([], ["-o", *rest[-1:]]):
+            from .lib.compiler import write_compiled
+
+            output = rest[-1] if rest else f"{path.rsplit('.', 1)[0]}_toy.py"
+            pc, ram, banks, devices = read_program(path)
+            if write_compiled(output, pc, ram, banks, devices):
+                print(f"Compiled to {output}.")
+            else:
+                print(f"{output} is up to date.")
+
+        case ["format", directory, *rest] if len(rest) <= 1:
+            from .lib.formatting import format_directory
+
+            results = format_directory(directory, *rest)
+            for result in results:
+                if result.error:
+                    print(f"Skipped {result.source}: {result.error}")
+                elif result.written:
+                    print(f"Formatted {result.target}.")
+            written = sum(result.written for result in results)
+            invalid = sum(bool(result.error) for result in results)
+            print(
+                f"\n{written} formatted, {len(results) - written - invalid} "
+                f"unchanged, {invalid} invalid."
+            )
+
+        case ["link", first, *rest] if "-o" not in [first, *rest[:-2], *rest[-1:]]:
+            from .lib.linker import Linker
+
+            paths, output = [first, *rest], None
+            if rest[-2:-1] == ["-o"]:
+                paths, output = [first, *rest[:-2]], rest[-1]
+            linker = Linker(".toy-objects")
+            try:
+                assembled = linker.link(paths)
+            except ToyException as e:
+                print(e.message)
+                exit(1)
+            computer = ToyComputer()
+            computer.set_state(assembled.pc, assembled.words, **assembled.devices)
+            if output is None:
+                computer.run()
+            else:
+                with open(output, "w") as f:
+                    f.write(computer.state_to_machine_language())
+                print(
+                    f"Linked {len(paths)} modules ({linker.assembled} assembled) "
+                    f"to {output}."
+                )
+
+        case ["lsp"]:
+            from .lib.language_server import LanguageServer
+
+            LanguageServer().serve()
+
+        case [path, "--record" | "--replay" as mode, log, *rest] if rest in (
+            [],
+            ["--seed", *rest[-1:]],
+        ):
+            from .lib.replay import InputLog, recording, replaying
+
+            pc, ram, banks, devices = read_program(path)
+            computer = ToyComputer(seed=int(rest[-1]) if rest else None)
+            computer.set_state(pc, ram, banks=banks, **devices)
+            if mode == "--record":
+                with recording(computer) as input_log:
+                    try:
+                        computer.run()
+                    finally:
+                        input_log.save(log)
+            else:
+                try:
+                    with replaying(computer, InputLog.load(log)):
+                        computer.run()
+                except ToyException as e:
+                    print(e.message)
+
+        case [path]:
+            pc, ram, banks, devices = read_program(path)
+            computer = ToyComputer()
+            computer.set_state(pc, ram, banks=banks, **devices)
+            computer.run()
+
+        case _:
+            print(
+                """
   To use:
     python -m toy
   or:
     python -m toy [file]
+  or, to record the program's input and random words to a log (with
+  random words from a seeded generator), or to run it again from one:
+    python -m toy [file] --record [log] [--seed n]
+    python -m toy [file] --replay [log]
+  or, to show memory E0 to EF as a 16 x 16 display while running:
+    python -m toy display [file]
+  or, to run in a full-screen debugger (F5 run, F6 pause, F7 step):
+    python -m toy debug [file]
+  or, to run and report a pipeline timing estimate:
+    python -m toy time [file]
+  or, to run through a cache (by default 32 words in 4 word lines,
+  direct mapped and lru, or lru, fifo or random), reporting hits and
+  misses at each address (with separate instruction and data caches
+  if --split):
+    python -m toy cache [file] [size] [line] [ways] [policy] [--split]
+  or, to run and attribute run time to lines of assembly (optionally
+  saving the formatted assembly with a heat column to html):
+    python -m toy profile [file] [html]
+  or, to run the test cases in each [name].test.json found in the
+  given files or directories (optionally updating expected outputs,
+  serving metrics on a localhost port and writing them to JSON at exit):
+    python -m toy test [path ...] [--update] [--metrics port]
+      [--metrics-json file]
+  or, to search for shorter machine code for lines of assembly (by
+  default, the assembler's longer expansions), adding what is found
+  to a replacement table that `assemble` can use:
+    python -m toy superoptimize [table] [line ...]
+  or, to compile a program to a Python module (run it with python):
+    python -m toy compile [file] [-o output]
+  or, to format every .asm file in a directory as html (beside each
+  file or below an output directory), skipping unchanged files:
+    python -m toy format [directory] [output]
+  or, to link modules of assembly (each assembled only when changed)
+  and run the program, or save it as machine language:
+    python -m toy link [file ...] [-o output]
+  or, to start a language server for editors (over stdio):
+    python -m toy lsp
+  or, to run a program once for each input from first to last:
+    python -m toy sweep [file] [first] [last] [max steps]
   """
-        )
+            )
@@ -0,0 +1,408 @@
+from math import gcd
+from typing import Callable
+
+from .image import ProgramImage
+from .toy_computer import ToyComputer
+
+# Register operations by opcode.
+operations: dict[int, Callable[[int, int], int]] = {
+    0x1: lambda a, b: (a + b) % 0x10000,
+    0x2: lambda a, b: (a - b) % 0x10000,
+    0x3: lambda a, b: a & b,
+    0x4: lambda a, b: a ^ b,
+    0x5: lambda a, b: (a << b) & 0xFFFF,
+    0x6: lambda a, b: (a >> b) & 0xFFFF,
+}
+
+# Symbolic register values in a loop iteration: a constant ("c", value),
+# a register's value at the start of the iteration plus an offset
+# ("l", register, offset) or such a value xor a constant
+# ("x", register, offset, constant).
+Symbol = tuple
+
+
+class Unsupported(Exception):
+    pass
+
+
+def first_exit(a: int, k: int, exit_on_zero: bool) -> int | None:
+    """
+    Returns the first i >= 0 for which a test of (a + i k) mod 0x10000
+    exits the loop, or None if it never does.
+    """
+    a, k = a % 0x10000, k % 0x10000
+    if not exit_on_zero:
+        return 0 if a else (1 if k else None)
+    if not k:
+        return 0 if not a else None
+    g = gcd(k, 0x10000)
+    if a % g:
+        return None
+    m = 0x10000 // g
+    return (-(a // g) * pow(k // g, -1, m)) % m
+
+
+def symbolic(op: int, a: Symbol, b: Symbol) -> Symbol:
+    """
+    Applies a register operation to symbolic values.
+    """
+    match op, a, b:
+        case _, ("c", x), ("c", y):
+            return ("c", operations[op](x, y))
+        case (0x1, ("l", r, offset), ("c", y)) | (0x1, ("c", y), ("l", r, offset)):
+            return ("l", r, (offset + y) % 0x10000)
+        case 0x2, ("l", r, offset), ("c", y):
+            return ("l", r, (offset - y) % 0x10000)
+        case 0x2, ("l", r, x), ("l", q, y) if r == q:
+            return ("c", (x - y) % 0x10000)
+        case (0x4, ("l", r, offset), ("c", k)) | (0x4, ("c", k), ("l", r, offset)):
+            return ("x", r, offset, k)
+        case (0x4, ("x", r, offset, k), ("c", y)) | (
+            0x4,
+            ("c", y),
+            ("x", r, offset, k),
+        ):
+            return ("x", r, offset, k ^ y)
+    raise Unsupported()
+
+
+class FusedToyComputer(ToyComputer):
+    """
+    A computer that recognizes sequences the assembler emits over and
+    over and executes each as a single operation:
+
+    * building a word in a register (`R[d] <- hi`, `R[F] <- 8`,
+      `R[d] <- R[d] << R[F]`, `R[F] <- lo`, `R[d] <- R[d] + R[F]`),
+    * `mv` (`R[d] <- 0`, `R[d] <- R[d] + R[s]`),
+    * `jmp` (`R[F] <- addr`, `PC <- R[F]`) and
+    * `or` (two operations into R[E] and R[F], then
+      `R[d] <- R[E] ^ R[F]`).
+
+    Sequences are found when state is set (or `fuse` is called). A
+    fused sequence is only used when execution reaches its first word
+    and none of its words have changed since; otherwise (including
+    when jumping into the middle of a sequence) instructions are
+    executed one at a time as usual. The step count is as if each
+    instruction were executed separately.
+
+    With `fast_forward`, simple counted loops are also recognized: loops
+    of register operations and loads (no stores, input or output) that
+    end with a `jp`/`jz` (or `jmp`) back to their start, in which each
+    register read before it is written changes by a loop invariant
+    amount. When such a loop is entered, the number of iterations before
+    one of its tests exits is solved for and the registers are set as
+    they would be after that many iterations in one step.
+    `skipped_iterations` counts the iterations skipped in this way.
+    """
+
+    def __init__(self, banked: bool = False, fast_forward: bool = False) -> None:
+        super().__init__(banked)
+        self.fused = dict[int, tuple[list[int], Callable[[], None]]]()
+        # Addresses at which a fused sequence or loop starts.
+        self.entries = set[int]()
+        self.fast_forward = fast_forward
+        self.loops = dict[int, list[list[int]]]()
+        self.unsupported = set[tuple[int, int]]()
+        self.loop_stats = dict[tuple[int, int], tuple[int, int]]()
+        self.resume = (-1, -1)
+        self.skipped_iterations = 0
+        self.step_limit: int | None = None
+
+    def fuse(self) -> None:
+        """
+        Finds fusable sequences in memory.
+        """
+        self.fused = {}
+        memory = self.memory
+        pc = 0
+        while pc < 0x100:
+            for length, build in (
+                (5, self.fuse_word),
+                (2, self.fuse_move),
+                (2, self.fuse_jump),
+                (3, self.fuse_or),
+            ):
+                words = memory[pc : pc + length]
+                if len(words) == length and (execute := build(pc, *words)):
+                    self.fused[pc] = (words, execute)
+                    pc += length
+                    break
+            else:
+                pc += 1
+        if self.fast_forward:
+            self.find_loops()
+        self.entries = {*self.fused, *self.loops}
+
+    def find_loops(self) -> None:
+        """
+        Finds candidate counted loops: runs of register operations and
+        loads ending with a branch back to their start. Loops sharing a
+        start are tried innermost first.
+        """
+        self.loops = {}
+        self.unsupported = set[tuple[int, int]]()
+        self.loop_stats = {}
+        memory = self.memory
+        for end in range(0x100):
+            op, _, _, _, addr = ToyComputer.decode(memory[end])
+            if op in (0xC, 0xD):
+                start = addr
+            elif op == 0xE and end > 0 and memory[end - 1] & 0xF000 == 0x7000:
+                start = memory[end - 1] & 0xFF
+            else:
+                continue
+            if start <= end and all(
+                (w & 0xF000) >> 12 in (1, 2, 3, 4, 5, 6, 7, 8, 0xA, 0xC, 0xD)
+                for w in memory[start:end]
+            ):
+                self.loops.setdefault(start, []).append(memory[start : end + 1])
+
+    def skip_loop(self, start: int, words: list[int]) -> int:
+        """
+        Skips as many whole iterations of the loop at `start` as can be
+        taken before it exits, returning the number skipped. Raises
+        `Unsupported` if the loop is not a simple counted loop.
+        """
+        registers, memory = self.registers, self.memory
+        end = start + len(words) - 1
+        # Registers read before they are written in an iteration must
+        # be induction variables; other registers read are invariant.
+        written = set[int]()
+        for w in words:
+            op, d, _, _, _ = ToyComputer.decode(w)
+            if op in (1, 2, 3, 4, 5, 6, 7, 8, 0xA):
+                written.add(d)
+        values: dict[int, Symbol] = {}
+        tests = list[tuple[Symbol, bool]]()
+
+        def read(r: int) -> Symbol:
+            if r in values:
+                return values[r]
+            return ("l", r, 0) if r in written else ("c", registers[r])
+
+        def load(address: Symbol) -> Symbol:
+            if address[0] != "c" or (address[1] & 0xFF) >= 0xF0:
+                raise Unsupported()
+            return ("c", memory[address[1] & 0xFF])
+
+        for address, w in enumerate(words, start):
+            op, d, s, t, addr = ToyComputer.decode(w)
+            match op:
+                case 0x7:
+                    values[d] = ("c", addr)
+                case 0x8:
+                    values[d] = load(("c", addr))
+                case 0xA:
+                    values[d] = load(read(t))
+                case 0xC | 0xD if address == end:
+                    # Back edge: jz continues on zero, jp on non-zero.
+                    tests.append((read(d), op == 0xD))
+                case 0xC | 0xD:
+                    if start <= addr <= end:
+                        raise Unsupported()
+                    tests.append((read(d), op == 0xC))
+                case 0xE if address == end:
+                    if read(d) != ("c", start):
+                        raise Unsupported()
+                case _:
+                    values[d] = symbolic(op, read(s), read(t))
+
+        steps = {}
+        for r in written:
+            if r not in values:
+                continue
+            value = values[r]
+            if value[0] == "l" and value[1] == r:
+                steps[r] = value[2]
+        iterations = None
+        for value, exit_on_zero in tests:
+            match value:
+                case ("c", v):
+                    n = first_exit(v, 0, exit_on_zero)
+                case ("l", r, offset) if r in steps:
+                    n = first_exit(registers[r] + offset, steps[r], exit_on_zero)
+                case ("x", r, offset, k) if r in steps and exit_on_zero:
+                    n = first_exit(registers[r] + offset - k, steps[r], True)
+                case _:
+                    raise Unsupported()
+            if n is not None and (iterations is None or n < iterations):
+                iterations = n
+        for value in values.values():
+            if value[0] in ("l", "x") and value[1] not in steps:
+                raise Unsupported()
+
+        if self.step_limit is not None:
+            budget = (self.step_limit - self.steps) // len(words)
+            iterations = budget if iterations is None else min(iterations, budget)
+        if iterations is None or iterations < 2:
+            return 0
+
+        # Registers at the start of the last skipped iteration.
+        last = {
+            r: (registers[r] + (iterations - 1) * k) % 0x10000
+            for r, k in steps.items()
+        }
+        for r, value in values.items():
+            match value:
+                case ("c", v):
+                    registers[r] = v
+                case ("l", b, offset):
+                    registers[r] = (last[b] + offset) % 0x10000
+                case ("x", b, offset, k):
+                    registers[r] = ((last[b] + offset) % 0x10000) ^ k
+        self.steps += iterations * len(words)
+        self.skipped_iterations += iterations
+        return iterations
+
+    def fuse_word(
+        self, pc: int, a: int, b: int, c: int, d: int, e: int
+    ) -> Callable[[], None] | None:
+        r = (a & 0x0F00) >> 8
+        if (
+            a & 0xF000 != 0x7000
+            or r == 0xF
+            or b != 0x7F08
+            or c != 0x500F | (r << 8) | (r << 4)
+            or d & 0xFF00 != 0x7F00
+            or e != 0x100F | (r << 8) | (r << 4)
+        ):
+            return None
+        value = (((a & 0xFF) << 8) + (d & 0xFF)) & 0xFFFF
+        low, after = d & 0xFF, pc + 5
+
+        def execute() -> None:
+            self.registers[r] = value
+            self.registers[0xF] = low
+            self.pc = after
+
+        return execute
+
+    def fuse_move(self, pc: int, a: int, b: int) -> Callable[[], None] | None:
+        d = (a & 0x0F00) >> 8
+        if a != 0x7000 | (d << 8) or b & 0xFFF0 != 0x1000 | (d << 8) | (d << 4):
+            return None
+        s, after = b & 0xF, pc + 2
+
+        def execute() -> None:
+            self.registers[d] = 0 if s == d else self.registers[s]
+            self.pc = after
+
+        return execute
+
+    def fuse_jump(self, pc: int, a: int, b: int) -> Callable[[], None] | None:
+        if a & 0xFF00 != 0x7F00 or b != 0xEF00:
+            return None
+        addr = a & 0xFF
+
+        def execute() -> None:
+            self.registers[0xF] = addr
+            self.pc = addr
+
+        return execute
+
+    def fuse_or(self, pc: int, a: int, b: int, c: int) -> Callable[[], None] | None:
+        first, second = ToyComputer.decode(a), ToyComputer.decode(b)
+        if (
+            first[0] not in (0x3, 0x4)
+            or second[0] not in (0x3, 0x4)
+            or {first[1], second[1]} != {0xE, 0xF}
+            or c & 0xF0FF != 0x40EF
+        ):
+            return None
+        steps = [
+            (operations[op], d, s, t)
+            for op, d, s, t, _ in (first, second, ToyComputer.decode(c))
+        ]
+        after = pc + 3
+
+        def execute() -> None:
+            registers = self.registers
+            for operation, d, s, t in steps:
+                registers[d] = operation(registers[s], registers[t])
+            self.pc = after
+
+        return execute
+
+    def give_up(self, key: tuple[int, int]) -> None:
+        """
+        Stops trying a loop, and its start address if nothing else
+        starts there.
+        """
+        self.unsupported.add(key)
+        pc = key[0]
+        if pc not in self.fused and all(
+            (pc, len(loop)) in self.unsupported for loop in self.loops[pc]
+        ):
+            self.entries.discard(pc)
+
+    def try_loop(self, pc: int, loop: list[int]) -> bool:
+        """
+        Tries to skip iterations of a candidate loop starting at `pc`.
+        """
+        key = (pc, len(loop))
+        if key in self.unsupported or self.memory[pc : pc + len(loop)] != loop:
+            return False
+        try:
+            skipped = self.skip_loop(pc, loop)
+        except Unsupported:
+            self.give_up(key)
+            return False
+        # Stop trying loops that rarely run long enough to pay for the
+        # analysis.
+        attempts, total = self.loop_stats.get(key, (0, 0))
+        attempts, total = attempts + 1, total + skipped
+        self.loop_stats[key] = (attempts, total)
+        if attempts >= 0x10 and total < 8 * attempts:
+            self.give_up(key)
+        if skipped:
+            # The rest of the last iteration is stepped as usual.
+            self.resume = (pc, self.steps)
+        return skipped > 0
+
+    def step(self) -> bool:
+        pc = self.pc
+        if pc not in self.entries or self.interrupt_at is not None:
+            # Fused sequences would run past a timer interrupt.
+            return super().step()
+        loops = self.loops.get(pc)
+        if loops is not None and self.resume != (pc, self.steps):
+            for loop in loops:
+                if self.try_loop(pc, loop):
+                    return True
+        fused = self.fused.get(pc)
+        if fused is not None:
+            words, execute = fused
+            if self.memory[pc : pc + len(words)] == words and (
+                self.step_limit is None or self.steps + len(words) <= self.step_limit
+            ):
+                execute()
+                self.steps += len(words)
+                return (self.memory[self.pc] & 0xF000) != 0
+        return super().step()
+
+    def run(self, max_steps: int | None = None) -> bool:
+        self.step_limit = None if max_steps is None else self.steps + max_steps
+        try:
+            return super().run(max_steps)
+        finally:
+            self.step_limit = None
+
+    def set_state(
+        self,
+        pc: int,
+        ram: list[int] | ProgramImage,
+        registers: list[int] = [],
+        banks: dict[int, list[int]] = {},
+        coprocessor: bool = False,
+        dma: bool = False,
+        timer: bool = False,
+        polling: bool = False,
+    ) -> None:
+        super().set_state(
+            pc, ram, registers, banks, coprocessor, dma, timer, polling
+        )
+        self.fuse()
+
+    def select_bank(self, bank: int) -> None:
+        super().select_bank(bank)
+        self.fuse()
@@ -1,7 +1,13 @@
-from dataclasses import dataclass
-from re import compile, match
+from array import array
+from dataclasses import dataclass, field
+from pathlib import Path
+from re import compile
+from sys import byteorder
+from typing import Iterator
 
 from .exception import ToyException
+from .superoptimizer import ReplacementTable
+from .toy_computer import BANK_SIZE, BANK_START
 
 
 def pat(s: str) -> str:
@@ -62,12 +68,14 @@ expressions = {
     "ret d": compile(f"^ret{pat("register")}$"),
     # Special
     ".main": compile(r"^\.main$"),
+    ".bank": compile(r"^\.bank *([a-z][a-z0-9_]*)? *$"),
     ".word": compile(r"^\.word$"),
     ".dump": compile(r"^\.dump$"),
     ".line": compile(r"^\.line$"),
     ".state": compile(r"^\.state$"),
     ".data": compile(r"^\.data *(.*)$"),
     ".ascii": compile(r'^\.ascii *"([^"]*)" *$'),
+    ".incbin": compile(r'^\.incbin *"([^"]*)" *(words|bytes)? *$'),
     ".char": compile(r"^\.char" + pat("register") + "$"),
     ".bin": compile(r"\.bin" + pat("register") + "$"),
     ".oct": compile(r"^\.oct" + pat("register") + "$"),
@@ -75,11 +83,166 @@ expressions = {
     ".hex": compile(r"^\.hex" + pat("register") + "$"),
     ".pattern": compile(r"^\.pattern" + pat("register") + "$"),
     ".input": compile(r"^\.input" + pat("register") + "$"),
+    ".ready": compile(r"^\.ready" + pat("register") + "$"),
+    ".poll": compile(r"^\.poll" + pat("register") + "$"),
     ".string": compile(r"^\.string" + pat("register") + "$"),
     ".rand": compile(r"^\.rand" + pat("register") + "$"),
+    ".coprocessor": compile(r"^\.coprocessor$"),
+    ".global": compile(f"^\\.global{pat("label")}$"),
+    ".extern": compile(f"^\\.extern{pat("label")}$"),
+    ".memcpy": compile(r"^\.memcpy" + pat("register") * 3 + "$"),
+    ".memset": compile(r"^\.memset" + pat("register") * 3 + "$"),
+    ".timer": compile(r"^\.timer" + pat("register") * 2 + "$"),
 }
 
 
+# Names (which cannot clash with labels) for what the assembler places
+# after the main program when needed: the three words of the transfer
+# descriptor used by `.memcpy` and `.memset`, the two argument words of
+# the multiply and divide routines and the routines themselves.
+DESCRIPTOR = (".dma", ".dma+1", ".dma+2")
+ARGUMENTS = (".args", ".args+1")
+MULTIPLY, DIVIDE = ".mul", ".div"
+
+# Coprocessor result addresses of the arithmetic pseudo-instructions.
+arithmetic_map = {
+    "mul": 0xFC,
+    "div": 0xFD,
+    "mod": 0xFE,
+}
+
+
+def save(registers: range, at: int) -> list[int]:
+    # M[at + i] <- R[r]
+    return [0x9000 | (r << 8) | (at + i) for i, r in enumerate(registers)]
+
+
+def restore(registers: range, at: int) -> list[int]:
+    # R[r] <- M[at + i]
+    return [0x8000 | (r << 8) | (at + i) for i, r in enumerate(registers)]
+
+
+def multiply_routine(start: int, arguments: int, saved: int) -> list[int]:
+    """
+    Shift and add multiplication of the two argument words, leaving the
+    product in R[E] and returning to R[F].
+    """
+    used = range(4)
+    loop = start + 8
+    skip, done = loop + 4, loop + 8
+    return [
+        *save(used, saved),
+        # R[0] <- a; R[1] <- b
+        0x8000 | arguments,
+        0x8100 | arguments + 1,
+        # R[E] <- 0; R[3] <- 1
+        0x7E00,
+        0x7301,
+        # loop: while R[1] != 0
+        0xC100 | done,
+        # if R[1] & 1: R[E] <- R[E] + R[0]
+        0x3213,
+        0xC200 | skip,
+        0x1EE0,
+        # skip: R[0] <- R[0] << 1; R[1] <- R[1] >> 1
+        0x5003,
+        0x6113,
+        0x7200,
+        0xC200 | loop,
+        # done:
+        *restore(used, saved),
+        0xEF00,
+    ]
+
+
+def divide_routine(start: int, arguments: int, saved: int) -> list[int]:
+    """
+    Shift and subtract division of the first argument word by the
+    second, leaving the quotient in R[E] and the remainder in the first
+    argument word and returning to R[F]. Dividing by zero gives a
+    quotient of FFFF and a remainder of the dividend.
+    """
+    used = range(7)
+    loop = start + 11
+    take = loop + 20
+    next, equal = take + 3, take - 3
+    return [
+        *save(used, saved),
+        # R[0] <- n (shifted out into the quotient); R[1] <- divisor
+        0x8000 | arguments,
+        0x8100 | arguments + 1,
+        # R[2] <- 0 (remainder); R[3] <- 16 (bits left)
+        0x7200,
+        0x7310,
+        # loop: R[4] <- carry out of R[2]; R[5] <- top bit of R[0]
+        0x7E0F,
+        0x642E,
+        0x650E,
+        # R[2]:R[0] <- R[2]:R[0] << 1
+        0x7E01,
+        0x522E,
+        0x1225,
+        0x500E,
+        # R[5] <- R[2] - R[1]
+        0x2521,
+        # carry: the remainder exceeds the divisor
+        0xD400 | take,
+        # R[4] <- (R[2] >> 1) - (R[1] >> 1)
+        0x642E,
+        0x661E,
+        0x2446,
+        0xC400 | equal,
+        # halves differ: R[2] < R[1] if the difference is negative
+        0x7E0F,
+        0x644E,
+        0xD400 | next,
+        0xC400 | take,
+        # equal: R[2] < R[1] if R[2] - R[1] is negative
+        0x7E0F,
+        0x645E,
+        0xD400 | next,
+        # take: R[2] <- R[2] - R[1]; R[0] <- R[0] + 1
+        0x2221,
+        0x7E01,
+        0x100E,
+        # next: R[3] <- R[3] - 1
+        0x7E01,
+        0x233E,
+        0xD300 | loop,
+        # R[E] <- quotient; M[arguments] <- remainder
+        0x7E00,
+        0x1EE0,
+        0x9200 | arguments,
+        *restore(used, saved),
+        0xEF00,
+    ]
+
+
+def runtime(start: int, referenced: set[str]) -> tuple[list[int], dict[str, int]]:
+    """
+    Returns the words to be placed at `start` (after the main program)
+    for the names in `referenced`, with the address of each name.
+    """
+    words = list[int]()
+    labels = dict[str, int]()
+    if any(name in referenced for name in DESCRIPTOR):
+        for name in DESCRIPTOR:
+            labels[name] = start + len(words)
+            words.append(0)
+    if MULTIPLY in referenced or DIVIDE in referenced:
+        arguments = start + len(words)
+        for name in ARGUMENTS:
+            labels[name] = start + len(words)
+            words.append(0)
+        saved = start + len(words)
+        words.extend(0 for _ in range(7))
+        for name, routine in ((MULTIPLY, multiply_routine), (DIVIDE, divide_routine)):
+            if name in referenced:
+                labels[name] = start + len(words)
+                words.extend(routine(labels[name], arguments, saved))
+    return words, labels
+
+
 def store_word_to(d: int, value: int) -> list[int]:
     s, t = (value & 0xFF00) >> 8, value & 0x00FF
     return [
@@ -119,19 +282,32 @@ def parse_value(v: str) -> int:
 
 def pieces(line: str, splitter: str) -> list[str]:
     """Splits by splitter if splitter not part of a string."""
-    result = list[str]()
-    split = True
-    start = 0
-    for i, c in enumerate(line):
-        if c == '"':
-            split = not split
-            continue
-        if split and c == splitter:
-            result.append(line[start:i].strip())
-            start = i + 1
-    else:
-        result.append(line[start : len(line)].strip())
-    return result
+    # Even segments lie outside strings, odd segments inside.
+    result = [""]
+    for i, segment in enumerate(line.split('"')):
+        if i:
+            result[-1] += '"'
+        if i % 2:
+            result[-1] += segment
+        else:
+            first, *rest = segment.split(splitter)
+            result[-1] += first
+            result.extend(rest)
+    return [x.strip() for x in result]
+
+
+@dataclass
+class SourceLocation:
+    """
+    Where a word of assembled code came from: the (1-based) number and
+    text of its source line, the most recent label and the position of
+    the word in the line's expansion.
+    """
+
+    line: int
+    text: str
+    label: str | None
+    offset: int
 
 
 @dataclass
@@ -140,533 +316,872 @@ class Assembled:
     pc: int
     words: list[int]
     address_mappings: dict[str, int]
-
-
-def assemble(code: str, show_addresses=True) -> Assembled:
+    banks: dict[int, list[int]] = field(default_factory=dict)
+    # Keyed by (bank, address), with bank 0 for main memory.
+    source_map: dict[tuple[int, int], SourceLocation] = field(default_factory=dict)
+    coprocessor: bool = False
+    dma: bool = False
+    timer: bool = False
+    polling: bool = False
+
+    @property
+    def devices(self) -> dict[str, bool]:
+        """
+        The optional devices the program uses, as keyword arguments for
+        `ToyComputer.set_state`.
+        """
+        return {
+            "coprocessor": self.coprocessor,
+            "dma": self.dma,
+            "timer": self.timer,
+            "polling": self.polling,
+        }
+
+
+def translate(
+    line: str, coprocessor=False
+) -> tuple[list[int], list[tuple[int, str]]]:
+    """
+    Translates a line of assembly (other than a label, `.bank` or
+    `.main`) into machine code, returning the words and, for each
+    reference to a label, the index of the word to be completed with
+    the label's address and the label. If `coprocessor`, `mul`, `div`
+    and `mod` use the arithmetic coprocessor rather than routines
+    added after the program.
+    """
     machine_code = list[int]()
-    pc = 0
-    lines = list[str]()
-
-    for line in [
-        stripped
-        for line in code.splitlines()
-        if (stripped := pieces(line, ";")[0].strip())
-    ]:
-        if ":" in line:
-            try:
-                label, content = pieces(line, ":")
-                lines.append(label.strip() + ":")
-                if content.strip():
-                    lines.append(content.strip())
-            except ValueError:
-                raise ToyException(f"Label error: {line}")
-        else:
-            lines.append(line)
+    references = list[tuple[int, str]]()
+    expression_found = False
 
-    labels = dict[str, int]()
-    addresses = dict[str, list[int]]()
+    def refer_to(label: str) -> None:
+        references.append((len(machine_code), label))
 
     def write_to_special(addr: int, r=0) -> None:
         machine_code.append(0x9000 | addr | (r << 8))
 
-    for line in lines:
-        expression_found = False
-
-        m = expressions["label"].match(line)
-        if m:
-            label = m.group(1)
-            if label in labels:
-                raise ToyException(f"Duplicate label: '{label}'.")
-            labels[label] = len(machine_code)
-            continue
-
-        m = expressions[".data"].match(line)
-        if m:
-            machine_code.extend(
-                [parse_value(v) & 0xFFFF for v in m.group(1).split(",")]
-            )
-            continue
-
-        m = expressions[".ascii"].match(line)
-        if m:
-
-            def append_ascii(string: str) -> None:
-                if string:
-                    if len(string) > 2 and string[:2] == r"\0":
-                        machine_code.append(0)
-                        append_ascii(string[2:])
-                    else:
-                        first, rest = string[0], string[1:]
-                        machine_code.append(ord(first) & 0xFF)
-                        append_ascii(rest)
-
-            append_ascii(m.group(1))
-            machine_code.append(0)
-            continue
-
-        for special, addr in {
-            ".char": 0xF5,
-            ".bin": 0xF1,
-            ".oct": 0xF2,
-            ".den": 0xF4,
-            ".hex": 0xF3,
-            ".pattern": 0xF7,
-        }.items():
-            m = expressions[special].match(line)
-            if m:
-                d = parse_register(m.group(1))
-                write_to_special(addr, d)
-                expression_found = True
-                break
-
-        if expression_found:
-            continue
-
-        for special, addr in {
-            ".input": 0xF0,
-            ".rand": 0xFA,
-            ".string": 0xFB,
-        }.items():
-            m = expressions[special].match(line)
-            if m:
-                d = parse_register(m.group(1))
-                machine_code.append(
-                    # R[d] <- input source
-                    0x8000 | (d << 8) | addr
-                )
-                expression_found = True
-
-        if expression_found:
-            continue
-
-        m = expressions[".main"].match(line)
-        if m:
-            pc = len(machine_code)
-            continue
-
-        m = expressions[".word"].match(line)
-        if m:
-            machine_code.append(0x0000)
-            continue
-
-        for special, addr in {
-            ".dump": 0xF8,
-            ".line": 0xF6,
-            ".state": 0xF9,
-        }.items():
-            m = expressions[special].match(line)
-            if m:
-                write_to_special(addr)
-                expression_found = True
-                break
-
-        if expression_found:
-            continue
-
-        m = expressions["halt"].match(line)
-        if m:
-            machine_code.append(0x0000)
-            continue
-
-        m = expressions["not d t"].match(line)
-        if m:
-            d = parse_register(m.group(1))
-            s = parse_register(m.group(2))
+    def arithmetic(op: str, d: int, s: int, t: int) -> None:
+        if coprocessor:
             machine_code.extend(
                 [
-                    *store_word_to(
-                        0xE,
-                        0xFFFF,
-                    ),
-                    # R[d] <- R[s] ^ R[E]
-                    0x400E | (d << 8) | (s << 4),
+                    # M[FC] <- R[s]; M[FD] <- R[t]
+                    0x90FC | (s << 8),
+                    0x90FD | (t << 8),
+                    # R[d] <- result
+                    0x8000 | (d << 8) | arithmetic_map[op],
                 ]
             )
-            continue
-
-        m = expressions["not d v"].match(line)
-        if m:
-            d = parse_register(m.group(1))
-            v = parse_value(m.group(2))
-            if v <= 0xFF:
-                machine_code.append(
-                    # R[D] <- v
-                    0x7D00 | v,
-                )
-            else:
-                machine_code.extend(
-                    store_word_to(0xD, v),
-                )
-
+            return
+        for name, r in zip(ARGUMENTS, (s, t)):
+            refer_to(name)
+            machine_code.append(
+                # M[argument] <- R[r]
+                0x9000 | (r << 8),
+            )
+        refer_to(MULTIPLY if op == "mul" else DIVIDE)
+        machine_code.append(
+            # R[F] <- PC; PC <- routine
+            0xFF00,
+        )
+        if op == "mod":
+            refer_to(ARGUMENTS[0])
+            machine_code.append(
+                # R[d] <- remainder
+                0x8000 | (d << 8),
+            )
+        elif d != 0xE:
             machine_code.extend(
                 [
-                    *store_word_to(
-                        0xE,
-                        0xFFFF,
-                    ),
-                    # R[d] <- R[D] ^ R[E]
-                    0x40DE | (d << 8),
+                    # R[d] <- 0
+                    0x7000 | (d << 8),
+                    # R[d] <- R[d] + R[E]
+                    0x100E | (d << 8) | (d << 4),
                 ]
             )
-            continue
 
-        m = expressions["load d l"].match(line)
+    m = expressions[".data"].match(line)
+    if m:
+        machine_code.extend(
+            [parse_value(v) & 0xFFFF for v in m.group(1).split(",")]
+        )
+        return machine_code, references
+
+    m = expressions[".ascii"].match(line)
+    if m:
+        # Each \0 stands for a zero word, unless it ends the string.
+        string, tail = m.group(1), ""
+        if string.endswith(r"\0"):
+            string, tail = string[:-2], r"\0"
+        for i, part in enumerate(string.split(r"\0")):
+            if i:
+                machine_code.append(0)
+            machine_code.extend(ord(c) & 0xFF for c in part)
+        machine_code.extend(ord(c) for c in tail)
+        machine_code.append(0)
+        return machine_code, references
+
+    for special, addr in {
+        ".char": 0xF5,
+        ".bin": 0xF1,
+        ".oct": 0xF2,
+        ".den": 0xF4,
+        ".hex": 0xF3,
+        ".pattern": 0xF7,
+    }.items():
+        m = expressions[special].match(line)
+        if m:
+            d = parse_register(m.group(1))
+            write_to_special(addr, d)
+            expression_found = True
+            break
+
+    if expression_found:
+        return machine_code, references
+
+    for special, addr in {
+        ".input": 0xF0,
+        ".ready": 0xF1,
+        ".poll": 0xF2,
+        ".rand": 0xFA,
+        ".string": 0xFB,
+    }.items():
+        m = expressions[special].match(line)
         if m:
             d = parse_register(m.group(1))
-            label = m.group(2)
-            if label not in addresses:
-                addresses[label] = []
-            addresses[label].append(len(machine_code))
             machine_code.append(
-                # R[d] <- ??
-                0x7000 | (d << 8),
+                # R[d] <- input source
+                0x8000 | (d << 8) | addr
             )
-            continue
+            expression_found = True
 
-        m = expressions["load d v"].match(line)
-        if m:
-            d = parse_register(m.group(1))
-            addr = parse_value(m.group(2))
+    if expression_found:
+        return machine_code, references
 
-            if addr <= 0xFF:
+    for special, addr in {
+        ".memcpy": 0xFA,
+        ".memset": 0xFB,
+    }.items():
+        m = expressions[special].match(line)
+        if m:
+            d, s, n = (parse_register(m.group(g)) for g in (1, 2, 3))
+            for name, r in zip(DESCRIPTOR, (s, d, n)):
+                refer_to(name)
                 machine_code.append(
-                    # R[d] <- v
-                    0x7000 | (d << 8) | addr,
+                    # M[descriptor + i] <- R[r]
+                    0x9000 | (r << 8),
                 )
-                continue
-
+            refer_to(DESCRIPTOR[0])
             machine_code.extend(
                 [
-                    *store_word_to(0xE, addr),
-                    # R[d] <- 0
-                    0x7000 | (d << 8),
-                    # R[d] <- R[d] + R[E]
-                    0x100E | (d << 8) | (d << 4),
+                    # R[E] <- descriptor
+                    0x7E00,
+                    # M[addr] <- R[E] (start transfer)
+                    0x9E00 | addr,
                 ]
             )
-            continue
-
-        m = expressions["load d a"].match(line)
+            return machine_code, references
+
+    m = expressions[".timer"].match(line)
+    if m:
+        n, h = parse_register(m.group(1)), parse_register(m.group(2))
+        machine_code.extend(
+            [
+                # M[FE] <- R[h] (timer handler)
+                0x90FE | (h << 8),
+                # M[F0] <- R[n] (timer interval)
+                0x90F0 | (n << 8),
+            ]
+        )
+        return machine_code, references
+
+    m = expressions[".word"].match(line)
+    if m:
+        machine_code.append(0x0000)
+        return machine_code, references
+
+    for special, addr in {
+        ".dump": 0xF8,
+        ".line": 0xF6,
+        ".state": 0xF9,
+    }.items():
+        m = expressions[special].match(line)
         if m:
-            d = parse_register(m.group(1))
-            addr = parse_value(m.group(2))
+            write_to_special(addr)
+            expression_found = True
+            break
+
+    if expression_found:
+        return machine_code, references
+
+    m = expressions["halt"].match(line)
+    if m:
+        machine_code.append(0x0000)
+        return machine_code, references
+
+    m = expressions["not d t"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        s = parse_register(m.group(2))
+        machine_code.extend(
+            [
+                *store_word_to(
+                    0xE,
+                    0xFFFF,
+                ),
+                # R[d] <- R[s] ^ R[E]
+                0x400E | (d << 8) | (s << 4),
+            ]
+        )
+        return machine_code, references
+
+    m = expressions["not d v"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        v = parse_value(m.group(2))
+        if v <= 0xFF:
             machine_code.append(
-                # R[d] <- addr
-                0x8000 | (d << 8) | (addr & 0xFF),
+                # R[D] <- v
+                0x7D00 | v,
             )
-            continue
-
-        m = expressions["store d la"].match(line)
-        if m:
-            addr = parse_value(m.group(1))
-            s = parse_register(m.group(2))
-            machine_code.append(
-                # M[addr] <- R[s]
-                0x9000 | (s << 8) | (addr & 0xFF),
+        else:
+            machine_code.extend(
+                store_word_to(0xD, v),
             )
-            continue
 
-        m = expressions["load d la"].match(line)
-        if m:
-            d = parse_register(m.group(1))
-            label = m.group(2)
-            if label not in addresses:
-                addresses[label] = []
-            addresses[label].append(len(machine_code))
+        machine_code.extend(
+            [
+                *store_word_to(
+                    0xE,
+                    0xFFFF,
+                ),
+                # R[d] <- R[D] ^ R[E]
+                0x40DE | (d << 8),
+            ]
+        )
+        return machine_code, references
+
+    m = expressions["load d l"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        label = m.group(2)
+        refer_to(label)
+        machine_code.append(
+            # R[d] <- ??
+            0x7000 | (d << 8),
+        )
+        return machine_code, references
+
+    m = expressions["load d v"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        addr = parse_value(m.group(2))
+
+        if addr <= 0xFF:
             machine_code.append(
-                # R[d] <- M[??]
-                0x8000 | (d << 8),
+                # R[d] <- v
+                0x7000 | (d << 8) | addr,
             )
-            continue
+            return machine_code, references
 
-        m = expressions["move d s"].match(line)
-        if m:
-            d, s = (parse_register(m.group(g)) for g in (1, 2))
+        machine_code.extend(
+            [
+                *store_word_to(0xE, addr),
+                # R[d] <- 0
+                0x7000 | (d << 8),
+                # R[d] <- R[d] + R[E]
+                0x100E | (d << 8) | (d << 4),
+            ]
+        )
+        return machine_code, references
+
+    m = expressions["load d a"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        addr = parse_value(m.group(2))
+        machine_code.append(
+            # R[d] <- addr
+            0x8000 | (d << 8) | (addr & 0xFF),
+        )
+        return machine_code, references
+
+    m = expressions["store d la"].match(line)
+    if m:
+        addr = parse_value(m.group(1))
+        s = parse_register(m.group(2))
+        machine_code.append(
+            # M[addr] <- R[s]
+            0x9000 | (s << 8) | (addr & 0xFF),
+        )
+        return machine_code, references
+
+    m = expressions["load d la"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        label = m.group(2)
+        refer_to(label)
+        machine_code.append(
+            # R[d] <- M[??]
+            0x8000 | (d << 8),
+        )
+        return machine_code, references
+
+    m = expressions["move d s"].match(line)
+    if m:
+        d, s = (parse_register(m.group(g)) for g in (1, 2))
+        machine_code.extend(
+            [
+                # R[d] <- 0
+                0x7000 | (d << 8),
+                # R[d] <- R[d] + R[s]
+                0x1000 | (d << 8) | (d << 4) | s,
+            ]
+        )
+        return machine_code, references
+
+    m = expressions["load d p"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        p = parse_register(m.group(2))
+        machine_code.append(
+            # R[d] <- M[R[p]]
+            0xA000 | (d << 8) | p,
+        )
+        return machine_code, references
+
+    m = expressions["store p s"].match(line)
+    if m:
+        p = parse_register(m.group(1))
+        s = parse_register(m.group(2))
+        machine_code.append(
+            # M[R[p]] <- s
+            0xB000 | (s << 8) | p,
+        )
+        return machine_code, references
+
+    m = expressions["store la s"].match(line)
+    if m:
+        label = m.group(1)
+        s = parse_register(m.group(2))
+        refer_to(label)
+        machine_code.append(
+            # M[??] <- R[s]
+            0x9000 | (s << 8),
+        )
+        return machine_code, references
+
+    m = expressions["jz d a"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        addr = parse_value(m.group(2))
+        machine_code.append(
+            # if R[d] == 0 PC <- v
+            0xC000 | (d << 8) | (addr & 0xFF),
+        )
+        return machine_code, references
+
+    m = expressions["jz d l"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        label = m.group(2)
+        refer_to(label)
+        machine_code.append(
+            # if R[d] == 0 PC <- ??
+            0xC000 | (d << 8),
+        )
+        return machine_code, references
+
+    m = expressions["jp d a"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        addr = parse_value(m.group(2))
+        machine_code.append(
+            # if R[d] > 0 PC <- v
+            0xD000 | (d << 8) | (addr & 0xFF),
+        )
+        return machine_code, references
+
+    m = expressions["jp d l"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        label = m.group(2)
+        refer_to(label)
+        machine_code.append(
+            # if R[d] > 0 PC <- ??
+            0xD000 | (d << 8),
+        )
+        return machine_code, references
+
+    m = expressions["jmp a"].match(line)
+    if m:
+        addr = parse_value(m.group(1))
+        machine_code.extend(
+            [
+                # R[F] <- v
+                0x7F00 | (addr & 0xFF),
+                # PC <- R[F]
+                0xEF00,
+            ]
+        )
+        return machine_code, references
+
+    m = expressions["jmp l"].match(line)
+    if m:
+        label = m.group(1)
+        refer_to(label)
+        machine_code.extend(
+            [
+                # R[F] <- ??
+                0x7F00,
+                # PC <- R[F]
+                0xEF00,
+            ]
+        )
+        return machine_code, references
+
+    m = expressions["call d a"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        addr = parse_value(m.group(2))
+        machine_code.append(
+            # R[d] <- PC; PC <- addr
+            0xF000 | (d << 8) | (addr & 0xFF),
+        )
+        return machine_code, references
+
+    m = expressions["call d l"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        label = m.group(2)
+        refer_to(label)
+        machine_code.append(
+            # R[d] <- PC; PC <- ??
+            0xF000 | (d << 8),
+        )
+        return machine_code, references
+
+    m = expressions["ret d"].match(line)
+    if m:
+        d = parse_register(m.group(1))
+        machine_code.append(
+            # PC <- R[d]
+            0xE000 | (d << 8),
+        )
+        return machine_code, references
+
+    m = expressions["op d s t"].match(line)
+    if m:
+        op = m.group(1).lower()
+        d, s, t = (parse_register(m.group(g)) for g in (2, 3, 4))
+        if op == "or":
             machine_code.extend(
                 [
-                    # R[d] <- 0
-                    0x7000 | (d << 8),
-                    # R[d] <- R[d] + R[s]
-                    0x1000 | (d << 8) | (d << 4) | s,
+                    # R[E] <- R[s] & R[t]
+                    0x3E00 | (s << 4) | t,
+                    # R[F] <- R[s] ^ R[t]
+                    0x4F00 | (s << 4) | t,
+                    # R[d] <- R[E] ^ R[F]
+                    0x40EF | (d << 8),
                 ]
             )
-            continue
-
-        m = expressions["load d p"].match(line)
-        if m:
-            d = parse_register(m.group(1))
-            p = parse_register(m.group(2))
+            return machine_code, references
+        if op in op_map:
             machine_code.append(
-                # R[d] <- M[R[p]]
-                0xA000 | (d << 8) | p,
+                # R[d] <- R[s] * R[t]
+                (op_map[op] << 12) | (d << 8) | (s << 4) | t,
             )
-            continue
+            return machine_code, references
+        if op in arithmetic_map:
+            arithmetic(op, d, s, t)
+            return machine_code, references
 
-        m = expressions["store p s"].match(line)
-        if m:
-            p = parse_register(m.group(1))
-            s = parse_register(m.group(2))
+        raise ToyException(f"Unknown operator: '{op}'.")
+
+    m = expressions["op d s v"].match(line)
+    if m:
+        op = m.group(1).lower()
+        d, s = (parse_register(m.group(g)) for g in (2, 3))
+        v = parse_value(m.group(4))
+
+        if v <= 0xFF:
             machine_code.append(
-                # M[R[p]] <- s
-                0xB000 | (s << 8) | p,
+                # R[E] <- v
+                0x7E00 | v,
+            )
+        else:
+            machine_code.extend(
+                store_word_to(0xE, v),
             )
-            continue
 
-        m = expressions["store la s"].match(line)
-        if m:
-            label = m.group(1)
-            s = parse_register(m.group(2))
-            if label not in addresses:
-                addresses[label] = []
-            addresses[label].append(len(machine_code))
-            machine_code.append(
-                # M[??] <- R[s]
-                0x9000 | (s << 8),
+        if op == "or":
+            machine_code.extend(
+                [
+                    # R[F] <- R[E] ^ R[s]
+                    0x4FE0 | s,
+                    # R[E] <- R[E] & R[s]
+                    0x3EE0 | s,
+                    # R[d] <- R[E] ^ R[F]
+                    0x40EF | (d << 8),
+                ]
             )
-            continue
+            return machine_code, references
 
-        m = expressions["jz d a"].match(line)
-        if m:
-            d = parse_register(m.group(1))
-            addr = parse_value(m.group(2))
+        if op in op_map:
             machine_code.append(
-                # if R[d] == 0 PC <- v
-                0xC000 | (d << 8) | (addr & 0xFF),
+                # R[d] <- R[s] * R[E]
+                0x000E | (op_map[op] << 12) | (d << 8) | (s << 4),
             )
-            continue
+            return machine_code, references
+        if op in arithmetic_map:
+            arithmetic(op, d, s, 0xE)
+            return machine_code, references
 
-        m = expressions["jz d l"].match(line)
-        if m:
-            d = parse_register(m.group(1))
-            label = m.group(2)
-            if label not in addresses:
-                addresses[label] = []
-            addresses[label].append(len(machine_code))
-            machine_code.append(
-                # if R[d] == 0 PC <- ??
-                0xC000 | (d << 8),
+        raise ToyException(f"Unknown operator: '{op}'.")
+
+    m = expressions["op d s"].match(line)
+    if m:
+        op = m.group(1).lower()
+        d, s = (parse_register(m.group(g)) for g in (2, 3))
+
+        if op == "or":
+            machine_code.extend(
+                [
+                    # R[E] <- R[d] & R[s]
+                    0x3E00 | (d << 4) | s,
+                    # R[F] <- R[d] ^ R[s]
+                    0x4F00 | (d << 4) | s,
+                    # R[d] <- R[E] ^ R[F]
+                    0x40EF | (d << 8),
+                ]
             )
-            continue
+            return machine_code, references
 
-        m = expressions["jp d a"].match(line)
-        if m:
-            d = parse_register(m.group(1))
-            addr = parse_value(m.group(2))
+        if op in op_map:
             machine_code.append(
-                # if R[d] > 0 PC <- v
-                0xD000 | (d << 8) | (addr & 0xFF),
+                # R[d] <- R[d] * R[s]
+                (op_map[op] << 12) | (d << 8) | (d << 4) | s,
             )
-            continue
+            return machine_code, references
+        if op in arithmetic_map:
+            arithmetic(op, d, d, s)
+            return machine_code, references
 
-        m = expressions["jp d l"].match(line)
-        if m:
-            d = parse_register(m.group(1))
-            label = m.group(2)
-            if label not in addresses:
-                addresses[label] = []
-            addresses[label].append(len(machine_code))
+        raise ToyException(f"Unknown operator: '{op}'.")
+
+    m = expressions["op d v"].match(line)
+    if m:
+        op = m.group(1).lower()
+        d = parse_register(m.group(2))
+        v = parse_value(m.group(3))
+
+        if v <= 0xFF:
             machine_code.append(
-                # if R[d] > 0 PC <- ??
-                0xD000 | (d << 8),
+                # R[E] <- v
+                0x7E00 | v,
             )
-            continue
-
-        m = expressions["jmp a"].match(line)
-        if m:
-            addr = parse_value(m.group(1))
+        else:
             machine_code.extend(
-                [
-                    # R[F] <- v
-                    0x7F00 | (addr & 0xFF),
-                    # PC <- R[F]
-                    0xEF00,
-                ]
+                store_word_to(0xE, v),
             )
-            continue
 
-        m = expressions["jmp l"].match(line)
-        if m:
-            label = m.group(1)
-            if label not in addresses:
-                addresses[label] = []
-            addresses[label].append(len(machine_code))
+        if op == "or":
             machine_code.extend(
                 [
-                    # R[F] <- ??
-                    0x7F00,
-                    # PC <- R[F]
-                    0xEF00,
+                    # R[F] <- R[E] ^ R[d]
+                    0x4FE0 | d,
+                    # R[E] <- R[E] & R[d]
+                    0x3EE0 | d,
+                    # R[d] <- R[E] ^ R[F]
+                    0x40EF | (d << 8),
                 ]
             )
-            continue
+            return machine_code, references
 
-        m = expressions["call d a"].match(line)
-        if m:
-            d = parse_register(m.group(1))
-            addr = parse_value(m.group(2))
+        if op in op_map:
             machine_code.append(
-                # R[d] <- PC; PC <- addr
-                0xF000 | (d << 8) | (addr & 0xFF),
+                # R[d] <- R[d] * R[E]
+                0x000E | (op_map[op] << 12) | (d << 8) | (d << 4),
             )
-            continue
+            return machine_code, references
+        if op in arithmetic_map:
+            arithmetic(op, d, d, 0xE)
+            return machine_code, references
 
-        m = expressions["call d l"].match(line)
-        if m:
-            d = parse_register(m.group(1))
-            label = m.group(2)
-            if label not in addresses:
-                addresses[label] = []
-            addresses[label].append(len(machine_code))
-            machine_code.append(
-                # R[d] <- PC; PC <- ??
-                0xF000 | (d << 8),
-            )
-            continue
+        raise ToyException(f"Unknown operator: '{op}'.")
 
-        m = expressions["ret d"].match(line)
-        if m:
-            d = parse_register(m.group(1))
-            machine_code.append(
-                # PC <- R[d]
-                0xE000 | (d << 8),
-            )
-            continue
+    raise ToyException(f"Cannot parse line: '{line}'")
 
-        m = expressions["op d s t"].match(line)
-        if m:
-            op = m.group(1).lower()
-            d, s, t = (parse_register(m.group(g)) for g in (2, 3, 4))
-            if op == "or":
-                machine_code.extend(
-                    [
-                        # R[E] <- R[s] & R[t]
-                        0x3E00 | (s << 4) | t,
-                        # R[F] <- R[s] ^ R[t]
-                        0x4F00 | (s << 4) | t,
-                        # R[d] <- R[E] ^ R[F]
-                        0x40EF | (d << 8),
-                    ]
-                )
-                continue
-            if op in op_map:
-                machine_code.append(
-                    # R[d] <- R[s] * R[t]
-                    (op_map[op] << 12) | (d << 8) | (s << 4) | t,
-                )
-                continue
 
-            raise ToyException(f"Unknown operator: '{op}'.")
+def read_binary(path: Path, as_bytes=False) -> list[int]:
+    """
+    Reads a file as big-endian words (padding an odd final byte with
+    zero) or, if `as_bytes`, as one byte per word.
+    """
+    try:
+        data = path.read_bytes()
+    except OSError:
+        raise ToyException(f"Cannot read file: '{path}'")
+    if as_bytes:
+        return memoryview(data).tolist()
+    words = array("H", data + bytes(len(data) % 2))
+    if byteorder == "little":
+        words.byteswap()
+    return words.tolist()
+
+
+def split_line(line: str) -> list[str]:
+    """
+    Removes any comment from a line of source and separates a label
+    from the statement following it.
+    """
+    line = pieces(line, ";")[0].strip()
+    if not line:
+        return []
+    if ":" in line:
+        try:
+            label, content = pieces(line, ":")
+        except ValueError:
+            raise ToyException(f"Label error: {line}")
+        if content.strip():
+            return [label.strip() + ":", content.strip()]
+        return [label.strip() + ":"]
+    return [line]
 
-        m = expressions["op d s v"].match(line)
-        if m:
-            op = m.group(1).lower()
-            d, s = (parse_register(m.group(g)) for g in (2, 3))
-            v = parse_value(m.group(4))
 
-            if v <= 0xFF:
-                machine_code.append(
-                    # R[E] <- v
-                    0x7E00 | v,
-                )
-            else:
-                machine_code.extend(
-                    store_word_to(0xE, v),
-                )
+@dataclass
+class AssemblyCache:
+    """
+    The parse of each distinct line of the most recently assembled
+    program, so that reassembling it after an edit only parses and
+    translates the lines that changed.
+    """
+
+    statements: dict[str, list[str]] = field(default_factory=dict)
+    translations: dict[str, tuple[list[int], list[tuple[int, str]]]] = field(
+        default_factory=dict
+    )
+    # The number of statements translated by the most recent assembly.
+    translated: int = 0
+    coprocessor: bool = False
 
-            if op == "or":
-                machine_code.extend(
-                    [
-                        # R[F] <- R[E] ^ R[s]
-                        0x4FE0 | s,
-                        # R[E] <- R[E] & R[s]
-                        0x3EE0 | s,
-                        # R[d] <- R[E] ^ R[F]
-                        0x40EF | (d << 8),
-                    ]
-                )
-                continue
 
-            if op in op_map:
-                machine_code.append(
-                    # R[d] <- R[s] * R[E]
-                    0x000E | (op_map[op] << 12) | (d << 8) | (s << 4),
-                )
-                continue
+@dataclass
+class ParsedProgram:
+    """
+    A program with its words placed but its label references not yet
+    completed: `addresses` holds, for each label referred to, the list
+    of words and the index in it of each word that refers to it. `pc`
+    is None if there is no `.main`.
+    """
+
+    pc: int | None
+    words: list[int]
+    labels: dict[str, int]
+    addresses: dict[str, list[tuple[list[int], int]]]
+    banks: dict[int, list[int]]
+    bank_numbers: dict[str, int]
+    source_map: dict[tuple[int, int], SourceLocation]
+    coprocessor: bool
+    # Labels declared with `.global` and `.extern`.
+    exported: list[str] = field(default_factory=list)
+    imported: list[str] = field(default_factory=list)
+    # Whether `.timer`, and `.ready` or `.poll`, are used.
+    timer: bool = False
+    polling: bool = False
+
+
+def parse_program(
+    code: str,
+    cache: AssemblyCache | None = None,
+    directory: str | Path = ".",
+    replacements: ReplacementTable | None = None,
+) -> ParsedProgram:
+    """
+    Places the words of a program (see `assemble`).
+    """
+    machine_code = list[int]()
+    pc: int | None = None
+    lines = list[tuple[int, str]]()
+    statements = dict[str, list[str]]()
+    translations = dict[str, tuple[list[int], list[tuple[int, str]]]]()
+    translated = 0
+
+    for number, line in enumerate(code.splitlines(), 1):
+        if line not in statements:
+            if cache is not None and line in cache.statements:
+                statements[line] = cache.statements[line]
+            else:
+                statements[line] = split_line(line)
+        for statement in statements[line]:
+            lines.append((number, statement))
 
-            raise ToyException(f"Unknown operator: '{op}'.")
+    labels = dict[str, int]()
+    addresses = dict[str, list[tuple[list[int], int]]]()
+    exported, imported = list[str](), list[str]()
+
+    # Code in a `.bank` section is placed in a page of banked memory
+    # and addressed from BANK_START; bank names are labels for their
+    # bank numbers.
+    main_code = machine_code
+    banks = dict[int, list[int]]()
+    bank_numbers = dict[str, int]()
+    base, bank = 0, 0
+
+    # The words each line adds are mapped back to it when the next
+    # line is reached.
+    source_map = dict[tuple[int, int], SourceLocation]()
+    current_label: str | None = None
+    previous = (machine_code, 0, base, bank, SourceLocation(0, "", None, 0))
+
+    def map_previous() -> None:
+        words, start, base, bank, location = previous
+        for offset, index in enumerate(range(start, len(words))):
+            source_map[bank, base + index] = SourceLocation(
+                location.line, location.text, location.label, offset
+            )
 
-        m = expressions["op d s"].match(line)
+    # `.coprocessor` anywhere in the program changes how `mul`, `div`
+    # and `mod` are translated throughout.
+    coprocessor = any(expressions[".coprocessor"].match(line) for _, line in lines)
+    if cache is not None and cache.coprocessor != coprocessor:
+        cache.translations = {}
+    # The timer and input status devices are enabled by using them.
+    timer = any(expressions[".timer"].match(line) for _, line in lines)
+    polling = any(
+        expressions[".ready"].match(line) or expressions[".poll"].match(line)
+        for _, line in lines
+    )
+
+    for number, line in lines:
+        map_previous()
+        previous = (
+            machine_code,
+            len(machine_code),
+            base,
+            bank,
+            SourceLocation(number, line, current_label, 0),
+        )
+        m = expressions["label"].match(line)
         if m:
-            op = m.group(1).lower()
-            d, s = (parse_register(m.group(g)) for g in (2, 3))
-
-            if op == "or":
-                machine_code.extend(
-                    [
-                        # R[E] <- R[d] & R[s]
-                        0x3E00 | (d << 4) | s,
-                        # R[F] <- R[d] ^ R[s]
-                        0x4F00 | (d << 4) | s,
-                        # R[d] <- R[E] ^ R[F]
-                        0x40EF | (d << 8),
-                    ]
-                )
-                continue
+            label = m.group(1)
+            if label in labels:
+                raise ToyException(f"Duplicate label: '{label}'.")
+            labels[label] = base + len(machine_code)
+            current_label = label
+            continue
 
-            if op in op_map:
-                machine_code.append(
-                    # R[d] <- R[d] * R[s]
-                    (op_map[op] << 12) | (d << 8) | (d << 4) | s,
-                )
+        m = expressions[".bank"].match(line)
+        if m:
+            name = m.group(1)
+            if not name:
+                machine_code, base, bank = main_code, 0, 0
                 continue
+            if name not in bank_numbers:
+                if name in labels:
+                    raise ToyException(f"Duplicate label: '{name}'.")
+                bank_numbers[name] = labels[name] = len(banks) + 1
+                banks[bank_numbers[name]] = []
+            bank = bank_numbers[name]
+            machine_code, base = banks[bank], BANK_START
+            continue
 
-            raise ToyException(f"Unknown operator: '{op}'.")
-
-        m = expressions["op d v"].match(line)
+        m = expressions[".main"].match(line)
         if m:
-            op = m.group(1).lower()
-            d = parse_register(m.group(2))
-            v = parse_value(m.group(3))
-
-            if v <= 0xFF:
-                machine_code.append(
-                    # R[E] <- v
-                    0x7E00 | v,
-                )
-            else:
-                machine_code.extend(
-                    store_word_to(0xE, v),
-                )
+            if machine_code is not main_code:
+                raise ToyException("Cannot start program in a bank.")
+            pc = len(machine_code)
+            continue
 
-            if op == "or":
-                machine_code.extend(
-                    [
-                        # R[F] <- R[E] ^ R[d]
-                        0x4FE0 | d,
-                        # R[E] <- R[E] & R[d]
-                        0x3EE0 | d,
-                        # R[d] <- R[E] ^ R[F]
-                        0x40EF | (d << 8),
-                    ]
-                )
-                continue
+        if expressions[".coprocessor"].match(line):
+            continue
 
-            if op in op_map:
-                machine_code.append(
-                    # R[d] <- R[d] * R[E]
-                    0x000E | (op_map[op] << 12) | (d << 8) | (d << 4),
-                )
-                continue
+        m = expressions[".global"].match(line)
+        if m:
+            exported.append(m.group(1))
+            continue
 
-            raise ToyException(f"Unknown operator: '{op}'.")
+        m = expressions[".extern"].match(line)
+        if m:
+            imported.append(m.group(1))
+            continue
 
-        raise ToyException(f"Cannot parse line: '{line}'")
+        m = expressions[".incbin"].match(line)
+        if m:
+            machine_code.extend(
+                read_binary(Path(directory) / m.group(1), m.group(2) == "bytes")
+            )
+            continue
 
-    for label, indices in addresses.items():
+        if line not in translations:
+            if cache is not None and line in cache.translations:
+                translations[line] = cache.translations[line]
+            else:
+                translations[line] = translate(line, coprocessor)
+                translated += 1
+        words, references = translations[line]
+        if replacements is not None and not references:
+            words = replacements.apply(words)
+        for index, label in references:
+            if label not in addresses:
+                addresses[label] = []
+            addresses[label].append((machine_code, len(machine_code) + index))
+        machine_code.extend(words)
+
+    map_previous()
+
+    for name, number in bank_numbers.items():
+        if len(banks[number]) > BANK_SIZE:
+            raise ToyException(f"Bank '{name}' does not fit in {BANK_SIZE} words.")
+
+    if cache is not None:
+        cache.statements, cache.translations = statements, translations
+        cache.translated = translated
+        cache.coprocessor = coprocessor
+
+    return ParsedProgram(
+        pc,
+        main_code,
+        labels,
+        addresses,
+        banks,
+        bank_numbers,
+        source_map,
+        coprocessor,
+        exported,
+        imported,
+        timer,
+        polling,
+    )
+
+
+def assemble(
+    code: str,
+    show_addresses=True,
+    cache: AssemblyCache | None = None,
+    directory: str | Path = ".",
+    replacements: ReplacementTable | None = None,
+) -> Assembled:
+    """
+    Assembles a program. If a `cache` is given, lines that were in the
+    program it was last used with are not parsed again. Files included
+    with `.incbin` are found relative to `directory`. If `replacements`
+    are given, lines with a shorter replacement (found by the
+    superoptimizer) are assembled to it.
+    """
+    program = parse_program(code, cache, directory, replacements)
+    labels = program.labels
+    words, names = runtime(len(program.words), set(program.addresses))
+    program.words.extend(words)
+    labels |= names
+    if program.banks and len(program.words) > BANK_START:
+        raise ToyException(
+            f"Program is {len(program.words)} words long, "
+            f"overlapping banked memory at {hex(BANK_START)[2:]}."
+        )
+
+    for label, references in program.addresses.items():
         if label in labels:
             address = labels[label]
-            for index in indices:
-                machine_code[index] |= address
+            for words, index in references:
+                words[index] |= address
         else:
             raise ToyException(f"Unrecognized label: '{label}'")
 
@@ -675,88 +1190,35 @@ def assemble(code: str, show_addresses=True) -> Assembled:
         for label, v in labels.items():
             print(f"  {label}: {hex(v)[2:].rjust(2, "0")}")
         print()
-    return Assembled(code, pc, machine_code, labels)
-
-
-def format_assembly(code: str) -> str:
-    try:
-        assembled = assemble(code, False)
-        label_width = max(len(label) for label in assembled.address_mappings) + 1
-        lines = code.splitlines()
-        html = '<pre class="toy-assembly">\n'
-
-        def format_argument(argument: str) -> str:
-            m = match(pat("register"), argument)
-            if m:
-                return f'<span class="register">{argument}</span>'
-            m = match(pat("at_register"), argument)
-            if m:
-                return f'[<span class="register">%{m.group(1)}</span>]'
-            m = match(pat("label"), argument)
-            if m:
-                return f'<span class="label">{argument}</span>'
-            m = match(pat("at_label"), argument)
-            if m:
-                return f'[<span class="label">{m.group(1)}</span>]'
-            m = match(pat("value"), argument)
-            if m:
-                return f'<span class="literal">{argument}</span>'
-            m = match(pat("at_address"), argument)
-            if m:
-                return f'[<span class="literal">{m.group(1)}</span>]'
-            return f"<h1>Huh? {argument}</h1>"
-
-        for line in lines:
-            label, comment, instruction, argument = "", "", "", ""
-            ps = pieces(line, ";")
-            if len(ps) >= 2:
-                line, comment = ps[0].strip(), ("; " + "".join(ps[1:])).strip()
-
-            if line:
-                ps = pieces(line, ":")
-                if len(ps) >= 2:
-                    label, line = ps[0].strip() + ":", "".join(ps[1:]).strip()
-                if line:
-                    ps = [
-                        stripped for p in pieces(line, " ") if (stripped := p.strip())
-                    ]
-                    if ps:
-                        instruction = (
-                            f'<span class="special">{ps[0]}</span>'
-                            if "." in ps[0]
-                            else f'<span class="keyword">{ps[0]}</span>'
-                        )
-                        match ps[0]:
-                            case ".ascii":
-                                argument = (
-                                    f'<span class="string">{" ".join(ps[1:])}</span>'
-                                )
-                            case ".data":
-                                # In case no spaces between commas...
-                                argument_pieces = list[str]()
-                                for p in ps[1:]:
-                                    argument_pieces.extend(n for n in p.split(",") if n)
-                                argument = ", ".join(
-                                    format_argument(p) for p in argument_pieces
-                                )
-                            case _:
-                                argument = " ".join(format_argument(p) for p in ps[1:])
-
-            html += (
-                f'<span class="label">{label.rjust(label_width)}</span>'
-                if label
-                else " " * label_width
-            )
-
-            if instruction or argument:
-                html += f" {instruction} {argument}"
-            if comment:
-                html += f'<span class="comment"> {comment}</span>'
-
-            html += "\n"
-
-        html += "</pre>"
-        return r"""
+    return Assembled(
+        code,
+        program.pc or 0,
+        program.words,
+        labels,
+        program.banks,
+        program.source_map,
+        program.coprocessor,
+        DESCRIPTOR[0] in program.addresses,
+        program.timer,
+        program.polling,
+    )
+
+
+# An argument of an instruction, in the order the kinds are tried.
+ARGUMENT = compile(
+    f"(?:{pat('register')})|(?:{pat('at_register')})|(?:{pat('label')})"
+    f"|(?:{pat('at_label')})|(?:{pat('value')})|(?:{pat('at_address')})"
+)
+ARGUMENT_KINDS = (
+    "register",
+    "at_register",
+    "label",
+    "at_label",
+    "literal",
+    "at_address",
+)
+
+PAGE_HEAD = r"""
 <!doctype html>
 
 <html lang="en">
@@ -801,17 +1263,154 @@ def format_assembly(code: str) -> str:
     .register {
       color: forestgreen;
     }
+
+    .heat {
+      color: dimgray;
+    }
   </style>
 
 </head>
 
 <body>
 
-  <<code>>
+"""
+
+PAGE_TAIL = """
 
 </body>
 
 </html>
-""".replace("<<code>>", html)
+"""
+
+
+@dataclass
+class FormattedLine:
+    """
+    The parts of a line of source, as the formatter shows them.
+    """
+
+    label: str = ""
+    instruction: str = ""
+    arguments: list[str] = field(default_factory=list)
+    comment: str = ""
+    # The statements the assembler reads from the line (see `split_line`).
+    statements: list[str] = field(default_factory=list)
+
+
+def parse_for_format(line: str) -> FormattedLine:
+    """
+    Splits a line of source into the parts the formatter shows, and the
+    statements in it as `split_line` would.
+    """
+    result = FormattedLine()
+    ps = pieces(line, ";")
+    code = ps[0]
+    if len(ps) >= 2:
+        line, result.comment = ps[0].strip(), ("; " + "".join(ps[1:])).strip()
+    if line:
+        ps = pieces(line, ":")
+        if ":" in code:
+            if len(ps) != 2:
+                raise ToyException(f"Label error: {code}")
+            result.statements = [ps[0] + ":", ps[1]] if ps[1] else [ps[0] + ":"]
+        elif code:
+            result.statements = [code]
+        if len(ps) >= 2:
+            result.label, line = ps[0].strip() + ":", "".join(ps[1:]).strip()
+        if line:
+            ps = [stripped for p in pieces(line, " ") if (stripped := p.strip())]
+            if ps:
+                result.instruction, result.arguments = ps[0], ps[1:]
+    return result
+
+
+def format_argument(argument: str) -> str:
+    m = ARGUMENT.match(argument)
+    if m is None:
+        return f"<h1>Huh? {argument}</h1>"
+    kind = ARGUMENT_KINDS[m.lastindex - 1]  # type: ignore
+    match kind:
+        case "at_register":
+            return f'[<span class="register">%{m.group(m.lastindex)}</span>]'
+        case "at_label":
+            return f'[<span class="label">{m.group(m.lastindex)}</span>]'
+        case "at_address":
+            return f'[<span class="literal">{m.group(m.lastindex)}</span>]'
+        case _:
+            return f'<span class="{kind}">{argument}</span>'
+
+
+def stream_assembly(
+    code: str, heat: dict[int, float] = {}, directory: str | Path = "."
+) -> Iterator[str]:
+    """
+    Returns an iterator over the html page formatting assembly, a line
+    at a time. Each line of source is parsed once, and the statements
+    found are assembled (with `.incbin` files found relative to
+    `directory`) before anything is produced, raising ToyException if
+    the code is invalid.
+    """
+    sources = code.splitlines()
+    lines = [parse_for_format(line) for line in sources]
+    cache = AssemblyCache(
+        {source: line.statements for source, line in zip(sources, lines)}
+    )
+    assemble(code, show_addresses=False, cache=cache, directory=directory)
+    return html_lines(lines, heat)
+
+
+def html_lines(lines: list[FormattedLine], heat: dict[int, float]) -> Iterator[str]:
+    """
+    Yields the html page formatting (valid, parsed) assembly a line at a
+    time.
+    """
+    label_width = max((len(line.label) for line in lines), default=0)
+    yield PAGE_HEAD
+    yield '  <pre class="toy-assembly">\n'
+    for number, line in enumerate(lines, 1):
+        html = ""
+        if heat:
+            share = heat.get(number, 0.0)
+            html += (
+                f'<span class="heat" style="background: rgba(255, 69, 0, '
+                f'{share:.3f})">{f"{100 * share:.1f}%" if share else "":>6}</span> '
+            )
+        html += (
+            f'<span class="label">{line.label.rjust(label_width)}</span>'
+            if line.label
+            else " " * label_width
+        )
+        if line.instruction:
+            kind = "special" if "." in line.instruction else "keyword"
+            match line.instruction:
+                case ".ascii":
+                    argument = f'<span class="string">{" ".join(line.arguments)}</span>'
+                case ".data":
+                    # In case no spaces between commas...
+                    argument = ", ".join(
+                        format_argument(n)
+                        for p in line.arguments
+                        for n in p.split(",")
+                        if n
+                    )
+                case _:
+                    argument = " ".join(format_argument(p) for p in line.arguments)
+            html += f' <span class="{kind}">{line.instruction}</span> {argument}'
+        if line.comment:
+            html += f'<span class="comment"> {line.comment}</span>'
+        yield html + "\n"
+    yield "</pre>"
+    yield PAGE_TAIL
+
+
+def format_assembly(
+    code: str, heat: dict[int, float] = {}, directory: str | Path = "."
+) -> str:
+    """
+    Formats assembly as html. If `heat` (the share of run time spent on
+    each line, by line number) is given, a heat column is included.
+    """
+    try:
+        return "".join(stream_assembly(code, heat, directory))
     except ToyException as e:
         return f"Invalid assembly.\n{e.message}"
@@ -0,0 +1,153 @@
+from collections import Counter
+from contextlib import contextmanager
+from random import Random
+from typing import Iterator
+
+from .exception import ToyException
+from .replay import patched
+from .toy_computer import ToyComputer, make_byte
+
+# Replacement policies: evict the least recently used line, the line
+# held longest or a line chosen at random.
+LRU, FIFO, RANDOM = "lru", "fifo", "random"
+
+# Addresses from here up are devices, which are never cached.
+SPECIAL_START = 0xF0
+
+
+class Cache:
+    """
+    A cache of `size` words in lines of `line_size` words, each of which
+    can be held in any of `associativity` places (its set), counting the
+    hits and misses at each address.
+
+    Stores allocate a line as loads do, so that a store to a line not
+    held is also a miss.
+    """
+
+    def __init__(
+        self,
+        size: int = 32,
+        line_size: int = 4,
+        associativity: int = 1,
+        policy: str = LRU,
+        seed: int = 0,
+    ) -> None:
+        for name, value in (
+            ("Size", size),
+            ("Line size", line_size),
+            ("Associativity", associativity),
+        ):
+            if value < 1 or value & (value - 1):
+                raise ToyException(f"{name} must be a power of two.")
+        if line_size * associativity > size:
+            raise ToyException("Cache is smaller than one set.")
+        if policy not in (LRU, FIFO, RANDOM):
+            raise ToyException(f"Unknown replacement policy: '{policy}'.")
+        self.size = size
+        self.line_size = line_size
+        self.associativity = associativity
+        self.policy = policy
+        self.set_count = size // (line_size * associativity)
+        self.random = Random(seed)
+        self.reset()
+
+    def reset(self) -> None:
+        # The tags held in each set, in the order they are to be evicted.
+        self.sets = [list[int]() for _ in range(self.set_count)]
+        self.hits = Counter[int]()
+        self.misses = Counter[int]()
+
+    def access(self, address: int) -> bool:
+        """
+        Accesses the word at `address`, returning whether it was a hit.
+        """
+        line = address // self.line_size
+        ways = self.sets[line % self.set_count]
+        tag = line // self.set_count
+        if tag in ways:
+            if self.policy == LRU:
+                ways.remove(tag)
+                ways.append(tag)
+            self.hits[address] += 1
+            return True
+        self.misses[address] += 1
+        if len(ways) == self.associativity:
+            del ways[self.random.randrange(len(ways)) if self.policy == RANDOM else 0]
+        ways.append(tag)
+        return False
+
+    @property
+    def accesses(self) -> int:
+        return self.hits.total() + self.misses.total()
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits.total() / self.accesses if self.accesses else 0.0
+
+    def format(self, name: str, computer: ToyComputer) -> str:
+        """
+        Returns the totals and a table of the hits and misses at each
+        address accessed.
+        """
+        result = (
+            f"\n{name} cache: {self.size} words, {self.line_size} word lines, "
+            f"{self.associativity} way, {self.policy}"
+            f"\nAccesses: {self.accesses}"
+            f"\nHits: {self.hits.total()}"
+            f"\nMisses: {self.misses.total()}"
+            f"\nHit rate: {100 * self.hit_rate:.1f}%\n\n"
+            f"{'Addr':>4} {'Word':>4} {'Hits':>8} {'Misses':>8}  Pseudocode\n"
+        )
+        for address in sorted(self.hits.keys() | self.misses.keys()):
+            word = computer.memory[address]
+            pseudo = ToyComputer.as_pseudocode(word)
+            result += (
+                f"{make_byte(address):>4} {hex(word)[2:].rjust(4, '0')}"
+                f" {self.hits[address]:>8} {self.misses[address]:>8}"
+                f"  {pseudo if pseudo else 'halt'}\n"
+            )
+        return result
+
+
+@contextmanager
+def caching(
+    computer: ToyComputer, instructions: Cache, data: Cache | None = None
+) -> Iterator[None]:
+    """
+    Passes the instruction fetches of `computer` through `instructions`
+    and its loads and stores through `data` (or, if not given, through
+    `instructions` too, as a unified cache) while in the context:
+
+    ```py
+    instructions, data = Cache(16), Cache(32, associativity=2)
+    with caching(computer, instructions, data):
+        computer.run()
+    print(data.hit_rate)
+    ```
+
+    A computer is only slowed while in the context. Special addresses
+    (F0 to FF) are devices and are not cached. A `FusedToyComputer` runs
+    whole sequences in a step, so use a `ToyComputer` to see every
+    access.
+    """
+    if data is None:
+        data = instructions
+    original = {name: getattr(computer, name) for name in ("step", "load", "store")}
+
+    def step() -> bool:
+        instructions.access(computer.pc)
+        return original["step"]()
+
+    def load(memory_address: int, register_address: int) -> None:
+        if memory_address < SPECIAL_START:
+            data.access(memory_address)
+        original["load"](memory_address, register_address)
+
+    def store(memory_address: int, register_address: int) -> None:
+        if memory_address < SPECIAL_START:
+            data.access(memory_address)
+        original["store"](memory_address, register_address)
+
+    with patched(computer, {"step": step, "load": load, "store": store}):
+        yield
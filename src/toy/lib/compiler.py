@@ -0,0 +1,319 @@
+from hashlib import sha256
+from importlib.util import module_from_spec, spec_from_file_location
+from json import dumps
+from pathlib import Path
+from py_compile import compile as compile_file
+from types import ModuleType
+
+from .exception import ToyException
+from .toy_computer import ToyComputer, make_byte
+
+# Special addresses after which the program may have written into its
+# own code (or started the timer), so that it must be checked.
+CHECKED_STORES = {0xF0, 0xFA, 0xFB, 0xFF}
+CHECKED_LOADS = {0xFB}
+
+# Changed whenever the generated code changes, so that modules compiled
+# before are compiled again.
+FORMAT = 3
+HEADER = "# Compiled Toy program (source hash {}). Do not edit.\n"
+
+
+def leaders(pc: int, ram: list[int]) -> dict[int, int]:
+    """
+    Finds the basic blocks reachable from `pc`, returning the address
+    of the first word of each with the address after its last.
+    """
+    memory = [*ram, *(0 for _ in range(0x100 - len(ram)))]
+    starts = set[int]()
+    pending = [pc]
+    while pending:
+        address = pending.pop()
+        if address in starts or address > 0xFF:
+            continue
+        starts.add(address)
+        if memory[address] >> 12 == 0x0:
+            continue
+        while address <= 0xFF:
+            op, _, _, _, addr = ToyComputer.decode(memory[address])
+            address += 1
+            match op:
+                case 0x0:
+                    pending.append(address - 1)
+                    break
+                case 0xC | 0xD | 0xF:
+                    pending += [addr, address]
+                    break
+                case 0xE:
+                    break
+    # Blocks end at the next leader as well as at a branch.
+    result = dict[int, int]()
+    ordered = sorted(starts)
+    for start in ordered:
+        address = start
+        while address <= 0xFF:
+            op = memory[address] >> 12
+            address += 1
+            if op in (0x0, 0xC, 0xD, 0xE, 0xF) or address in starts:
+                break
+        result[start] = address
+    return result
+
+
+def block_name(address: int) -> str:
+    return f"block_{make_byte(address)}"
+
+
+def compile_block(
+    start: int, end: int, memory: list[int], code: set[int]
+) -> list[str]:
+    """
+    Returns the lines of a function running the block from `start` to
+    `end`. It returns the function for the next block, or None after
+    setting `pc` to where the program halts or the interpreter takes
+    over.
+    """
+    name = block_name(start)
+    if memory[start] >> 12 == 0x0:
+        return [f"def {name}():", "    nonlocal pc", f"    pc = {start}"]
+    n = end - start
+    last, target = memory[end - 1] >> 12, memory[end - 1] & 0xFF
+    # A block that branches back to its start runs as a loop.
+    loop = last in (0xC, 0xD) and target == start
+    lines = [f"def {name}():", "    nonlocal steps, pc"]
+    body = list[str]()
+
+    def leave(address: int, i: int) -> list[str]:
+        # Stops after the i-th word of the block.
+        return [
+            *([f"steps -= {n - i - 1}"] if i < n - 1 else []),
+            f"pc = {address + 1}",
+            "return None",
+        ]
+
+    def special(call: str, address: int, i: int, checked: bool) -> list[str]:
+        # Special addresses are left to the computer, with its program
+        # counter and steps as the interpreter would have them.
+        return [
+            f"computer.pc, computer.steps = {address + 1}, steps - {n - i - 1}",
+            call,
+            *(["if changed():", *indent(leave(address, i))] if checked else []),
+        ]
+
+    for i, address in enumerate(range(start, end)):
+        op, d, s, t, addr = ToyComputer.decode(memory[address])
+        match op:
+            case 0x1:
+                body.append(f"R[{d}] = (R[{s}] + R[{t}]) % 0x10000")
+            case 0x2:
+                body.append(f"R[{d}] = (R[{s}] - R[{t}]) % 0x10000")
+            case 0x3:
+                body.append(f"R[{d}] = (R[{s}] & R[{t}]) & 0xFFFF")
+            case 0x4:
+                body.append(f"R[{d}] = (R[{s}] ^ R[{t}]) & 0xFFFF")
+            case 0x5:
+                body.append(f"R[{d}] = (R[{s}] << R[{t}]) & 0xFFFF")
+            case 0x6:
+                body.append(f"R[{d}] = (R[{s}] >> R[{t}]) & 0xFFFF")
+            case 0x7:
+                body.append(f"R[{d}] = {addr}")
+            case 0x8 if addr >= 0xF0:
+                call = f"computer.load({addr}, {d})"
+                body += special(call, address, i, addr in CHECKED_LOADS)
+            case 0x8:
+                body.append(f"R[{d}] = M[{addr}]")
+            case 0x9 if addr >= 0xF0:
+                call = f"computer.store({addr}, {d})"
+                body += special(call, address, i, addr in CHECKED_STORES)
+            case 0x9:
+                body.append(f"M[{addr}] = R[{d}]")
+                if addr in code:
+                    # Writes into the program's own code.
+                    body += leave(address, i)
+                    break
+            case 0xA:
+                body += [
+                    f"a = R[{t}] & 0xFF",
+                    "if a < 0xF0:",
+                    f"    R[{d}] = M[a]",
+                    "else:",
+                    *indent(special(f"computer.load(a, {d})", address, i, True)),
+                ]
+            case 0xB:
+                body += [
+                    f"a = R[{t}] & 0xFF",
+                    "if a >= 0xF0:",
+                    *indent(special(f"computer.store(a, {d})", address, i, True)),
+                    "elif a in CODE:",
+                    f"    M[a] = R[{d}]",
+                    *indent(leave(address, i)),
+                    "else:",
+                    f"    M[a] = R[{d}]",
+                ]
+            case 0xC | 0xD:
+                test = f"R[{d}] == 0" if op == 0xC else f"R[{d}] > 0"
+                if loop:
+                    body += [f"if not {test}:", f"    return {block_name(end)}"]
+                else:
+                    body.append(
+                        f"return {block_name(addr)} if {test} else {block_name(end)}"
+                    )
+            case 0xE:
+                body += [f"pc = R[{d}]", "return blocks.get(pc)"]
+            case 0xF:
+                body += [f"R[{d}] = {end}", f"return {block_name(addr)}"]
+    else:
+        if last not in (0xC, 0xD, 0xE, 0xF):
+            if end > 0xFF:
+                body += [f"pc = {end}", "return None"]
+            else:
+                body.append(f"return {block_name(end)}")
+
+    body = [
+        f"if steps + {n} > limit:",
+        f"    pc = {start}",
+        "    return None",
+        f"steps += {n}",
+        *body,
+    ]
+    if loop:
+        return lines + indent(["while True:", *indent(body)])
+    return lines + indent(body)
+
+
+def indent(lines: list[str]) -> list[str]:
+    return ["    " + line for line in lines]
+
+
+def source_hash(
+    pc: int, ram: list[int], banks: dict[int, list[int]], devices: dict[str, bool]
+) -> str:
+    state = [pc, ram, sorted(banks.items()), sorted(devices.items()), FORMAT]
+    return sha256(dumps(state).encode()).hexdigest()
+
+
+def compile_program(
+    pc: int,
+    ram: list[int],
+    banks: dict[int, list[int]] = {},
+    devices: dict[str, bool] = {},
+) -> str:
+    """
+    Returns the source of a Python module that runs a program, with one
+    function for each basic block reachable from `pc`. `devices` are
+    the optional devices the program uses (see `Assembled.devices`).
+
+    The module's `run(computer, max_steps=None)` behaves as
+    `computer.run(max_steps)` for a computer loaded with the program,
+    continuing in the interpreter if the program writes into its own
+    code, starts the timer or jumps somewhere unexpected. Running the
+    module runs the program.
+    """
+    memory = [*ram, *(0 for _ in range(0x100 - len(ram)))]
+    image = ram[:]
+    while image and not image[-1]:
+        image.pop()
+    blocks = leaders(pc, ram)
+    addresses = ", ".join(str(a) for a in blocks)
+    code = {
+        address
+        for start, end in blocks.items()
+        for address in range(start, max(end, start + 1))
+    }
+    lines = [
+        HEADER.format(source_hash(pc, ram, banks, devices)),
+        "from toy.lib.toy_computer import ToyComputer",
+        "",
+        f"PC = {pc}",
+        f"IMAGE = [{', '.join(f'0x{word:04X}' for word in image)}]",
+        f"BANKS = {banks}",
+        f"DEVICES = {devices}",
+        f"CODE = {{{', '.join(str(a) for a in sorted(code))}}}",
+        "CODE_WORDS = [",
+        *(f"    ({a}, 0x{memory[a]:04X})," for a in sorted(code)),
+        "]",
+        "",
+        "",
+        "def run(computer: ToyComputer, max_steps: int | None = None) -> bool:",
+        "    R, M = computer.registers, computer.memory",
+        "",
+        "    def changed() -> bool:",
+        "        return computer.interrupt_at is not None or any(",
+        "            M[a] != w for a, w in CODE_WORDS",
+        "        )",
+        "",
+        "    # Starting on a halt is left to the interpreter, which counts it",
+        "    # as a step.",
+        "    if (",
+        f"        computer.pc not in {{{addresses}}}",
+        "        or M[computer.pc] >> 12 == 0",
+        "        or changed()",
+        "    ):",
+        "        return computer.run(max_steps)",
+        "    steps, pc = computer.steps, computer.pc",
+        "    limit = float('inf') if max_steps is None else steps + max_steps",
+        "",
+    ]
+    for start, end in blocks.items():
+        lines += indent(compile_block(start, end, memory, code)) + [""]
+    lines += [
+        "    blocks = {",
+        *(f"        {start}: {block_name(start)}," for start in blocks),
+        "    }",
+        "    block = blocks[pc]",
+        "    while block is not None:",
+        "        block = block()",
+        "    computer.pc, computer.steps = pc, steps",
+        "    if 0 <= pc <= 0xFF and M[pc] >> 12 == 0:",
+        "        return True",
+        "    return computer.run(None if max_steps is None else limit - steps)",
+        "",
+        "",
+        "def main() -> None:",
+        "    computer = ToyComputer()",
+        "    computer.set_state(PC, IMAGE, banks=BANKS, **DEVICES)",
+        "    run(computer)",
+        "",
+        "",
+        'if __name__ == "__main__":',
+        "    main()",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def write_compiled(
+    path: str | Path,
+    pc: int,
+    ram: list[int],
+    banks: dict[int, list[int]] = {},
+    devices: dict[str, bool] = {},
+) -> bool:
+    """
+    Writes the compiled program to `path` and byte-compiles it, unless
+    `path` already holds the same program. Returns whether it was
+    written.
+    """
+    path = Path(path)
+    header = HEADER.format(source_hash(pc, ram, banks, devices))
+    try:
+        with path.open() as f:
+            if f.readline() == header:
+                return False
+    except OSError:
+        pass
+    path.write_text(compile_program(pc, ram, banks, devices))
+    compile_file(str(path), doraise=True)
+    return True
+
+
+def load_compiled(path: str | Path) -> ModuleType:
+    """
+    Imports a compiled program (using its cached byte code).
+    """
+    path = Path(path)
+    spec = spec_from_file_location(path.stem, path)
+    if spec is None or spec.loader is None:
+        raise ToyException(f"Cannot load '{path}'...")
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,289 @@
+from dataclasses import dataclass
+from queue import Empty, Queue
+from threading import Thread, current_thread
+from time import monotonic
+
+from prompt_toolkit.application import Application
+from prompt_toolkit.formatted_text import StyleAndTextTuples
+from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.layout import HSplit, Layout, VSplit, Window
+from prompt_toolkit.layout.controls import FormattedTextControl
+from prompt_toolkit.styles import Style
+from prompt_toolkit.widgets import Frame, TextArea
+
+from .exception import ToyException
+from .replay import patched
+from .toy_computer import ToyComputer, make_byte, make_nibble
+
+# Steps run between checks for commands and for whether a snapshot is due.
+CHUNK = 0x400
+
+# Most snapshots taken (and frames drawn) each second.
+FRAME_RATE = 20
+
+# Snapshots for which a word written to memory stays highlighted.
+RECENT = 10
+
+# Characters of output kept, and lines of it shown.
+OUTPUT_LIMIT = 0x1000
+OUTPUT_ROWS = 6
+
+# Commands for the worker thread.
+RUN, PAUSE, STEP, QUIT = "run", "pause", "step", "quit"
+
+STYLE = Style.from_dict(
+    {
+        "pc": "reverse",
+        "recent": "bold ansiyellow",
+        "state": "bold",
+        "help": "reverse",
+    }
+)
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    A computer's state at a moment of a run, for display.
+    """
+
+    pc: int
+    registers: tuple[int, ...]
+    memory: tuple[int, ...]
+    steps: int
+    state: str
+    output: str
+
+
+class Debugger:
+    """
+    Runs a computer on a worker thread that takes commands between
+    chunks of steps and publishes a `Snapshot` at most `FRAME_RATE`
+    times a second (and whenever it stops), so that a display can show
+    the run without the run ever waiting for the display.
+
+    Output is kept rather than printed, and lines of input are taken
+    from `enter`.
+    """
+
+    def __init__(self, computer: ToyComputer) -> None:
+        self.computer = computer
+        self.commands = Queue[str]()
+        self.lines = Queue[str | None]()
+        self.written = list[str]()
+        self.output = ""
+        self.running = False
+        self.state = "paused"
+        self.next_snapshot = 0.0
+        self.thread = Thread(target=self.work, daemon=True)
+        self.publish()
+
+    def write(self, text: str) -> None:
+        self.written.append(text)
+
+    def read_line(self) -> str:
+        worker = current_thread() is self.thread
+        if worker:
+            self.state = "waiting for input"
+            self.publish()
+        line = self.lines.get()
+        if line is None:
+            raise EOFError
+        if worker:
+            self.state = "running" if self.running else "paused"
+            self.write(f"{line}\n")
+        return line
+
+    def enter(self, line: str) -> None:
+        self.lines.put(line)
+
+    def send(self, command: str) -> None:
+        self.commands.put(command)
+
+    def stop(self) -> None:
+        self.send(QUIT)
+        self.lines.put(None)
+        self.thread.join(timeout=1)
+
+    def publish(self) -> None:
+        computer = self.computer
+        if self.written:
+            self.output = (self.output + "".join(self.written))[-OUTPUT_LIMIT:]
+            self.written.clear()
+        self.snapshot = Snapshot(
+            computer.pc,
+            tuple(computer.registers),
+            tuple(computer.memory),
+            computer.steps,
+            self.state,
+            self.output,
+        )
+        self.next_snapshot = monotonic() + 1 / FRAME_RATE
+
+    def work(self) -> None:
+        computer = self.computer
+        while True:
+            try:
+                command = (
+                    self.commands.get_nowait() if self.running else self.commands.get()
+                )
+            except Empty:
+                command = None
+            match command:
+                case "run":
+                    self.running = True
+                case "pause" | "step":
+                    self.running = False
+                case "quit":
+                    return
+            steps = CHUNK if self.running else int(command == STEP)
+            try:
+                if computer.halted or (steps and computer.run(steps)):
+                    self.running = False
+                    self.state = "halted"
+                else:
+                    self.state = "running" if self.running else "paused"
+            except ToyException as e:
+                self.running = False
+                self.state = f"error: {e.message}"
+            except EOFError:
+                return
+            if not self.running or monotonic() >= self.next_snapshot:
+                self.publish()
+
+
+def debug(computer: ToyComputer) -> None:
+    """
+    Shows `computer` full screen (registers, the code around the program
+    counter and memory, with words recently written highlighted) while
+    it runs on a worker thread. F5 runs, F6 pauses, F7 steps and Ctrl-Q
+    leaves. Lines typed are given to the program as input.
+    """
+    debugger = Debugger(computer)
+    shown = [debugger.snapshot]
+    ages = [RECENT] * 0x100
+
+    def current() -> Snapshot:
+        # Ages each word by a snapshot, restarting those that changed.
+        snapshot = debugger.snapshot
+        if snapshot is not shown[0]:
+            for address, (old, new) in enumerate(
+                zip(shown[0].memory, snapshot.memory)
+            ):
+                ages[address] = 0 if old != new else min(ages[address] + 1, RECENT)
+            shown[0] = snapshot
+        return snapshot
+
+    def registers() -> StyleAndTextTuples:
+        snapshot = current()
+        result: StyleAndTextTuples = [
+            ("class:state", f"{snapshot.state}\n"),
+            ("", f"PC {make_byte(snapshot.pc)}  steps {snapshot.steps}\n\n"),
+        ]
+        for i, value in enumerate(snapshot.registers):
+            end = "\n" if i % 4 == 3 else "  "
+            result.append(("", f"{make_nibble(i)} {value:04x}{end}"))
+        return result
+
+    def code() -> StyleAndTextTuples:
+        snapshot = current()
+        result: StyleAndTextTuples = []
+        first = max(0, min(snapshot.pc - 3, 0x100 - 9))
+        for address in range(first, first + 9):
+            word = snapshot.memory[address]
+            pseudo = ToyComputer.as_pseudocode(word) or "halt"
+            style = "class:pc" if address == snapshot.pc else ""
+            result.append((style, f"{make_byte(address)}: {word:04x}  {pseudo}\n"))
+        return result
+
+    def memory() -> StyleAndTextTuples:
+        snapshot = current()
+        header = " ".join(f"   {column:x}" for column in range(0x10))
+        result: StyleAndTextTuples = [("", f"    {header}")]
+        for address, word in enumerate(snapshot.memory):
+            if address % 0x10 == 0:
+                result.append(("", f"\n{make_byte(address)}: "))
+            if address == snapshot.pc:
+                style = "class:pc"
+            elif ages[address] < RECENT:
+                style = "class:recent"
+            else:
+                style = ""
+            result += [(style, f"{word:04x}"), ("", " ")]
+        return result
+
+    def output() -> str:
+        return "\n".join(current().output.split("\n")[-OUTPUT_ROWS:])
+
+    def accept(buffer) -> bool:
+        debugger.enter(buffer.text)
+        return False
+
+    entry = TextArea(height=1, prompt="Input: ", multiline=False, accept_handler=accept)
+    keys = KeyBindings()
+
+    @keys.add("f5")
+    def _(event) -> None:
+        debugger.send(RUN)
+
+    @keys.add("f6")
+    def _(event) -> None:
+        debugger.send(PAUSE)
+
+    @keys.add("f7")
+    def _(event) -> None:
+        debugger.send(STEP)
+
+    @keys.add("c-q")
+    @keys.add("c-c")
+    def _(event) -> None:
+        event.app.exit()
+
+    layout = Layout(
+        HSplit(
+            [
+                VSplit(
+                    [
+                        Frame(
+                            Window(FormattedTextControl(registers), width=26),
+                            title="Registers",
+                        ),
+                        Frame(Window(FormattedTextControl(code)), title="Code"),
+                    ],
+                    height=11,
+                ),
+                Frame(
+                    Window(FormattedTextControl(memory), height=17), title="Memory"
+                ),
+                Frame(
+                    Window(FormattedTextControl(output), height=OUTPUT_ROWS),
+                    title="Output",
+                ),
+                entry,
+                Window(
+                    FormattedTextControl(" F5 run  F6 pause  F7 step  Ctrl-Q quit"),
+                    height=1,
+                    style="class:help",
+                ),
+            ]
+        ),
+        focused_element=entry,
+    )
+    application = Application(
+        layout=layout,
+        key_bindings=keys,
+        style=STYLE,
+        full_screen=True,
+        refresh_interval=1 / FRAME_RATE,
+    )
+    reader = computer.reader
+    with patched(
+        computer, {"write": debugger.write, "read_line": debugger.read_line}
+    ):
+        debugger.thread.start()
+        try:
+            application.run()
+        finally:
+            debugger.stop()
+    # A background reader started while debugging reads from the debugger.
+    computer.reader = reader
@@ -0,0 +1,107 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from hashlib import sha256
+from json import dumps, loads
+from pathlib import Path
+
+from .assembler import stream_assembly
+from .exception import ToyException
+
+# Changed whenever the html produced changes, so that files formatted
+# before are formatted again.
+FORMAT = 1
+
+# Holds the hash of each source last formatted into a directory.
+MANIFEST = ".toy-format.json"
+
+
+@dataclass
+class Formatted:
+    """
+    What became of a source: whether its page was written and, if the
+    source is not valid assembly (and so was skipped), why.
+    """
+
+    source: Path
+    target: Path
+    written: bool = False
+    error: str = ""
+
+
+def content_hash(code: str) -> str:
+    return sha256(f"{FORMAT}\n{code}".encode()).hexdigest()
+
+
+def format_file(
+    source: Path, target: Path, previous: str | None
+) -> tuple[str | None, bool, str]:
+    """
+    Streams the html for `source` to `target`, unless `source` still has
+    the hash `previous` and `target` exists. Returns the hash of the
+    source (None if it is invalid), whether `target` was written and
+    any error.
+    """
+    code = source.read_text()
+    digest = content_hash(code)
+    if digest == previous and target.exists():
+        return digest, False, ""
+    try:
+        lines = stream_assembly(code, directory=source.parent)
+    except ToyException as e:
+        return None, False, e.message
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with target.open("w") as f:
+        f.writelines(lines)
+    return digest, True, ""
+
+
+def format_directory(
+    directory: str | Path,
+    output: str | Path | None = None,
+    processes: int | None = None,
+) -> list[Formatted]:
+    """
+    Formats every `.asm` file in (or below) `directory` as html, across
+    a pool of processes, writing each to the same place relative to
+    `output` (by default, beside the source) with `.html` in place of
+    `.asm`. Files unchanged since they were last formatted are skipped,
+    as are files that are not valid assembly (which are checked again
+    each time).
+    """
+    directory = Path(directory)
+    output = directory if output is None else Path(output)
+    manifest = output / MANIFEST
+    try:
+        hashes = loads(manifest.read_text())
+    except (OSError, ValueError):
+        hashes = {}
+    sources = sorted(directory.rglob("*.asm"))
+    if not sources:
+        return []
+    names = [str(source.relative_to(directory)) for source in sources]
+    targets = [output / Path(name).with_suffix(".html") for name in names]
+    with ProcessPoolExecutor(processes) as executor:
+        results = list(
+            executor.map(
+                format_file,
+                sources,
+                targets,
+                [hashes.get(name) for name in names],
+                chunksize=8,
+            )
+        )
+    output.mkdir(parents=True, exist_ok=True)
+    manifest.write_text(
+        dumps(
+            {
+                name: digest
+                for name, (digest, _, _) in zip(names, results)
+                if digest is not None
+            },
+            indent=2,
+        )
+    )
+    return [
+        Formatted(source, target, written, error)
+        for source, target, (_, written, error) in zip(sources, targets, results)
+    ]
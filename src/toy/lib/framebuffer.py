@@ -0,0 +1,99 @@
+from sys import stdout
+from threading import Event, Thread
+from typing import TextIO
+
+from .toy_computer import ToyComputer, make_pattern
+
+
+class Framebuffer:
+    """
+    A memory mapped display: the `rows` words of memory starting at
+    `base` are shown as a 16 pixel wide bitmap, one row per word, in
+    the same style as the pattern output (F7).
+
+    The display is refreshed from a background thread at most `fps`
+    times per second, and only rows that have changed since the last
+    refresh are repainted, so the program runs at full speed however
+    often it draws. Repainting moves the cursor relative to the end of
+    the display, so programs should avoid other output once drawing
+    has begun.
+
+    ```py
+    with Framebuffer(computer):
+        computer.run()
+    ```
+    """
+
+    def __init__(
+        self,
+        computer: ToyComputer,
+        base: int = 0xE0,
+        rows: int = 0x10,
+        fps: float = 30.0,
+        stream: TextIO = stdout,
+    ) -> None:
+        if base < 0 or rows < 1 or base + rows > 0xF0:
+            raise ValueError("Framebuffer must lie within addresses 00 to EF.")
+        self.computer = computer
+        self.base = base
+        self.rows = rows
+        self.interval = 1 / fps
+        self.stream = stream
+        self.shown = list[int]()
+        self.stopped = Event()
+        self.thread: Thread | None = None
+
+    def render(self) -> None:
+        """
+        Repaints rows that differ from what is currently shown.
+        """
+        memory = self.computer.memory
+        rows = [memory[self.base + i] for i in range(self.rows)]
+        if not self.shown:
+            if not any(rows):
+                # Wait until something is drawn before taking over
+                # the terminal, so prompts can come first.
+                return
+            output = "".join(f"{make_pattern(v)}\n" for v in rows)
+        else:
+            output = ""
+            for i, v in enumerate(rows):
+                if v != self.shown[i]:
+                    # Move up to the row, repaint it, then move back down.
+                    up = self.rows - i
+                    output += f"\x1b[{up}A\r{make_pattern(v)}\x1b[{up}B\r"
+        self.shown = rows
+        if output:
+            self.stream.write(output)
+            self.stream.flush()
+
+    def refresh(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.render()
+
+    def start(self) -> None:
+        """
+        Starts refreshing the display in the background.
+        """
+        self.shown = []
+        self.render()
+        self.stopped.clear()
+        self.thread = Thread(target=self.refresh, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops refreshing and paints the final frame.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.render()
+
+    def __enter__(self) -> "Framebuffer":
+        self.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.stop()
@@ -0,0 +1,254 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from difflib import unified_diff
+from json import dumps, loads
+from pathlib import Path
+from time import perf_counter
+
+from .assembler import assemble
+from .exception import ToyException
+from .metrics import EXHAUSTED, FAILED, HALTED, Metrics
+from .toy_computer import ToyComputer
+
+# Test spec files are named after the program they test, for example
+# `add.test.json` beside `add.asm`.
+SPEC_SUFFIX = ".test.json"
+DEFAULT_MAX_STEPS = 0x100000
+
+
+class CapturingComputer(ToyComputer):
+    """
+    A computer that reads input from a list of lines (all of which are
+    waiting from the start) and collects its output rather than
+    printing it.
+    """
+
+    def __init__(self, inputs: list[str], banked: bool = False) -> None:
+        super().__init__(banked)
+        self.inputs = iter(inputs)
+        self.output = list[str]()
+
+        self.waiting: str | None = None
+
+    def read_line(self) -> str:
+        if self.waiting is not None:
+            line, self.waiting = self.waiting, None
+            return line
+        line = next(self.inputs, None)
+        if line is None:
+            raise ToyException("Ran out of input...")
+        return line
+
+    def input_pending(self) -> bool:
+        # Input is always waiting until it runs out, so runs are repeatable.
+        if self.waiting is None:
+            self.waiting = next(self.inputs, None)
+        return self.waiting is not None
+
+    def poll_line(self) -> str | None:
+        return self.read_line() if self.input_pending() else None
+
+    def write(self, text: str) -> None:
+        self.output.append(text)
+
+
+@dataclass
+class Case:
+    """
+    A single run of a program: its input lines, expected output and
+    step limit.
+    """
+
+    spec: Path
+    name: str
+    inputs: list[str]
+    expected: str | None
+    max_steps: int
+
+
+@dataclass
+class CaseResult:
+    case: Case
+    output: str = ""
+    steps: int = 0
+    seconds: float = 0.0
+    error: str = ""
+    # How the run ended (see `Metrics`).
+    outcome: str = ""
+
+    @property
+    def passed(self) -> bool:
+        return not self.error and self.output == self.case.expected
+
+    def diff(self) -> str:
+        """
+        Returns the differences between expected and actual output.
+        """
+        return "".join(
+            unified_diff(
+                (self.case.expected or "").splitlines(keepends=True),
+                self.output.splitlines(keepends=True),
+                "expected",
+                "actual",
+            )
+        )
+
+
+@dataclass
+class Program:
+    spec: Path
+    source: Path
+    pc: int = 0
+    ram: list[int] = field(default_factory=list)
+    banks: dict[int, list[int]] = field(default_factory=dict)
+    devices: dict[str, bool] = field(default_factory=dict)
+    error: str = ""
+    cases: list[Case] = field(default_factory=list)
+
+
+def discover(paths: list[str], metrics: Metrics | None = None) -> list[Program]:
+    """
+    Finds test specs in (or below) `paths` and loads the programs they
+    test, assembling each once (counted in `metrics`, if given).
+
+    A spec is a JSON file such as:
+
+    ```json
+    {
+      "program": "add.asm",
+      "max_steps": 10000,
+      "cases": {
+        "small": {"input": ["1", "2"], "output": "3\\n"},
+        "large": {"input": ["60000", "7"], "output": "60007\\n", "max_steps": 100}
+      }
+    }
+    ```
+
+    `program` defaults to the spec's name with `.asm` in place of
+    `.test.json`.
+    """
+    specs = list[Path]()
+    for path in map(Path, paths):
+        if path.is_dir():
+            specs.extend(sorted(path.rglob(f"*{SPEC_SUFFIX}")))
+        elif path.name.endswith(SPEC_SUFFIX):
+            specs.append(path)
+        else:
+            spec = path.with_name(path.name.rsplit(".", 1)[0] + SPEC_SUFFIX)
+            if spec.exists():
+                specs.append(spec)
+
+    programs = list[Program]()
+    for spec in specs:
+        try:
+            data = loads(spec.read_text())
+        except ValueError as e:
+            programs.append(Program(spec, spec, error=f"Bad spec: {e}"))
+            continue
+        source = spec.with_name(
+            data.get("program", spec.name[: -len(SPEC_SUFFIX)] + ".asm")
+        )
+        program = Program(spec, source)
+        max_steps = data.get("max_steps", DEFAULT_MAX_STEPS)
+        for name, case in data.get("cases", {}).items():
+            program.cases.append(
+                Case(
+                    spec,
+                    name,
+                    case.get("input", []),
+                    case.get("output"),
+                    case.get("max_steps", max_steps),
+                )
+            )
+        try:
+            code = source.read_text()
+            if source.suffix == ".asm":
+                assembled = (metrics.assemble if metrics else assemble)(
+                    code, show_addresses=False, directory=source.parent
+                )
+                program.pc, program.ram = assembled.pc, assembled.words
+                program.banks = assembled.banks
+                program.devices = assembled.devices
+            else:
+                computer = ToyComputer()
+                computer.compile_machine_language(code)
+                program.pc, program.ram = computer.pc, computer.memory
+        except FileNotFoundError:
+            program.error = f"File '{source}' not found..."
+        except ToyException as e:
+            program.error = e.message
+        programs.append(program)
+    return programs
+
+
+def run_case(
+    pc: int,
+    ram: list[int],
+    banks: dict[int, list[int]],
+    devices: dict[str, bool],
+    case: Case,
+) -> CaseResult:
+    """
+    Runs a single case, recording its output, steps and run time.
+    """
+    result = CaseResult(case)
+    computer = CapturingComputer(case.inputs)
+    computer.set_state(pc, ram, banks=banks, **devices)
+    start = perf_counter()
+    try:
+        if computer.run(case.max_steps):
+            result.outcome = HALTED
+        else:
+            result.outcome = EXHAUSTED
+            result.error = f"Did not halt within {case.max_steps} steps."
+    except ToyException as e:
+        result.outcome = FAILED
+        result.error = e.message
+    result.seconds = perf_counter() - start
+    result.steps = computer.steps
+    result.output = "".join(computer.output)
+    return result
+
+
+def run_tests(
+    programs: list[Program],
+    processes: int | None = None,
+    metrics: Metrics | None = None,
+) -> list[CaseResult]:
+    """
+    Runs every case of every (successfully loaded) program across a
+    pool of processes. Each run is counted in `metrics`, if given, as it finishes.
+    """
+    jobs = [
+        (program.pc, program.ram, program.banks, program.devices, case)
+        for program in programs
+        if not program.error
+        for case in program.cases
+    ]
+    if not jobs:
+        return []
+    results = list[CaseResult]()
+    with ProcessPoolExecutor(processes) as executor:
+        for result in executor.map(run_case, *zip(*jobs), chunksize=8):
+            if metrics is not None:
+                metrics.record_run(result.steps, result.seconds, result.outcome)
+            results.append(result)
+    return results
+
+
+def update_goldens(results: list[CaseResult]) -> list[Path]:
+    """
+    Writes actual outputs into the specs as the expected outputs of
+    cases that ran without error. Returns the specs changed.
+    """
+    changed = dict[Path, dict]()
+    for result in results:
+        if result.error or result.output == result.case.expected:
+            continue
+        spec = result.case.spec
+        if spec not in changed:
+            changed[spec] = loads(spec.read_text())
+        changed[spec]["cases"][result.case.name]["output"] = result.output
+    for spec, data in changed.items():
+        spec.write_text(dumps(data, indent=2) + "\n")
+    return list(changed)
@@ -0,0 +1,93 @@
+from typing import Iterable, Iterator
+
+from .exception import ToyException
+
+# Each page of an image (the unit copied on first write) holds
+# 2 ** PAGE_BITS words.
+PAGE_BITS = 4
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+
+class ProgramImage:
+    """
+    An immutable image of the 256 words of memory a program is loaded
+    into, which any number of computers can share (see `set_state`).
+    """
+
+    def __init__(self, ram: Iterable[int]) -> None:
+        words = list(ram)
+        if len(words) > 0x100:
+            raise ToyException("Not enough memory.")
+        words += [0] * (0x100 - len(words))
+        self.pages = tuple(
+            tuple(words[i : i + PAGE_SIZE]) for i in range(0, 0x100, PAGE_SIZE)
+        )
+
+    def __len__(self) -> int:
+        return 0x100
+
+    def __getitem__(self, index: int) -> int:
+        return self.pages[index >> PAGE_BITS][index & PAGE_MASK]
+
+    def __iter__(self) -> Iterator[int]:
+        for page in self.pages:
+            yield from page
+
+
+class CopyOnWriteMemory:
+    """
+    Memory that reads from a shared `ProgramImage` until a page is first
+    stored to, when that page (alone) is copied. Behaves as the list of
+    256 words a computer's memory otherwise is.
+    """
+
+    def __init__(self, image: ProgramImage) -> None:
+        self.image = image
+        self.pages: list[tuple[int, ...] | list[int]] = list(image.pages)
+
+    @property
+    def copied(self) -> int:
+        """
+        The number of pages copied from the image.
+        """
+        return sum(type(page) is list for page in self.pages)
+
+    def __len__(self) -> int:
+        return 0x100
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            return [self[i] for i in range(*index.indices(0x100))]
+        if index < 0:
+            index += 0x100
+        return self.pages[index >> PAGE_BITS][index & PAGE_MASK]
+
+    def __setitem__(self, index, value) -> None:
+        if type(index) is slice:
+            indices = range(*index.indices(0x100))
+            values = list(value)
+            if len(values) != len(indices):
+                raise ToyException("Cannot change the size of memory.")
+            for i, v in zip(indices, values):
+                self[i] = v
+            return
+        if index < 0:
+            index += 0x100
+        page = self.pages[index >> PAGE_BITS]
+        if type(page) is tuple:
+            page = self.pages[index >> PAGE_BITS] = list(page)
+        page[index & PAGE_MASK] = value
+
+    def __iter__(self) -> Iterator[int]:
+        for page in self.pages:
+            yield from page
+
+    def __eq__(self, other: object) -> bool:
+        try:
+            return list(self) == list(other)  # type: ignore
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
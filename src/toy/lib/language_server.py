@@ -0,0 +1,445 @@
+from dataclasses import dataclass, field
+from json import dumps, loads
+from pathlib import Path
+from re import finditer
+from sys import stdin, stdout
+from typing import BinaryIO
+from urllib.parse import unquote, urlparse
+
+from .assembler import expressions, runtime, split_line, translate
+from .exception import ToyException
+from .toy_computer import BANK_SIZE, BANK_START, ToyComputer
+
+# Diagnostic severity.
+ERROR = 1
+
+
+@dataclass
+class Line:
+    """
+    The parse of a line of source: its statements, the words and label
+    references they translate to and any error found in the line alone.
+    """
+
+    statements: list[str]
+    words: list[int] = field(default_factory=list)
+    references: list[tuple[int, str]] = field(default_factory=list)
+    error: str = ""
+
+
+def parse_line(text: str, coprocessor=False) -> Line:
+    try:
+        statements = split_line(text)
+    except ToyException as e:
+        return Line([], error=e.message)
+    line = Line(statements)
+    for statement in statements:
+        if (
+            expressions["label"].match(statement)
+            or expressions[".bank"].match(statement)
+            or expressions[".main"].match(statement)
+            or expressions[".incbin"].match(statement)
+            or expressions[".coprocessor"].match(statement)
+            or expressions[".global"].match(statement)
+            or expressions[".extern"].match(statement)
+        ):
+            continue
+        try:
+            words, references = translate(statement, coprocessor)
+        except ToyException as e:
+            line.error = e.message
+            continue
+        line.references += [(len(line.words) + i, r) for i, r in references]
+        line.words += words
+    return line
+
+
+@dataclass
+class Layout:
+    """
+    Where each line's words are placed, the labels defined and the
+    problems found when laying out a whole document.
+    """
+
+    # (bank, address of first word) for each line.
+    placement: list[tuple[int, int]] = field(default_factory=list)
+    # Label name to (line number, address).
+    labels: dict[str, tuple[int, int]] = field(default_factory=dict)
+    diagnostics: list[tuple[int, str, int]] = field(default_factory=list)
+
+
+class Document:
+    """
+    A Toy assembly document, kept as a list of lines, each parsed once
+    when it first appears so that an edit only reparses the lines it
+    touches.
+    """
+
+    def __init__(self, text: str, directory: str | Path = ".") -> None:
+        self.directory = Path(directory)
+        self.coprocessor = False
+        self.cache = dict[str, Line]()
+        self.lines = list[str]()
+        self.parsed = list[Line]()
+        self.replace(0, 0, 0, 0, text)
+
+    def parse(self, text: str) -> Line:
+        if text not in self.cache:
+            self.cache[text] = parse_line(text, self.coprocessor)
+        return self.cache[text]
+
+    def replace(
+        self,
+        start_line: int,
+        start_character: int,
+        end_line: int,
+        end_character: int,
+        text: str,
+    ) -> None:
+        """
+        Replaces the text between two positions.
+        """
+        if not self.lines:
+            self.lines = [""]
+            self.parsed = [self.parse("")]
+        end_line = min(end_line, len(self.lines) - 1)
+        before = self.lines[start_line][:start_character]
+        after = self.lines[end_line][end_character:]
+        lines = (before + text + after).split("\n")
+        self.lines[start_line : end_line + 1] = lines
+        self.parsed[start_line : end_line + 1] = [self.parse(x) for x in lines]
+        if len(self.cache) > 4 * len(self.lines) + 0x100:
+            self.cache = {x: self.cache[x] for x in self.lines}
+        coprocessor = any(
+            expressions[".coprocessor"].match(statement)
+            for line in self.parsed
+            for statement in line.statements
+        )
+        if coprocessor != self.coprocessor:
+            # `mul`, `div` and `mod` translate differently throughout.
+            self.coprocessor = coprocessor
+            self.cache = {}
+            self.parsed = [self.parse(x) for x in self.lines]
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+    def layout(self) -> Layout:
+        """
+        Places every line's words, collecting all the problems found
+        rather than stopping at the first.
+        """
+        result = Layout()
+        sizes = {0: 0}
+        bank_numbers = dict[str, int]()
+        bank = 0
+        for number, line in enumerate(self.parsed):
+            if line.error:
+                result.diagnostics.append((number, line.error, ERROR))
+            base = BANK_START if bank else 0
+            included = 0
+            for statement in line.statements:
+                if m := expressions["label"].match(statement):
+                    label = m.group(1)
+                    if label in result.labels:
+                        result.diagnostics.append(
+                            (number, f"Duplicate label: '{label}'.", ERROR)
+                        )
+                    else:
+                        result.labels[label] = (number, base + sizes[bank])
+                elif m := expressions[".bank"].match(statement):
+                    name = m.group(1)
+                    if not name:
+                        bank = 0
+                    else:
+                        if name not in bank_numbers:
+                            if name in result.labels:
+                                result.diagnostics.append(
+                                    (number, f"Duplicate label: '{name}'.", ERROR)
+                                )
+                            bank_numbers[name] = len(bank_numbers) + 1
+                            result.labels[name] = (number, bank_numbers[name])
+                            sizes[bank_numbers[name]] = 0
+                        bank = bank_numbers[name]
+                    base = BANK_START if bank else 0
+                elif m := expressions[".extern"].match(statement):
+                    # Defined in another module (see `link`).
+                    result.labels.setdefault(m.group(1), (number, 0))
+                elif expressions[".main"].match(statement):
+                    if bank:
+                        result.diagnostics.append(
+                            (number, "Cannot start program in a bank.", ERROR)
+                        )
+                elif m := expressions[".incbin"].match(statement):
+                    path = self.directory / m.group(1)
+                    try:
+                        size = path.stat().st_size
+                        included = size if m.group(2) == "bytes" else (size + 1) // 2
+                    except OSError:
+                        result.diagnostics.append(
+                            (number, f"Cannot read file: '{path}'", ERROR)
+                        )
+            result.placement.append((bank, base + sizes[bank]))
+            sizes[bank] += len(line.words) + included
+
+        words, names = runtime(
+            sizes[0], {label for line in self.parsed for _, label in line.references}
+        )
+        for name, address in names.items():
+            result.labels[name] = (len(self.lines) - 1, address)
+        sizes[0] += len(words)
+
+        for number, line in enumerate(self.parsed):
+            for _, label in line.references:
+                if label not in result.labels:
+                    result.diagnostics.append(
+                        (number, f"Unrecognized label: '{label}'", ERROR)
+                    )
+        if sizes[0] > 0x100:
+            result.diagnostics.append(
+                (len(self.lines) - 1, f"Program is {sizes[0]} words long.", ERROR)
+            )
+        elif bank_numbers and sizes[0] > BANK_START:
+            result.diagnostics.append(
+                (
+                    len(self.lines) - 1,
+                    f"Program is {sizes[0]} words long, "
+                    f"overlapping banked memory at {hex(BANK_START)[2:]}.",
+                    ERROR,
+                )
+            )
+        for name, n in bank_numbers.items():
+            if sizes[n] > BANK_SIZE:
+                result.diagnostics.append(
+                    (
+                        result.labels[name][0],
+                        f"Bank '{name}' does not fit in {BANK_SIZE} words.",
+                        ERROR,
+                    )
+                )
+        return result
+
+    def word_at(self, line: int, character: int) -> str:
+        for m in finditer(r"[a-z][a-z0-9_]*", self.lines[line]):
+            if m.start() <= character <= m.end():
+                return m.group()
+        return ""
+
+    def hover(self, line: int, character: int) -> str | None:
+        """
+        Describes the words a line assembles to.
+        """
+        if line >= len(self.lines):
+            return None
+        layout = self.layout()
+        word = self.word_at(line, character)
+        parsed = self.parsed[line]
+        if not parsed.words:
+            if word in layout.labels:
+                number, address = layout.labels[word]
+                return f"`{word}`: {hex(address)[2:].rjust(2, '0')} (line {number + 1})"
+            return None
+        bank, start = layout.placement[line]
+        words = parsed.words[:]
+        for index, label in parsed.references:
+            if label in layout.labels:
+                words[index] |= layout.labels[label][1] & 0xFF
+        result = "```txt\n"
+        if bank:
+            result += f"Bank {bank}\n"
+        for i, v in enumerate(words):
+            pseudo = ToyComputer.as_pseudocode(v)
+            result += (
+                f"{hex(start + i)[2:].rjust(2, '0')}: {hex(v)[2:].rjust(4, '0')}"
+                f"  {pseudo if pseudo else 'halt'}\n"
+            )
+        return result + "```"
+
+    def definition(self, line: int, character: int) -> int | None:
+        """
+        Returns the line on which the label under the cursor is defined.
+        """
+        if line >= len(self.lines):
+            return None
+        word = self.word_at(line, character)
+        labels = self.layout().labels
+        return labels[word][0] if word in labels else None
+
+
+class LanguageServer:
+    """
+    A language server for Toy assembly, speaking JSON-RPC over stdio,
+    that reports problems as documents change and provides hover (the
+    machine words a line assembles to) and go to definition for labels.
+    """
+
+    def __init__(
+        self, reader: BinaryIO = stdin.buffer, writer: BinaryIO = stdout.buffer
+    ) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.documents = dict[str, Document]()
+        self.running = True
+
+    def receive(self) -> bytes | None:
+        """
+        Reads the body of the next message (empty if its length is
+        missing or malformed), or returns None at the end of input.
+        """
+        length = 0
+        while True:
+            header = self.reader.readline()
+            if not header:
+                return None
+            header = header.strip()
+            if not header:
+                break
+            name, _, value = header.decode(errors="replace").partition(":")
+            if name.lower() == "content-length":
+                try:
+                    length = max(int(value), 0)
+                except ValueError:
+                    length = 0
+        return self.reader.read(length)
+
+    def send(self, message: dict) -> None:
+        body = dumps({"jsonrpc": "2.0", **message}).encode()
+        self.writer.write(f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        self.writer.flush()
+
+    @staticmethod
+    def directory(uri: str) -> Path:
+        """
+        The directory holding a document, for finding `.incbin` files.
+        """
+        parts = urlparse(uri)
+        return Path(unquote(parts.path)).parent if parts.scheme == "file" else Path()
+
+    def publish(self, uri: str) -> None:
+        document = self.documents[uri]
+        diagnostics = [
+            {
+                "range": {
+                    "start": {"line": line, "character": 0},
+                    "end": {"line": line, "character": len(document.lines[line])},
+                },
+                "severity": severity,
+                "source": "toy",
+                "message": message,
+            }
+            for line, message, severity in document.layout().diagnostics
+        ]
+        self.send(
+            {
+                "method": "textDocument/publishDiagnostics",
+                "params": {"uri": uri, "diagnostics": diagnostics},
+            }
+        )
+
+    def handle(self, message: dict) -> None:
+        method = message.get("method")
+        params = message.get("params", {})
+        result = None
+        match method:
+            case "initialize":
+                result = {
+                    "capabilities": {
+                        "textDocumentSync": {"openClose": True, "change": 2},
+                        "hoverProvider": True,
+                        "definitionProvider": True,
+                    },
+                    "serverInfo": {"name": "toy"},
+                }
+            case "shutdown":
+                pass
+            case "exit":
+                self.running = False
+                return
+            case "textDocument/didOpen":
+                uri = params["textDocument"]["uri"]
+                self.documents[uri] = Document(
+                    params["textDocument"]["text"], self.directory(uri)
+                )
+                self.publish(uri)
+            case "textDocument/didChange":
+                uri = params["textDocument"]["uri"]
+                document = self.documents.get(uri)
+                if document is None:
+                    # Never opened, so there is nothing to change.
+                    return
+                for change in params["contentChanges"]:
+                    if "range" in change:
+                        start, end = change["range"]["start"], change["range"]["end"]
+                        document.replace(
+                            start["line"],
+                            start["character"],
+                            end["line"],
+                            end["character"],
+                            change["text"],
+                        )
+                    else:
+                        self.documents[uri] = document = Document(
+                            change["text"], self.directory(uri)
+                        )
+                self.publish(uri)
+            case "textDocument/didClose":
+                self.documents.pop(params["textDocument"]["uri"], None)
+            case "textDocument/hover":
+                document = self.documents.get(params["textDocument"]["uri"])
+                position = params["position"]
+                text = document and document.hover(
+                    position["line"], position["character"]
+                )
+                if text:
+                    result = {"contents": {"kind": "markdown", "value": text}}
+            case "textDocument/definition":
+                uri = params["textDocument"]["uri"]
+                document = self.documents.get(uri)
+                position = params["position"]
+                line = document and document.definition(
+                    position["line"], position["character"]
+                )
+                if line is not None:
+                    point = {"line": line, "character": 0}
+                    result = {"uri": uri, "range": {"start": point, "end": point}}
+            case _ if "id" in message:
+                self.send(
+                    {
+                        "id": message["id"],
+                        "error": {
+                            "code": -32601,
+                            "message": f"Unknown method: {method}",
+                        },
+                    }
+                )
+                return
+        if "id" in message:
+            self.send({"id": message["id"], "result": result})
+
+    def serve(self) -> None:
+        while self.running:
+            body = self.receive()
+            if body is None:
+                break
+            try:
+                message = loads(body)
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                self.send(
+                    {"id": None, "error": {"code": -32700, "message": "Parse error"}}
+                )
+                continue
+            try:
+                self.handle(message)
+            except Exception as e:
+                # A message that cannot be handled fails alone, rather
+                # than stopping the server.
+                if "id" in message:
+                    self.send(
+                        {
+                            "id": message["id"],
+                            "error": {"code": -32603, "message": repr(e)},
+                        }
+                    )
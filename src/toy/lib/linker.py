@@ -0,0 +1,221 @@
+from dataclasses import asdict, dataclass, field
+from hashlib import sha256
+from json import dumps, loads
+from os import replace
+from pathlib import Path
+
+from .assembler import (
+    DESCRIPTOR,
+    Assembled,
+    expressions,
+    parse_program,
+    runtime,
+    split_line,
+)
+from .exception import ToyException
+
+# Changed whenever objects change, so that modules assembled before are
+# assembled again.
+FORMAT = 2
+
+
+@dataclass
+class ObjectModule:
+    """
+    A module of assembly, assembled as if it were placed at address 0.
+
+    The low byte of each word in `relocations` is an address in the
+    module, to which the address the module is placed at is added. Each
+    word listed in `externals` is completed with the address of a label
+    defined in another module (declared with `.extern`) or of something
+    the assembler places after the program. `symbols` holds the labels
+    the module makes available to others (declared with `.global`).
+    """
+
+    name: str
+    words: list[int]
+    pc: int | None = None
+    symbols: dict[str, int] = field(default_factory=dict)
+    relocations: list[int] = field(default_factory=list)
+    externals: dict[str, list[int]] = field(default_factory=dict)
+    coprocessor: bool = False
+    timer: bool = False
+    polling: bool = False
+
+    def to_json(self) -> str:
+        return dumps(asdict(self))
+
+    @staticmethod
+    def from_json(text: str) -> "ObjectModule":
+        return ObjectModule(**loads(text))
+
+
+def assemble_object(
+    code: str, name: str = "", directory: str | Path = "."
+) -> ObjectModule:
+    """
+    Assembles a module of a program that is linked from several (see
+    `link`). Banks cannot be used in a module.
+    """
+    program = parse_program(code, directory=directory)
+    if program.banks:
+        raise ToyException(f"Banks cannot be used in a module ('{name}').")
+    module = ObjectModule(
+        name,
+        program.words,
+        program.pc,
+        coprocessor=program.coprocessor,
+        timer=program.timer,
+        polling=program.polling,
+    )
+    for label in program.exported:
+        if label not in program.labels:
+            raise ToyException(f"Global label not defined: '{label}'.")
+        module.symbols[label] = program.labels[label]
+    for label in program.imported:
+        if label in program.labels:
+            raise ToyException(f"Duplicate label: '{label}'.")
+    for label, references in program.addresses.items():
+        indexes = [index for _, index in references]
+        if label in program.labels:
+            address = program.labels[label]
+            for index in indexes:
+                module.words[index] |= address
+            module.relocations += indexes
+        elif label in program.imported or label.startswith("."):
+            module.externals[label] = indexes
+        else:
+            raise ToyException(f"Unrecognized label: '{label}'")
+    module.relocations.sort()
+    return module
+
+
+def link(modules: list[ObjectModule], show_addresses: bool = False) -> Assembled:
+    """
+    Places modules one after another (followed by anything the assembler
+    places after a program), completing each reference between them.
+    The program starts at the module with `.main` (or at address 0).
+    """
+    symbols = dict[str, int]()
+    bases = list[int]()
+    size = 0
+    pc = None
+    for module in modules:
+        bases.append(size)
+        for label, address in module.symbols.items():
+            if label in symbols:
+                raise ToyException(f"Duplicate global label: '{label}'.")
+            symbols[label] = size + address
+        if module.pc is not None:
+            if pc is not None:
+                raise ToyException(
+                    f"More than one module has .main ('{module.name}')."
+                )
+            pc = size + module.pc
+        size += len(module.words)
+
+    referenced = {label for module in modules for label in module.externals}
+    extra, names = runtime(size, referenced)
+    symbols |= names
+
+    words = list[int]()
+    for module, base in zip(modules, bases):
+        code = module.words[:]
+        for index in module.relocations:
+            if (code[index] & 0xFF) + base > 0xFF:
+                raise ToyException(f"Module '{module.name}' does not fit in memory.")
+            code[index] += base
+        for label, indexes in module.externals.items():
+            if label not in symbols:
+                raise ToyException(
+                    f"Unresolved external label: '{label}' (in '{module.name}')."
+                )
+            for index in indexes:
+                code[index] |= symbols[label]
+        words += code
+    words += extra
+
+    if show_addresses:
+        print("\nAddress Mappings:\n")
+        for label, v in symbols.items():
+            print(f"  {label}: {hex(v)[2:].rjust(2, "0")}")
+        print()
+    return Assembled(
+        "",
+        pc or 0,
+        words,
+        symbols,
+        coprocessor=any(module.coprocessor for module in modules),
+        dma=DESCRIPTOR[0] in referenced,
+        timer=any(module.timer for module in modules),
+        polling=any(module.polling for module in modules),
+    )
+
+
+class Linker:
+    """
+    Assembles and links programs made of several modules (source files),
+    keeping each module's object by the hash of its source (and of any
+    files it includes), in memory and, if `directory` is given, on disk,
+    so that only modules that changed are assembled again.
+    """
+
+    def __init__(self, directory: str | Path | None = None) -> None:
+        self.objects = dict[str, ObjectModule]()
+        self.directory = None if directory is None else Path(directory)
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        # The number of modules assembled (rather than found).
+        self.assembled = 0
+
+    @staticmethod
+    def key(path: Path, code: str) -> str:
+        digest = sha256(f"{FORMAT}\n{path.name}\n{code}".encode())
+        for line in code.splitlines():
+            for statement in split_line(line):
+                if m := expressions[".incbin"].match(statement):
+                    try:
+                        digest.update((path.parent / m.group(1)).read_bytes())
+                    except OSError:
+                        pass
+        return digest.hexdigest()
+
+    def load(self, path: str | Path) -> ObjectModule:
+        """
+        Returns the object of the module at `path`, assembling it only if
+        it is not already known.
+        """
+        path = Path(path)
+        try:
+            code = path.read_text()
+        except OSError:
+            raise ToyException(f"File '{path}' not found...")
+        key = self.key(path, code)
+        if key in self.objects:
+            return self.objects[key]
+        if self.directory is not None:
+            try:
+                module = ObjectModule.from_json(
+                    (self.directory / f"{key}.json").read_text()
+                )
+                self.objects[key] = module
+                return module
+            except (OSError, ValueError, TypeError):
+                pass
+        module = assemble_object(code, path.stem, path.parent)
+        self.assembled += 1
+        self.objects[key] = module
+        if self.directory is not None:
+            target = self.directory / f"{key}.json"
+            temporary = target.with_suffix(".tmp")
+            temporary.write_text(module.to_json())
+            replace(temporary, target)
+        return module
+
+    def link(
+        self, paths: list[str | Path], show_addresses: bool = False
+    ) -> Assembled:
+        """
+        Links the modules at `paths`, in order.
+        """
+        return link([self.load(path) for path in paths], show_addresses)
@@ -0,0 +1,282 @@
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, replace as replace_fields
+from hashlib import sha256
+from itertools import chain
+from json import dumps, loads
+from os import replace, utime
+from pathlib import Path
+
+from .exception import ToyException
+from .toy_computer import ToyComputer
+
+
+@dataclass(frozen=True)
+class RunResult:
+    """
+    The output written, the final state and the number of steps
+    performed by a run.
+    """
+
+    output: str
+    pc: int
+    registers: list[int]
+    memory: list[int]
+    steps: int
+    halted: bool
+    bank: int = 0
+    banks: dict[int, list[int]] | None = None
+    # Timer interval, handler and steps until it next interrupts.
+    timer: list[int] | None = None
+    # Coprocessor operands (None if the coprocessor is disabled).
+    operands: list[int] | None = None
+
+    def to_json(self) -> str:
+        return dumps(asdict(self))
+
+    @staticmethod
+    def from_json(text: str) -> "RunResult":
+        data = loads(text)
+        if data["banks"] is not None:
+            data["banks"] = {int(n): page for n, page in data["banks"].items()}
+        return RunResult(**data)
+
+    def copy(self) -> "RunResult":
+        """
+        Returns a copy that shares no lists with this result.
+        """
+        return replace_fields(
+            self,
+            registers=self.registers[:],
+            memory=self.memory[:],
+            banks=(
+                None
+                if self.banks is None
+                else {n: page[:] for n, page in self.banks.items()}
+            ),
+            timer=None if self.timer is None else self.timer[:],
+            operands=None if self.operands is None else self.operands[:],
+        )
+
+
+def timer_state(computer: ToyComputer) -> list[int] | None:
+    if computer.interrupt_at is None:
+        return None
+    return [
+        computer.timer_interval,
+        computer.timer_handler,
+        computer.interrupt_at - computer.steps,
+    ]
+
+
+def run_key(
+    computer: ToyComputer, inputs: list[str], max_steps: int | None
+) -> str:
+    """
+    Returns a hash of everything that determines the result of a run
+    that uses no random input, including the class of computer.
+    """
+    banks = (
+        None
+        if computer.banks is None
+        else sorted((n, page) for n, page in computer.banks.items())
+    )
+    state = [
+        f"{type(computer).__module__}.{type(computer).__qualname__}",
+        computer.pc,
+        computer.registers,
+        computer.memory[:],
+        computer.bank,
+        banks,
+        computer.operands,
+        computer.dma,
+        computer.timer,
+        computer.polling,
+        timer_state(computer),
+        inputs,
+        max_steps,
+    ]
+    return sha256(dumps(state).encode()).hexdigest()
+
+
+class RunCache:
+    """
+    Results of runs, kept in memory for the `size` most recently used
+    and, if `directory` is given, on disk, where the least recently
+    used are removed once more than `disk_limit` bytes are held.
+    Results are copied going in and out, so that changing a result
+    does not change the cache.
+    """
+
+    def __init__(
+        self,
+        size: int = 0x100,
+        directory: str | Path | None = None,
+        disk_limit: int = 0x4000000,
+    ) -> None:
+        self.size = size
+        self.entries = OrderedDict[str, RunResult]()
+        self.directory = None if directory is None else Path(directory)
+        self.disk_limit = disk_limit
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> RunResult | None:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key].copy()
+        if self.directory is not None:
+            path = self.directory / f"{key}.json"
+            try:
+                result = RunResult.from_json(path.read_text())
+                utime(path)
+            except (OSError, ValueError, KeyError, TypeError):
+                result = None
+            if result is not None:
+                self.remember(key, result)
+                self.hits += 1
+                return result.copy()
+        self.misses += 1
+        return None
+
+    def put(self, key: str, result: RunResult) -> None:
+        self.remember(key, result.copy())
+        if self.directory is not None:
+            path = self.directory / f"{key}.json"
+            temporary = path.with_suffix(".tmp")
+            temporary.write_text(result.to_json())
+            replace(temporary, path)
+            self.evict()
+
+    def remember(self, key: str, result: RunResult) -> None:
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used results on disk until at most
+        `disk_limit` bytes are held.
+        """
+        assert self.directory is not None
+        files = []
+        for path in self.directory.glob("*.json"):
+            try:
+                info = path.stat()
+            except OSError:
+                continue
+            files.append((info.st_mtime, info.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_limit:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self) -> None:
+        self.entries.clear()
+        if self.directory is not None:
+            for path in self.directory.glob("*.json"):
+                path.unlink(missing_ok=True)
+
+
+def memoized_run(
+    computer: ToyComputer,
+    inputs: list[str] = [],
+    cache: RunCache | None = None,
+    max_steps: int | None = None,
+) -> RunResult:
+    """
+    Runs `computer` (as `ToyComputer.run`), reading lines of input
+    (for F0, F2 and FB, all of them waiting from the start) from
+    `inputs`, and returns the output written and
+    the final state.
+
+    If an identical run (the same state and inputs) is in `cache`, the
+    computer is instead set to the stored final state and the stored
+    output is written. Runs that use random input (FA) are not stored.
+    """
+    key = run_key(computer, inputs, max_steps)
+    result = None if cache is None else cache.get(key)
+    if result is not None:
+        computer.pc = result.pc
+        computer.registers[:] = result.registers
+        computer.memory[:] = result.memory
+        computer.steps += result.steps
+        computer.bank = result.bank
+        if result.banks is not None:
+            computer.banks = {n: page[:] for n, page in result.banks.items()}
+        if result.timer is None:
+            computer.set_timer(0)
+        else:
+            interval, handler, remaining = result.timer
+            computer.set_timer(interval, handler)
+            computer.interrupt_at = computer.steps + remaining
+        if result.operands is not None:
+            computer.operands = result.operands[:]
+        computer.write(result.output)
+        return result
+
+    output = list[str]()
+    original_write, original_random_word = computer.write, computer.random_word
+    remaining = iter(inputs)
+    used_random = False
+
+    def read_line() -> str:
+        line = next(remaining, None)
+        if line is None:
+            raise ToyException("Ran out of input...")
+        return line
+
+    def input_pending() -> bool:
+        nonlocal remaining
+        line = next(remaining, None)
+        if line is None:
+            return False
+        remaining = chain([line], remaining)
+        return True
+
+    def poll_line() -> str | None:
+        return read_line() if input_pending() else None
+
+    def write(text: str) -> None:
+        output.append(text)
+        original_write(text)
+
+    def random_word() -> int:
+        nonlocal used_random
+        used_random = True
+        return original_random_word()
+
+    computer.read_line, computer.write = read_line, write
+    computer.input_pending, computer.poll_line = input_pending, poll_line
+    computer.random_word = random_word
+    steps = computer.steps
+    try:
+        halted = computer.run(max_steps)
+    finally:
+        del computer.read_line, computer.write, computer.random_word
+        del computer.input_pending, computer.poll_line
+
+    result = RunResult(
+        "".join(output),
+        computer.pc,
+        computer.registers[:],
+        computer.memory[:],
+        computer.steps - steps,
+        halted,
+        computer.bank,
+        (
+            None
+            if computer.banks is None
+            else {n: page[:] for n, page in computer.banks.items()}
+        ),
+        timer_state(computer),
+        None if computer.operands is None else computer.operands[:],
+    )
+    if cache is not None and not used_random:
+        cache.put(key, result)
+    return result
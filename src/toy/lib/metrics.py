@@ -0,0 +1,197 @@
+from atexit import register
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from pathlib import Path
+from threading import Lock, Thread
+from time import perf_counter
+
+from .assembler import Assembled, assemble
+from .exception import ToyException
+from .toy_computer import ToyComputer
+
+# Upper bounds (in seconds) of the latency histograms' buckets.
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# How a run ended: halting, running out of steps or raising ToyException.
+HALTED, EXHAUSTED, FAILED = "halted", "exhausted", "error"
+
+
+class Histogram:
+    """
+    Counts of observed values at or below each bucket's upper bound,
+    as in Prometheus, with their sum.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": {str(b): n for b, n in zip(self.buckets, self.counts)},
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+    def to_prometheus(self, name: str) -> list[str]:
+        return [
+            f"# TYPE {name} histogram",
+            *(
+                f'{name}_bucket{{le="{b}"}} {n}'
+                for b, n in zip(self.buckets, self.counts)
+            ),
+            f'{name}_bucket{{le="+Inf"}} {self.count}',
+            f"{name}_sum {self.sum}",
+            f"{name}_count {self.count}",
+        ]
+
+
+class Metrics:
+    """
+    Counts of programs assembled and runs (with how they ended), the
+    instructions executed and histograms of the time taken, gathered by
+    using `assemble` and `run` in place of the library's `assemble` and
+    `ToyComputer.run` (or, for runs made elsewhere, `record_run`):
+
+    ```py
+    metrics = Metrics()
+    metrics.serve(9100)
+    metrics.dump_at_exit("metrics.json")
+    assembled = metrics.assemble(code)
+    ...
+    metrics.run(computer, max_steps=10000)
+    ```
+
+    Nothing is counted (or slowed) otherwise. Metrics can be shared
+    between threads.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.lock = Lock()
+        self.assembled = 0
+        self.assembly_errors = 0
+        self.assembly_seconds = Histogram(buckets)
+        self.instructions = 0
+        self.outcomes = Counter[str]({HALTED: 0, EXHAUSTED: 0, FAILED: 0})
+        self.run_seconds = Histogram(buckets)
+
+    @property
+    def instructions_per_second(self) -> float:
+        seconds = self.run_seconds.sum
+        return self.instructions / seconds if seconds else 0.0
+
+    def assemble(self, code: str, *args, **kwargs) -> Assembled:
+        """
+        Calls `assemble`, counting the program and the time taken.
+        """
+        start = perf_counter()
+        try:
+            result = assemble(code, *args, **kwargs)
+        except ToyException:
+            with self.lock:
+                self.assembly_errors += 1
+            raise
+        seconds = perf_counter() - start
+        with self.lock:
+            self.assembled += 1
+            self.assembly_seconds.observe(seconds)
+        return result
+
+    def run(self, computer: ToyComputer, max_steps: int | None = None) -> bool:
+        """
+        Calls `computer.run(max_steps)`, counting the instructions
+        executed, how the run ended and the time taken.
+        """
+        steps, start = computer.steps, perf_counter()
+        try:
+            halted = computer.run(max_steps)
+        except ToyException:
+            self.record_run(computer.steps - steps, perf_counter() - start, FAILED)
+            raise
+        outcome = HALTED if halted else EXHAUSTED
+        self.record_run(computer.steps - steps, perf_counter() - start, outcome)
+        return halted
+
+    def record_run(self, instructions: int, seconds: float, outcome: str) -> None:
+        with self.lock:
+            self.instructions += instructions
+            self.outcomes[outcome] += 1
+            self.run_seconds.observe(seconds)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "programs_assembled": self.assembled,
+                "assembly_errors": self.assembly_errors,
+                "assembly_seconds": self.assembly_seconds.to_dict(),
+                "instructions": self.instructions,
+                "instructions_per_second": self.instructions_per_second,
+                "runs": dict(self.outcomes),
+                "run_seconds": self.run_seconds.to_dict(),
+            }
+
+    def to_json(self) -> str:
+        return dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """
+        Returns the metrics in Prometheus' text exposition format.
+        """
+        with self.lock:
+            lines = [
+                "# TYPE toy_programs_assembled_total counter",
+                f"toy_programs_assembled_total {self.assembled}",
+                "# TYPE toy_assembly_errors_total counter",
+                f"toy_assembly_errors_total {self.assembly_errors}",
+                *self.assembly_seconds.to_prometheus("toy_assembly_seconds"),
+                "# TYPE toy_instructions_total counter",
+                f"toy_instructions_total {self.instructions}",
+                "# TYPE toy_instructions_per_second gauge",
+                f"toy_instructions_per_second {self.instructions_per_second}",
+                "# TYPE toy_runs_total counter",
+                *(
+                    f'toy_runs_total{{outcome="{outcome}"}} {n}'
+                    for outcome, n in self.outcomes.items()
+                ),
+                *self.run_seconds.to_prometheus("toy_run_seconds"),
+            ]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9100, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+        Serves the metrics in Prometheus' format (at any path) from a
+        background thread, returning the server.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def dump_at_exit(self, path: str | Path) -> None:
+        """
+        Writes the metrics as JSON to `path` when the interpreter exits.
+        """
+        register(lambda: Path(path).write_text(self.to_json() + "\n"))
@@ -0,0 +1,90 @@
+from collections import Counter
+from dataclasses import dataclass, field
+
+from .assembler import Assembled
+from .timing import TimingModel, timed_step
+from .toy_computer import BANK_END, BANK_START, ToyComputer
+
+
+@dataclass
+class Profile:
+    """
+    Instructions executed and cycles spent, attributed to source lines
+    (by line number) and to labels.
+    """
+
+    line_executions: Counter[int] = field(default_factory=Counter)
+    line_cycles: Counter[int] = field(default_factory=Counter)
+    label_executions: Counter[str] = field(default_factory=Counter)
+    label_cycles: Counter[str] = field(default_factory=Counter)
+    cycles: int = 0
+    instructions: int = 0
+
+    @property
+    def heat(self) -> dict[int, float]:
+        """
+        The share of cycles spent on each line.
+        """
+        total = sum(self.line_cycles.values())
+        return {n: c / total for n, c in self.line_cycles.items()} if total else {}
+
+    def annotate(self, code: str) -> str:
+        """
+        Returns the source with executions, cycles and share of cycles
+        shown beside each line, followed by totals for each label.
+        """
+        heat = self.heat
+        result = f"{'Count':>8} {'Cycles':>8} {'%':>6}\n"
+        for number, line in enumerate(code.splitlines(), 1):
+            if number in self.line_executions:
+                result += (
+                    f"{self.line_executions[number]:>8} "
+                    f"{self.line_cycles[number]:>8} "
+                    f"{100 * heat.get(number, 0.0):>6.1f} {line}\n"
+                )
+            else:
+                result += f"{'':>24} {line}\n"
+        result += f"\n{'Count':>8} {'Cycles':>8} {'%':>6} Label\n"
+        for label, cycles in self.label_cycles.most_common():
+            result += (
+                f"{self.label_executions[label]:>8} {cycles:>8} "
+                f"{100 * cycles / self.cycles if self.cycles else 0:>6.1f} {label}\n"
+            )
+        return result + f"\nCycles: {self.cycles}\nInstructions: {self.instructions}\n"
+
+
+def profile_run(
+    computer: ToyComputer,
+    assembled: Assembled,
+    model: TimingModel | None = None,
+    max_steps: int | None = None,
+) -> Profile:
+    """
+    Runs `computer` (loaded with `assembled`) through a timing model,
+    attributing each executed instruction and its cycles to the source
+    line it was assembled from.
+    """
+    if model is None:
+        model = TimingModel()
+    result = Profile()
+    source_map = assembled.source_map
+    steps = 0
+    while max_steps is None or steps < max_steps:
+        steps += 1
+        address = computer.pc
+        bank = computer.bank if BANK_START <= address < BANK_END else 0
+        cycles = model.report.cycles
+        more = timed_step(computer, model)
+        location = source_map.get((bank, address))
+        if location is not None:
+            added = model.report.cycles - cycles
+            result.line_executions[location.line] += 1
+            result.line_cycles[location.line] += added
+            label = location.label or ""
+            result.label_executions[label] += 1
+            result.label_cycles[label] += added
+        if not more:
+            break
+    result.cycles = model.report.cycles
+    result.instructions = model.report.instructions
+    return result
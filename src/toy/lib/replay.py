@@ -0,0 +1,215 @@
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from sys import byteorder
+from typing import Iterator
+
+from .exception import ToyException
+from .toy_computer import ToyComputer
+
+# Kinds of input: a random word (FA), a line read (F0 and FB), whether
+# input was waiting (F1) and a line (or None) polled for (F2).
+RANDOM, LINE, PENDING, POLL = range(4)
+KIND_NAMES = {
+    RANDOM: "a random word",
+    LINE: "a line of input",
+    PENDING: "the input status",
+    POLL: "a poll for input",
+}
+
+# Tags of the binary log, which starts with MAGIC.
+MAGIC = b"TOYLOG\x01"
+RANDOM_RUN, LINE_TAG, NOT_PENDING, IS_PENDING, POLL_NONE, POLL_LINE = range(6)
+
+# The methods through which a computer takes its inputs.
+HOOKS = ("next_line", "random_word", "input_pending", "poll_line")
+
+
+def write_size(result: bytearray, n: int) -> None:
+    # Seven bits per byte, least significant first.
+    while n >= 0x80:
+        result.append((n & 0x7F) | 0x80)
+        n >>= 7
+    result.append(n)
+
+
+def read_size(data: bytes, i: int) -> tuple[int, int]:
+    n = shift = 0
+    while True:
+        byte = data[i]
+        i += 1
+        n |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return n, i
+
+
+@dataclass
+class InputLog:
+    """
+    The inputs a run took, in order, as (kind, value) pairs.
+    """
+
+    entries: list[tuple[int, int | str | bool | None]] = field(default_factory=list)
+
+    def to_bytes(self) -> bytes:
+        """
+        Encodes the log compactly: runs of random words as two bytes
+        each and lines as their length and UTF-8 encoding.
+        """
+        result = bytearray(MAGIC)
+        i = 0
+        while i < len(self.entries):
+            kind, value = self.entries[i]
+            i += 1
+            if kind == RANDOM:
+                words = array("H", [value])  # type: ignore
+                while i < len(self.entries) and self.entries[i][0] == RANDOM:
+                    words.append(self.entries[i][1])  # type: ignore
+                    i += 1
+                if byteorder == "little":
+                    words.byteswap()
+                result.append(RANDOM_RUN)
+                write_size(result, len(words))
+                result += words.tobytes()
+            elif kind == PENDING:
+                result.append(IS_PENDING if value else NOT_PENDING)
+            elif kind == POLL and value is None:
+                result.append(POLL_NONE)
+            else:
+                encoded = str(value).encode()
+                result.append(LINE_TAG if kind == LINE else POLL_LINE)
+                write_size(result, len(encoded))
+                result += encoded
+        return bytes(result)
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "InputLog":
+        if not data.startswith(MAGIC):
+            raise ToyException("Not an input log...")
+        log = InputLog()
+        i = len(MAGIC)
+        while i < len(data):
+            tag = data[i]
+            i += 1
+            if tag == RANDOM_RUN:
+                n, i = read_size(data, i)
+                words = array("H", data[i : i + 2 * n])
+                if byteorder == "little":
+                    words.byteswap()
+                log.entries += [(RANDOM, word) for word in words]
+                i += 2 * n
+            elif tag in (NOT_PENDING, IS_PENDING):
+                log.entries.append((PENDING, tag == IS_PENDING))
+            elif tag == POLL_NONE:
+                log.entries.append((POLL, None))
+            elif tag in (LINE_TAG, POLL_LINE):
+                n, i = read_size(data, i)
+                line = data[i : i + n].decode()
+                log.entries.append((LINE if tag == LINE_TAG else POLL, line))
+                i += n
+            else:
+                raise ToyException("Corrupt input log...")
+        return log
+
+    def save(self, path: str | Path) -> None:
+        Path(path).write_bytes(self.to_bytes())
+
+    @staticmethod
+    def load(path: str | Path) -> "InputLog":
+        return InputLog.from_bytes(Path(path).read_bytes())
+
+
+@contextmanager
+def patched(computer: ToyComputer, hooks: dict) -> Iterator[None]:
+    """
+    Replaces methods of a computer while in the context, restoring
+    any that were already replaced on leaving it.
+    """
+    saved = {name: computer.__dict__.get(name) for name in hooks}
+    for name, hook in hooks.items():
+        setattr(computer, name, hook)
+    try:
+        yield
+    finally:
+        for name, hook in saved.items():
+            if hook is None:
+                delattr(computer, name)
+            else:
+                setattr(computer, name, hook)
+
+
+@contextmanager
+def recording(computer: ToyComputer) -> Iterator[InputLog]:
+    """
+    Records every input `computer` takes while in the context:
+
+    ```py
+    with recording(computer) as log:
+        computer.run()
+    log.save("run.toylog")
+    ```
+    """
+    log = InputLog()
+    original = {name: getattr(computer, name) for name in HOOKS}
+
+    def next_line() -> str:
+        line = original["next_line"]()
+        log.entries.append((LINE, line))
+        return line
+
+    def random_word() -> int:
+        word = original["random_word"]()
+        log.entries.append((RANDOM, word))
+        return word
+
+    def input_pending() -> bool:
+        pending = original["input_pending"]()
+        log.entries.append((PENDING, pending))
+        return pending
+
+    def poll_line() -> str | None:
+        line = original["poll_line"]()
+        log.entries.append((POLL, line))
+        return line
+
+    hooks = dict(zip(HOOKS, (next_line, random_word, input_pending, poll_line)))
+    with patched(computer, hooks):
+        yield log
+
+
+@contextmanager
+def replaying(computer: ToyComputer, log: InputLog) -> Iterator[None]:
+    """
+    Gives `computer` the inputs in `log` (rather than reading them or
+    generating random words) while in the context. Raises a
+    `ToyException` if the program asks for an input other than the next
+    one recorded.
+    """
+    entries = iter(log.entries)
+
+    def take(kind: int):
+        entry = next(entries, None)
+        if entry is None:
+            raise ToyException("Ran out of recorded input...")
+        if entry[0] != kind:
+            raise ToyException(
+                f"Expected the program to ask for {KIND_NAMES[entry[0]]}, "
+                f"not {KIND_NAMES[kind]}..."
+            )
+        return entry[1]
+
+    hooks = dict(
+        zip(
+            HOOKS,
+            (
+                lambda: take(LINE),
+                lambda: take(RANDOM),
+                lambda: take(PENDING),
+                lambda: take(POLL),
+            ),
+        )
+    )
+    with patched(computer, hooks):
+        yield
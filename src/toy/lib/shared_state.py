@@ -0,0 +1,166 @@
+from array import array
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from sys import version_info
+from time import monotonic
+
+from .image import ProgramImage
+from .toy_computer import ToyComputer
+
+# Segment layout: an eight byte sequence counter followed by the
+# program counter, the 16 registers and the 256 memory words.
+SEQUENCE_SIZE = 8
+WORDS = 1 + 0x10 + 0x100
+SEGMENT_SIZE = SEQUENCE_SIZE + 2 * WORDS
+
+# Steps run between checks for whether the mirror is due a refresh.
+CHUNK = 0x400
+
+
+def attach(name: str) -> SharedMemory:
+    """
+    Attaches to an existing segment without letting this process's
+    resource tracker unlink it at exit.
+    """
+    if version_info >= (3, 13):
+        return SharedMemory(name, track=False)
+    segment = SharedMemory(name)
+    resource_tracker.unregister(segment._name, "shared_memory")  # type: ignore
+    return segment
+
+
+class SharedToyComputer(ToyComputer):
+    """
+    A computer that mirrors its program counter, registers and memory
+    into a named shared memory segment so that other local processes
+    can read the live state.
+
+    `run` runs in chunks of `CHUNK` steps, refreshing the mirror
+    between chunks once `period` seconds have passed since the last
+    refresh, so that each step is not slowed and the mirror always
+    holds the state between two steps. The mirror is also refreshed
+    before checking or waiting for input and when a run ends (steps
+    taken one at a time with `step` are only mirrored then). The
+    sequence counter is odd while the mirror is being refreshed, so
+    readers can detect and retry torn reads.
+    """
+
+    def __init__(
+        self,
+        name: str | None = None,
+        period: float = 1 / 60,
+        banked: bool = False,
+    ) -> None:
+        self.segment = SharedMemory(name, create=True, size=SEGMENT_SIZE)
+        self.sequence = self.segment.buf[:SEQUENCE_SIZE].cast("Q")
+        self.words = self.segment.buf[SEQUENCE_SIZE:SEGMENT_SIZE].cast("H")
+        self.period = period
+        self.next_publish = 0.0
+        super().__init__(banked)
+        self.publish()
+
+    @property
+    def name(self) -> str:
+        return self.segment.name
+
+    def publish(self) -> None:
+        """
+        Copies the current state into the shared segment.
+        """
+        self.sequence[0] += 1
+        self.words[0] = self.pc
+        self.words[1:0x11] = array("H", self.registers)
+        self.words[0x11:] = array("H", self.memory)
+        self.sequence[0] += 1
+        self.next_publish = monotonic() + self.period
+
+    def run(self, max_steps: int | None = None) -> bool:
+        limit = None if max_steps is None else self.steps + max_steps
+        try:
+            while True:
+                chunk = CHUNK if limit is None else min(CHUNK, limit - self.steps)
+                if chunk <= 0:
+                    return self.halted
+                if super().run(chunk):
+                    return True
+                if monotonic() >= self.next_publish:
+                    self.publish()
+        finally:
+            self.publish()
+
+    def load(self, memory_address: int, register_address: int) -> None:
+        if memory_address in (0xF0, 0xF1, 0xF2, 0xFB):
+            self.publish()
+        super().load(memory_address, register_address)
+
+    def set_state(
+        self,
+        pc: int,
+        ram: list[int] | ProgramImage,
+        registers: list[int] = [],
+        banks: dict[int, list[int]] = {},
+        coprocessor: bool = False,
+        dma: bool = False,
+        timer: bool = False,
+        polling: bool = False,
+    ) -> None:
+        super().set_state(
+            pc, ram, registers, banks, coprocessor, dma, timer, polling
+        )
+        self.publish()
+
+    def clear(self) -> None:
+        super().clear()
+        self.publish()
+
+    def close(self) -> None:
+        """
+        Releases and removes the shared segment. The computer should
+        not be used afterwards.
+        """
+        for view in (self.sequence, self.words):
+            view.release()
+        self.segment.close()
+        self.segment.unlink()
+
+
+@dataclass
+class StateSnapshot:
+    sequence: int
+    pc: int
+    registers: list[int]
+    memory: list[int]
+
+
+class SharedStateReader:
+    """
+    Reads consistent snapshots of the state of a `SharedToyComputer`
+    running in another process.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.segment = attach(name)
+        self.sequence = self.segment.buf[:SEQUENCE_SIZE].cast("Q")
+        self.words = self.segment.buf[SEQUENCE_SIZE:SEGMENT_SIZE].cast("H")
+
+    def snapshot(self, retries: int = 1000) -> StateSnapshot | None:
+        """
+        Returns a copy of the state as last mirrored (between steps, or
+        while waiting for input, at most about `period` seconds ago
+        while running), or None if no untorn copy could be read within
+        `retries` attempts.
+        """
+        for _ in range(retries):
+            before = self.sequence[0]
+            if before & 1:
+                continue
+            words = self.words.tolist()
+            if self.sequence[0] == before:
+                return StateSnapshot(before, words[0], words[1:0x11], words[0x11:])
+        return None
+
+    def close(self) -> None:
+        for view in (self.sequence, self.words):
+            view.release()
+        self.segment.close()
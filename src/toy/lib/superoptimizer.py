@@ -0,0 +1,308 @@
+from json import dumps, loads
+from pathlib import Path
+from random import Random
+
+from .timing import registers_used
+from .toy_computer import ToyComputer
+
+# Registers used by pseudo-instructions for scratch work. Their values
+# after a line are not kept unless the line leaves its result in one.
+SCRATCH = (0xD, 0xE, 0xF)
+
+# Values tried with instruction 7 besides those in the sequence itself.
+CONSTANTS = (0x00, 0x01, 0x02, 0x08, 0x0F, 0x10, 0xFF)
+
+# Operations that treat each bit of their operands independently.
+BITWISE = {0x3, 0x4, 0x7}
+
+OPERATIONS = {
+    0x1: lambda a, b: (a + b) & 0xFFFF,
+    0x2: lambda a, b: (a - b) & 0xFFFF,
+    0x3: lambda a, b: a & b,
+    0x4: lambda a, b: a ^ b,
+    0x5: lambda a, b: (a << b) & 0xFFFF if b < 0x10 else 0,
+    0x6: lambda a, b: a >> b,
+}
+
+
+def straight(words: list[int]) -> bool:
+    """
+    Whether every word is an arithmetic, logic or load address
+    instruction (so a sequence of them runs straight through).
+    """
+    return all(0x1 <= word >> 12 <= 0x7 for word in words)
+
+
+def inputs(words: list[int]) -> list[int]:
+    """
+    Returns the registers read before they are written.
+    """
+    result, written = list[int](), set[int]()
+    for word in words:
+        read, wrote = registers_used(word)
+        result += [r for r in read if r not in written and r not in result]
+        written.update(wrote)
+    return result
+
+
+def outputs(words: list[int]) -> list[int]:
+    """
+    Returns the registers whose values after a line must be kept: those
+    it uses other than scratch registers and the one it writes last.
+    """
+    result = list[int]()
+    for word in words:
+        read, wrote = registers_used(word)
+        result += [r for r in read + wrote if r not in SCRATCH and r not in result]
+    last = (words[-1] >> 8) & 0xF
+    return result if last in result else result + [last]
+
+
+def execute(words: list[int], registers: list[int]) -> list[int]:
+    """
+    Runs straight-line code on a copy of `registers`.
+    """
+    registers = registers[:]
+    for word in words:
+        op, d, s, t, addr = ToyComputer.decode(word)
+        if op == 0x7:
+            registers[d] = addr
+        else:
+            registers[d] = OPERATIONS[op](registers[s], registers[t])
+    return registers
+
+
+def equivalent(target: list[int], candidate: list[int]) -> bool | None:
+    """
+    Checks for every value of the registers read by either sequence
+    that they leave the same values in the registers `target` keeps.
+    Returns None if there are too many values to check.
+
+    Sequences of bitwise operations are checked one bit position at a
+    time, so only each combination of all zero or all one inputs needs
+    to be tried. Otherwise at most one register can be read.
+    """
+    read = sorted(set(inputs(target)) | set(inputs(candidate)))
+    kept = outputs(target)
+    if {word >> 12 for word in target + candidate} <= BITWISE and len(read) <= 12:
+        values = (
+            [0xFFFF if (n >> i) & 1 else 0 for i in range(len(read))]
+            for n in range(1 << len(read))
+        )
+    elif len(read) <= 1:
+        values = ([v] for v in range(0x10000)) if read else iter([[]])
+    else:
+        return None
+    registers = [0] * 0x10
+    for chosen in values:
+        for r, v in zip(read, chosen):
+            registers[r] = v
+        expected = execute(target, registers)
+        actual = execute(candidate, registers)
+        if any(expected[r] != actual[r] for r in kept):
+            return False
+    return True
+
+
+def superoptimize(
+    target: list[int], max_length: int = 3, samples: int = 16, seed: int = 0
+) -> list[int] | None:
+    """
+    Searches for the shortest sequence, shorter than `target` and of at
+    most `max_length` words, that keeps the same results, using only the
+    registers `target` uses. Returns it, or None if none is found.
+
+    Candidates are built up a word at a time and run on `samples` random
+    register states, discarding any that reach a state already reached
+    by a shorter one, so that only sequences that agree with `target` on
+    every sample are then checked exhaustively with `equivalent`.
+    """
+    if len(target) < 2 or not straight(target):
+        return None
+    kept = outputs(target)
+    used = sorted(
+        set(kept)
+        | set(inputs(target))
+        | {r for word in target for r in registers_used(word)[1]}
+    )
+    constants = sorted(
+        set(CONSTANTS) | {word & 0xFF for word in target if word >> 12 == 0x7}
+    )
+    words = [
+        (op << 12) | (d << 8) | (s << 4) | t
+        for op in OPERATIONS
+        for d in used
+        for s in used
+        for t in used
+    ] + [0x7000 | (d << 8) | v for d in used for v in constants]
+
+    # Each register holds a value for each sample, starting with all
+    # zeros, all ones and single bits before random values.
+    random = Random(seed)
+    start = [0, 0xFFFF, 0x0001, 0x8000]
+    lanes = [
+        (
+            [start[i]] * 0x10
+            if i < len(start)
+            else [random.randrange(0x10000) for _ in range(0x10)]
+        )
+        for i in range(samples)
+    ]
+    initial = tuple(tuple(lane[r] for lane in lanes) for r in used)
+    finals = [execute(target, lane) for lane in lanes]
+    expected = {
+        i: tuple(final[r] for final in finals) for i, r in enumerate(used) if r in kept
+    }
+    index = {r: i for i, r in enumerate(used)}
+
+    def mismatched(state: tuple[tuple[int, ...], ...]) -> list[int]:
+        return [i for i, values in expected.items() if state[i] != values]
+
+    def last_words(state: tuple[tuple[int, ...], ...], i: int) -> list[int]:
+        # The words that would leave the expected values in used[i].
+        values, d = expected[i], used[i]
+        result = list[int]()
+        if all(v == values[0] for v in values) and values[0] <= 0xFF:
+            result.append(0x7000 | (d << 8) | values[0])
+        for op, operation in OPERATIONS.items():
+            for s in used:
+                a = state[index[s]]
+                for t in used:
+                    b = state[index[t]]
+                    if operation(a[0], b[0]) != values[0]:
+                        continue
+                    if tuple(map(operation, a, b)) == values:
+                        result.append((op << 12) | (d << 8) | (s << 4) | t)
+        return result
+
+    def path(state: tuple[tuple[int, ...], ...]) -> list[int]:
+        result = list[int]()
+        while parents[state] is not None:
+            state, word = parents[state]
+            result.append(word)
+        return result[::-1]
+
+    parents: dict[tuple, tuple[tuple, int] | None] = {initial: None}
+    level = [initial]
+    for length in range(1, min(max_length, len(target) - 1) + 1):
+        # Try finishing each sequence of length - 1 words.
+        for state in level:
+            wrong = mismatched(state)
+            if len(wrong) != 1:
+                continue
+            for word in last_words(state, wrong[0]):
+                candidate = path(state) + [word]
+                if equivalent(target, candidate):
+                    return candidate
+        if length == min(max_length, len(target) - 1):
+            break
+        remaining = min(max_length, len(target) - 1) - length
+        next_level = []
+        for state in level:
+            for word in words:
+                op, d, s, t, addr = ToyComputer.decode(word)
+                values = (
+                    (addr,) * samples
+                    if op == 0x7
+                    else tuple(
+                        map(OPERATIONS[op], state[index[s]], state[index[t]])
+                    )
+                )
+                i = index[d]
+                if values == state[i]:
+                    continue
+                reached = state[:i] + (values,) + state[i + 1 :]
+                if reached in parents or len(mismatched(reached)) > remaining:
+                    continue
+                parents[reached] = (state, word)
+                next_level.append(reached)
+        level = next_level
+    return None
+
+
+def canonical(words: list[int]) -> tuple[tuple[int, ...], dict[int, int]]:
+    """
+    Renames the registers (other than scratch registers) in the order
+    they first appear, returning the renamed words and the mapping from
+    new names back to the original ones.
+    """
+    names = dict[int, int]()
+    for word in words:
+        read, wrote = registers_used(word)
+        for r in wrote[:1] + read:
+            if r not in SCRATCH and r not in names:
+                names[r] = len(names)
+    renamed = rename(words, names)
+    return tuple(renamed), {new: old for old, new in names.items()}
+
+
+def rename(words: list[int], names: dict[int, int]) -> list[int]:
+    result = list[int]()
+    for word in words:
+        op, d, s, t, addr = ToyComputer.decode(word)
+        d = names.get(d, d)
+        if op == 0x7:
+            result.append((op << 12) | (d << 8) | addr)
+        else:
+            s, t = names.get(s, s), names.get(t, t)
+            result.append((op << 12) | (d << 8) | (s << 4) | t)
+    return result
+
+
+class ReplacementTable:
+    """
+    Shorter sequences found by `superoptimize` for the words of lines of
+    assembly, kept with registers renamed (see `canonical`) so that one
+    entry serves a line whatever registers it uses.
+    """
+
+    def __init__(self, entries: dict[tuple[int, ...], list[int]] = {}) -> None:
+        self.entries = dict(entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, target: list[int], replacement: list[int]) -> None:
+        key, names = canonical(target)
+        self.entries[key] = rename(replacement, {v: k for k, v in names.items()})
+
+    def apply(self, words: list[int]) -> list[int]:
+        """
+        Returns the replacement for the words of a line, or the words
+        themselves if there is none.
+        """
+        if len(words) < 2 or not straight(words):
+            return words
+        key, names = canonical(words)
+        replacement = self.entries.get(key)
+        return words if replacement is None else rename(replacement, names)
+
+    def to_json(self) -> str:
+        return dumps(
+            [
+                {
+                    "target": " ".join(f"{word:04X}" for word in target),
+                    "replacement": " ".join(f"{word:04X}" for word in replacement),
+                }
+                for target, replacement in self.entries.items()
+            ],
+            indent=2,
+        )
+
+    @staticmethod
+    def from_json(text: str) -> "ReplacementTable":
+        return ReplacementTable(
+            {
+                tuple(int(word, 16) for word in entry["target"].split()): [
+                    int(word, 16) for word in entry["replacement"].split()
+                ]
+                for entry in loads(text)
+            }
+        )
+
+    def save(self, path: str | Path) -> None:
+        Path(path).write_text(self.to_json() + "\n")
+
+    @staticmethod
+    def load(path: str | Path) -> "ReplacementTable":
+        return ReplacementTable.from_json(Path(path).read_text())
@@ -0,0 +1,175 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from os import cpu_count
+
+from .exception import ToyException
+from .toy_computer import ToyComputer
+
+# Run statuses.
+HALTED, EXHAUSTED, ERROR = 0, 1, 2
+STATUS_NAMES = {HALTED: "halted", EXHAUSTED: "exhausted", ERROR: "error"}
+
+
+class SweepComputer(ToyComputer):
+    """
+    A computer for which every integer input (F0, or, if polling is
+    enabled, F2 as input is always waiting) reads `value` and every value output
+    (F1 to F5, F7) is recorded as `output` rather than printed. String
+    input (FB) reads an empty string and the remaining output addresses
+    are ignored.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.value = 0
+        self.output = 0
+
+    def load(self, memory_address: int, register_address: int) -> None:
+        match memory_address:
+            case 0xF0:
+                self.registers[register_address] = self.value
+            case 0xF2 if self.polling:
+                self.registers[register_address] = self.value
+            case 0xF1 if self.polling:
+                self.registers[register_address] = 1
+            case 0xFB:
+                pass
+            case _:
+                super().load(memory_address, register_address)
+
+    def store(self, memory_address: int, register_address: int) -> None:
+        match memory_address:
+            case 0xF1 | 0xF2 | 0xF3 | 0xF4 | 0xF5 | 0xF7:
+                self.output = self.registers[register_address]
+            case 0xF6 | 0xF8 | 0xF9:
+                pass
+            case _:
+                super().store(memory_address, register_address)
+
+
+@dataclass
+class SweepResult:
+    """
+    The last value output, the number of steps performed and the
+    status of the run for each input in `inputs`.
+    """
+
+    inputs: range
+    outputs: array
+    steps: array
+    statuses: array
+
+    def __len__(self) -> int:
+        return len(self.inputs)
+
+
+def result_views(buffer: memoryview, n: int) -> tuple[memoryview, ...]:
+    """
+    Splits a results buffer into step, output and status views.
+    """
+    return (
+        buffer[: 4 * n].cast("I"),
+        buffer[4 * n : 6 * n].cast("H"),
+        buffer[6 * n : 7 * n].cast("B"),
+    )
+
+
+def sweep_chunk(
+    image_name: str,
+    results_name: str,
+    inputs: range,
+    start: int,
+    stop: int,
+    max_steps: int,
+    banks: dict[int, list[int]] = {},
+    devices: dict[str, bool] = {},
+) -> None:
+    """
+    Runs the shared program image for inputs with index in
+    `start:stop`, writing into the shared results.
+    """
+    image = SharedMemory(image_name)
+    results = SharedMemory(results_name)
+    words = image.buf.cast("H")
+    steps, outputs, statuses = result_views(results.buf, len(inputs))
+    try:
+        pc, ram = words[0], words[1:]
+        computer = SweepComputer()
+        for i in range(start, stop):
+            computer.set_state(pc, ram, banks=banks, **devices)
+            computer.value = inputs[i] & 0xFFFF
+            computer.output = 0
+            try:
+                status = HALTED if computer.run(max_steps) else EXHAUSTED
+            except ToyException:
+                status = ERROR
+            steps[i] = computer.steps
+            outputs[i] = computer.output
+            statuses[i] = status
+    finally:
+        for view in (steps, outputs, statuses, ram, words):
+            view.release()
+        image.close()
+        results.close()
+
+
+def sweep(
+    pc: int,
+    ram: list[int],
+    inputs: range = range(0x10000),
+    max_steps: int = 0x10000,
+    processes: int | None = None,
+    banks: dict[int, list[int]] = {},
+    devices: dict[str, bool] = {},
+) -> SweepResult:
+    """
+    Runs a program once for every value in `inputs`, across a pool of
+    processes that share a single copy of the program image. `banks`
+    and `devices` (see `Assembled.devices`) are loaded with the program
+    for each run.
+    """
+    if len(ram) > 0x100:
+        raise ToyException("Not enough memory.")
+    n = len(inputs)
+    processes = processes or cpu_count() or 1
+    image = SharedMemory(create=True, size=2 * (0x101))
+    results = SharedMemory(create=True, size=max(7 * n, 1))
+    try:
+        words = image.buf.cast("H")
+        words[0] = pc
+        for i, v in enumerate(ram):
+            words[i + 1] = v & 0xFFFF
+        words.release()
+
+        size = max(1, -(-n // (4 * processes)))
+        with ProcessPoolExecutor(processes) as executor:
+            for future in [
+                executor.submit(
+                    sweep_chunk,
+                    image.name,
+                    results.name,
+                    inputs,
+                    start,
+                    min(start + size, n),
+                    max_steps,
+                    banks,
+                    devices,
+                )
+                for start in range(0, n, size)
+            ]:
+                future.result()
+
+        steps, outputs, statuses = result_views(results.buf, n)
+        result = SweepResult(
+            inputs, array("H", outputs), array("I", steps), array("B", statuses)
+        )
+        for view in (steps, outputs, statuses):
+            view.release()
+        return result
+    finally:
+        image.close()
+        image.unlink()
+        results.close()
+        results.unlink()
@@ -0,0 +1,200 @@
+from collections import Counter
+from dataclasses import dataclass, field
+
+from .toy_computer import ToyComputer, make_byte
+
+# Cycles spent in the execute stage by each opcode.
+DEFAULT_LATENCIES = {op: 1 for op in range(0x10)}
+
+# Cycles spent in the execute stage loading a result from the
+# arithmetic coprocessor (product, quotient and remainder).
+DEFAULT_DEVICE_LATENCIES = {0xFC: 3, 0xFD: 18, 0xFE: 18}
+
+# Stall causes.
+DATA, LATENCY, BRANCH = "data", "latency", "branch"
+
+# Cycles before the first instruction reaches the execute stage (fetch
+# and decode) and after the last leaves it (memory and write back).
+FILL, DRAIN = 2, 2
+
+
+def registers_used(instruction: int) -> tuple[tuple[int, ...], tuple[int, ...]]:
+    """
+    Returns the registers read and written by an instruction.
+    """
+    op, d, s, t, _ = ToyComputer.decode(instruction)
+    match op:
+        case 0x1 | 0x2 | 0x3 | 0x4 | 0x5 | 0x6:
+            return (s, t), (d,)
+        case 0x7 | 0x8 | 0xF:
+            return (), (d,)
+        case 0x9 | 0xC | 0xD | 0xE:
+            return (d,), ()
+        case 0xA:
+            return (t,), (d,)
+        case 0xB:
+            return (t, d), ()
+        case _:
+            return (), ()
+
+
+@dataclass
+class TimingReport:
+    """
+    Cycle counts for a run, with the cycles spent on and the stalls
+    caused at each address.
+    """
+
+    cycles: int = 0
+    instructions: int = 0
+    executions: Counter[int] = field(default_factory=Counter)
+    address_cycles: Counter[int] = field(default_factory=Counter)
+    stalls: dict[int, Counter[str]] = field(default_factory=dict)
+
+    @property
+    def cpi(self) -> float:
+        return self.cycles / self.instructions if self.instructions else 0.0
+
+    def format(self, computer: ToyComputer) -> str:
+        """
+        Returns a table of the cost of each executed address.
+        """
+        result = (
+            f"\nCycles: {self.cycles}"
+            f"\nInstructions: {self.instructions}"
+            f"\nCPI: {self.cpi:.2f}\n\n"
+            f"{'Addr':>4} {'Word':>4} {'Count':>8} {'Cycles':>8}"
+            f" {DATA:>8} {LATENCY:>8} {BRANCH:>8}  Pseudocode\n"
+        )
+        for address in sorted(self.executions):
+            word = computer.memory[address]
+            stalls = self.stalls.get(address, Counter())
+            pseudo = ToyComputer.as_pseudocode(word)
+            result += (
+                f"{make_byte(address):>4} {hex(word)[2:].rjust(4, '0')}"
+                f" {self.executions[address]:>8} {self.address_cycles[address]:>8}"
+                f" {stalls[DATA]:>8} {stalls[LATENCY]:>8} {stalls[BRANCH]:>8}"
+                f"  {pseudo if pseudo else 'halt'}\n"
+            )
+        return result
+
+
+class TimingModel:
+    """
+    A simple in-order five stage pipeline (fetch, decode, execute,
+    memory, write back) with forwarding.
+
+    Each instruction spends its opcode's latency in the execute stage,
+    waits for the registers it reads (loaded values are available one
+    cycle later than computed ones, or all results only after write
+    back without forwarding) and, if it changes the flow of control,
+    costs `branch_penalty` extra cycles to refill the pipeline. Loads
+    from the arithmetic coprocessor take `device_latencies` instead.
+    """
+
+    def __init__(
+        self,
+        latencies: dict[int, int] = {},
+        branch_penalty: int = 2,
+        forwarding: bool = True,
+        device_latencies: dict[int, int] = {},
+    ) -> None:
+        self.latencies = DEFAULT_LATENCIES | latencies
+        self.device_latencies = DEFAULT_DEVICE_LATENCIES | device_latencies
+        self.branch_penalty = branch_penalty
+        self.forwarding = forwarding
+        self.reset()
+
+    def reset(self) -> None:
+        self.report = TimingReport()
+        # Cycle in which the next instruction could start executing and
+        # cycle from which each register's value can be used.
+        self.next_cycle = FILL + 1
+        self.ready = [0 for _ in range(0x10)]
+
+    def record(
+        self, address: int, instruction: int, taken: bool, device: int | None = None
+    ) -> int:
+        """
+        Accounts for one executed instruction (a load from coprocessor
+        address `device`, if given), returning the cycles it added to
+        the run.
+        """
+        op = (instruction & 0xF000) >> 12
+        reads, writes = registers_used(instruction)
+        report = self.report
+        stalls = report.stalls.setdefault(address, Counter())
+
+        start = self.next_cycle
+        for r in reads:
+            if self.ready[r] > start:
+                stalls[DATA] += self.ready[r] - start
+                start = self.ready[r]
+        latency = self.latencies[op]
+        if device is not None:
+            latency = self.device_latencies.get(device, latency)
+        if latency > 1:
+            stalls[LATENCY] += latency - 1
+        done = start + latency
+
+        for r in writes:
+            if not self.forwarding:
+                self.ready[r] = done + 2
+            elif op in (0x8, 0xA):
+                self.ready[r] = done + 1
+            else:
+                self.ready[r] = done
+
+        penalty = self.branch_penalty if taken else 0
+        stalls[BRANCH] += penalty
+        added = done + penalty - self.next_cycle
+        self.next_cycle = done + penalty
+
+        if not report.instructions:
+            added += FILL
+        report.cycles = self.next_cycle - 1 + DRAIN
+        report.instructions += 1
+        report.executions[address] += 1
+        report.address_cycles[address] += added
+        return added
+
+
+def timed_step(computer: ToyComputer, model: TimingModel) -> bool:
+    """
+    Performs a step of `computer`, accounting for it in `model`.
+    """
+    address = computer.pc
+    instruction = computer.memory[address]
+    op, _, _, t, addr = ToyComputer.decode(instruction)
+    device = None
+    if computer.operands is not None and op in (0x8, 0xA):
+        target = addr if op == 0x8 else computer.registers[t] & 0xFF
+        if target in (0xFC, 0xFD, 0xFE):
+            device = target
+    more = computer.step()
+    model.record(
+        address,
+        instruction,
+        (instruction & 0xF000) != 0 and computer.pc != address + 1,
+        device,
+    )
+    return more
+
+
+def time_run(
+    computer: ToyComputer,
+    model: TimingModel | None = None,
+    max_steps: int | None = None,
+) -> TimingReport:
+    """
+    Runs `computer` (as `ToyComputer.run`) through a timing model,
+    returning the model's report.
+    """
+    if model is None:
+        model = TimingModel()
+    steps = 0
+    while max_steps is None or steps < max_steps:
+        steps += 1
+        if not timed_step(computer, model):
+            break
+    return model.report
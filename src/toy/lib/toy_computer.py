@@ -1,35 +1,157 @@
-from random import randrange
+from array import array
+from queue import Queue
+from random import Random, randrange
+from threading import Event, Thread
+from typing import Callable
 from .exception import ToyException
+from .image import CopyOnWriteMemory, ProgramImage
 
 
-def readInteger() -> int:
+def parse_integer(
+    result: str, write: Callable[[str], None] = lambda text: print(text, end="")
+) -> int | None:
+    """
+    Parses a binary, octal, denary or hexadecimal integer, returning
+    None if it is invalid.
+    """
+    if len(result) > 2:
+        match result[:2]:
+            case "0x":
+                base, result = 16, result[2:]
+            case "0o":
+                base, result = 8, result[2:]
+            case "0b":
+                base, result = 2, result[2:]
+            case _:
+                base, result = 10, result
+    else:
+        base, result = 10, result
+
+    try:
+        v = int(result, base)
+        w = abs(v) & 0xFFFF
+        if v != w:
+            write(f"* Taking input to be {hex(w)}\n")
+        return w
+
+    except ValueError:
+        return None
+
+
+def readInteger(
+    read: Callable[[], str] = input,
+    write: Callable[[str], None] = lambda text: print(text, end=""),
+) -> int:
     """
     Inputs an binary, octal, denary or hexadecimal integer.
     """
     while True:
-        result = input()
-        if len(result) > 2:
-            match result[:2]:
-                case "0x":
-                    base, result = 16, result[2:]
-                case "0o":
-                    base, result = 8, result[2:]
-                case "0b":
-                    base, result = 2, result[2:]
-                case _:
-                    base, result = 10, result
-        else:
-            base, result = 10, result
+        v = parse_integer(read(), write)
+        if v is not None:
+            return v
+        write("* Invalid input. Try again: ")
+
+
+class RandomWords:
+    """
+    Random words from a seeded generator, drawn in bulk so that each
+    word costs no more than an array lookup.
+    """
 
-        try:
-            v = int(result, base)
-            w = abs(v) & 0xFFFF
-            if v != w:
-                print(f"* Taking input to be {hex(w)}")
-            return w
+    def __init__(self, seed: int, batch: int = 0x100) -> None:
+        self.generator = Random(seed)
+        self.batch = batch
+        self.words = array("H")
+        self.index = 0
 
-        except ValueError:
-            print("* Invalid input. Try again: ", end="")
+    def next(self) -> int:
+        if self.index == len(self.words):
+            self.words = array("H", self.generator.randbytes(2 * self.batch))
+            self.index = 0
+        word = self.words[self.index]
+        self.index += 1
+        return word
+
+
+class LineReader:
+    """
+    Reads lines (one at a time, when asked for) in a background thread
+    so that a program can check for input without blocking.
+    """
+
+    def __init__(self, read_line: Callable[[], str]) -> None:
+        self.lines = Queue[str | BaseException]()
+        self.wanted = Event()
+        self.reading = False
+        self.stopped = False
+        Thread(target=self.read, args=(read_line,), daemon=True).start()
+
+    def read(self, read_line: Callable[[], str]) -> None:
+        while True:
+            self.wanted.wait()
+            self.wanted.clear()
+            if not self.reading:
+                # Woken by `stop` with no line wanted.
+                return
+            try:
+                self.lines.put(read_line())
+            except BaseException as e:
+                # Passed on to the reader (for example, EOFError).
+                self.lines.put(e)
+                return
+            if self.stopped:
+                return
+
+    def request(self) -> None:
+        if not self.reading:
+            self.reading = True
+            self.wanted.set()
+
+    def pending(self) -> bool:
+        """
+        Whether a line is waiting, starting to read one if not.
+        """
+        if self.lines.empty():
+            self.request()
+            return False
+        return True
+
+    def poll(self) -> str | None:
+        """
+        Returns a waiting line, or None, without blocking.
+        """
+        return self.take() if self.pending() else None
+
+    def take(self) -> str:
+        """
+        Returns the next line, waiting for it if necessary.
+        """
+        self.request()
+        line = self.lines.get()
+        self.reading = False
+        if isinstance(line, BaseException):
+            raise line
+        return line
+
+    def stop(self) -> bool:
+        """
+        Stops the thread once any line being read has been read (a read
+        in progress cannot be interrupted). Returns whether a line is
+        still being read, in which case it can still be taken.
+        """
+        self.stopped = True
+        if not self.reading:
+            self.wanted.set()
+        return self.reading and self.lines.empty()
+
+
+# Banked memory: writing a bank number to BANK_SELECT maps that page
+# into addresses BANK_START up to (but not including) BANK_END.
+BANK_START, BANK_END, BANK_SELECT = 0x80, 0xE0, 0xFF
+BANK_SIZE = BANK_END - BANK_START
+
+# Register receiving the program counter when the timer interrupts.
+TIMER_LINK = 0xC
 
 
 def make_nibble(x: int) -> str:
@@ -40,6 +162,10 @@ def make_byte(x: int) -> str:
     return hex(x)[2:].rjust(2, "0")
 
 
+def make_pattern(x: int) -> str:
+    return bin(x)[2:].replace("0", " ").replace("1", "█").rjust(16, " ")
+
+
 class ToyComputer:
     """
     A simple, educational virtual computer based on the specifications
@@ -75,10 +201,42 @@ class ToyComputer:
     ```
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        banked: bool = False,
+        coprocessor: bool = False,
+        seed: int | None = None,
+        dma: bool = False,
+        timer: bool = False,
+        polling: bool = False,
+    ) -> None:
         self.registers = [0 for _ in range(0x10)]
-        self.memory = [0 for _ in range(0x100)]
+        self.memory: list[int] | CopyOnWriteMemory = [0] * 0x100
         self.pc = 0
+        self.steps = 0
+        # Pages of banked memory (None if banking is disabled) and the
+        # number of the page currently mapped into memory.
+        self.banks: dict[int, list[int]] | None = {} if banked else None
+        self.bank = 0
+        # Operands written to the arithmetic coprocessor (None if the
+        # coprocessor is disabled).
+        self.operands: list[int] | None = [0, 0] if coprocessor else None
+        # Whether the block copy and fill device (FA and FB) is enabled.
+        self.dma = dma
+        # Whether the input status and non-blocking read (F1 and F2
+        # loads) are enabled.
+        self.polling = polling
+        # Background reader, started once a program checks for input.
+        self.reader: LineReader | None = None
+        # Whether the timer can be set by the program (F0 and FE stores).
+        self.timer = timer
+        # Timer: every `timer_interval` steps (if not 0), PC is stored in
+        # R[TIMER_LINK] and set to `timer_handler`.
+        self.timer_interval = 0
+        self.timer_handler = 0
+        self.interrupt_at: int | None = None
+        # Random words (for FA) from a seeded generator, if seeded.
+        self.random_words = None if seed is None else RandomWords(seed)
 
     @property
     def ir(self) -> int:
@@ -87,6 +245,26 @@ class ToyComputer:
         """
         return self.memory[self.pc]
 
+    @property
+    def devices(self) -> dict[str, bool]:
+        """
+        The optional devices enabled, as keyword arguments for
+        `set_state` (see `Assembled.devices`).
+        """
+        return {
+            "coprocessor": self.operands is not None,
+            "dma": self.dma,
+            "timer": self.timer,
+            "polling": self.polling,
+        }
+
+    @property
+    def halted(self) -> bool:
+        """
+        Whether the current instruction is halt.
+        """
+        return (self.memory[self.pc] & 0xF000) == 0
+
     @staticmethod
     def decode(instruction: int) -> tuple[int, int, int, int, int]:
         """
@@ -160,87 +338,238 @@ class ToyComputer:
             case _:
                 return ""
 
+    def read_line(self) -> str:
+        """
+        Reads a line of input (for F0 and FB).
+        """
+        return input()
+
+    def next_line(self) -> str:
+        """
+        Reads the next line of input, from the background reader if one
+        has been started.
+        """
+        return self.read_line() if self.reader is None else self.reader.take()
+
+    def stop_reader(self) -> LineReader | None:
+        """
+        Stops any background reader, so that input is read directly
+        again, discarding any line it read that the program did not
+        take. Returns the reader if it is still reading a line, which
+        then goes to whoever takes it from the reader rather than to
+        the next direct read.
+        """
+        reader, self.reader = self.reader, None
+        return reader if reader is not None and reader.stop() else None
+
+    def input_pending(self) -> bool:
+        """
+        Whether a line of input is waiting to be read (for F1).
+        """
+        if self.reader is None:
+            self.reader = LineReader(self.read_line)
+        return self.reader.pending()
+
+    def poll_line(self) -> str | None:
+        """
+        Returns a waiting line of input, or None, without blocking (for F2).
+        """
+        if self.reader is None:
+            self.reader = LineReader(self.read_line)
+        return self.reader.poll()
+
+    def write(self, text: str) -> None:
+        """
+        Writes output (for F1 to F9).
+        """
+        print(text, end="")
+
+    def random_word(self) -> int:
+        """
+        Returns a random word (for FA).
+        """
+        if self.random_words is not None:
+            return self.random_words.next()
+        return randrange(0x10000)
+
+    def store(self, memory_address: int, register_address: int) -> None:
+        """
+        Stores value into memory or performs special output operation.
+        """
+        match memory_address:
+            case 0xF1:
+                # binary out
+                self.write(bin(self.registers[register_address])[2:])
+            case 0xF2:
+                # octal out
+                self.write(oct(self.registers[register_address])[2:])
+            case 0xF3:
+                # hexadecimal out
+                self.write(hex(self.registers[register_address])[2:])
+            case 0xF4:
+                # denary out
+                self.write(str(self.registers[register_address]))
+            case 0xF5:
+                # char out
+                self.write(chr(self.registers[register_address]))
+            case 0xF6:
+                # new line
+                self.write("\n")
+            case 0xF7:
+                # pattern
+                self.write(f"{make_pattern(self.registers[register_address])}\n")
+            case 0xF8:
+                # dump
+                self.write(f"\n{self.dump()}\n")
+            case 0xF9:
+                # state
+                self.write(f"\n{self.state_to_machine_language()}\n")
+            case 0xF0 if self.timer:
+                # timer interval (0 stops the timer)
+                self.set_timer(self.registers[register_address])
+            case 0xFE if self.timer:
+                # timer handler address
+                self.timer_handler = self.registers[register_address] & 0xFF
+            case 0xFA if self.dma:
+                # block copy
+                self.transfer(self.registers[register_address], fill=False)
+            case 0xFB if self.dma:
+                # block fill
+                self.transfer(self.registers[register_address], fill=True)
+            case 0xFC | 0xFD if self.operands is not None:
+                # coprocessor operand
+                self.operands[memory_address - 0xFC] = self.registers[register_address]
+            case 0xFF if self.banks is not None:
+                # bank select
+                self.select_bank(self.registers[register_address])
+            case _ if memory_address < 0x100:
+                self.memory[memory_address] = self.registers[register_address]
+            case _:
+                raise ToyException(
+                    f"Trying to store to address {hex(memory_address)[2:]}..."
+                )
+
+    def load(self, memory_address: int, register_address: int) -> None:
+        """
+        Loads value into register or performs special input operation.
+        """
+        match memory_address:
+            case 0xF0:
+                # Load an integer value.
+                self.registers[register_address] = readInteger(
+                    self.next_line, self.write
+                )
+            case 0xF1 if self.polling:
+                # Input status: whether a line is waiting.
+                self.registers[register_address] = int(self.input_pending())
+            case 0xF2 if self.polling:
+                # Load an integer value if one is waiting (or zero).
+                line = self.poll_line()
+                v = None if line is None else parse_integer(line, self.write)
+                if line is not None and v is None:
+                    self.write("* Invalid input.\n")
+                self.registers[register_address] = v or 0
+            case 0xFA:
+                # Load a random word.
+                self.registers[register_address] = self.random_word()
+            case 0xFB:
+                # Store a string starting at address in register.
+                data = [
+                    x for c in self.next_line() if (x := ord(c)) >= 0x20 and x <= 0x7F
+                ]
+                start = self.registers[register_address]
+                for i, v in enumerate(data):
+                    if (address := start + i) < len(self.memory):
+                        self.memory[address] = v
+                    else:
+                        break
+            case 0xFC | 0xFD | 0xFE if self.operands is not None:
+                # Load the product, quotient or remainder of the operands.
+                a, b = self.operands
+                match memory_address:
+                    case 0xFC:
+                        v = a * b
+                    case 0xFD:
+                        v = a // b if b else 0xFFFF
+                    case _:
+                        v = a % b if b else a
+                self.registers[register_address] = v & 0xFFFF
+            case 0xFF if self.banks is not None:
+                # Load the selected bank number.
+                self.registers[register_address] = self.bank
+            case _ if memory_address < 0x100:
+                # R[d] <- M[addr]
+                self.registers[register_address] = self.memory[memory_address]
+            case _:
+                raise ToyException(
+                    f"Trying to load from address {hex(memory_address)[2:]}..."
+                )
+
+    def transfer(self, descriptor: int, fill: bool) -> None:
+        """
+        Copies a block of memory, or fills it with a value, as described
+        by the three words at `descriptor`: the source address (or the
+        value), the destination address and the number of words.
+        """
+        descriptor &= 0xFF
+        if descriptor > 0xFD:
+            raise ToyException(f"Bad transfer descriptor at {make_byte(descriptor)}...")
+        source, destination, length = self.memory[descriptor : descriptor + 3]
+        if destination + length > 0x100 or (not fill and source + length > 0x100):
+            raise ToyException("Trying to transfer outside memory...")
+        if fill:
+            self.memory[destination : destination + length] = [source] * length
+        else:
+            self.memory[destination : destination + length] = self.memory[
+                source : source + length
+            ]
+
+    def select_bank(self, bank: int) -> None:
+        """
+        Maps a page of banked memory into addresses `BANK_START` to
+        `BANK_END`. Pages are only allocated once they hold data.
+        """
+        if self.banks is None:
+            raise ToyException("Banked memory is not enabled.")
+        if bank == self.bank:
+            return
+        window = self.memory[BANK_START:BANK_END]
+        if self.bank in self.banks or any(window):
+            self.banks[self.bank] = window
+        page = self.banks.get(bank)
+        for i in range(BANK_SIZE):
+            self.memory[BANK_START + i] = page[i] if page else 0
+        self.bank = bank
+
+    def set_timer(self, interval: int, handler: int | None = None) -> None:
+        """
+        Interrupts the program every `interval` steps (never if 0) by
+        storing the program counter in R[TIMER_LINK] and jumping to
+        `handler` (if not given, the address last stored to FE).
+        """
+        if handler is not None:
+            self.timer_handler = handler & 0xFF
+        self.timer_interval = interval
+        self.interrupt_at = self.steps + interval if interval else None
+
+    def interrupt(self) -> None:
+        """
+        Stores the program counter in R[TIMER_LINK] and jumps to the
+        timer's handler.
+        """
+        self.registers[TIMER_LINK] = self.pc
+        self.pc = self.timer_handler
+        self.interrupt_at = self.steps + self.timer_interval
+
     def step(self) -> bool:
         """
         Performs a single fetch-decode-execute cycle. Returns whether
         there are non halting steps remaining.
         """
-
-        def store(memory_address: int, register_address: int) -> None:
-            """
-            Stores value into memory or performs special output operation.
-            """
-            match memory_address:
-                case 0xF1:
-                    # binary out
-                    print(bin(self.registers[register_address])[2:], end="")
-                case 0xF2:
-                    # octal out
-                    print(oct(self.registers[register_address])[2:], end="")
-                case 0xF3:
-                    # hexadecimal out
-                    print(hex(self.registers[register_address])[2:], end="")
-                case 0xF4:
-                    # denary out
-                    print(self.registers[register_address], end="")
-                case 0xF5:
-                    # char out
-                    print(chr(self.registers[register_address]), end="")
-                case 0xF6:
-                    # new line
-                    print()
-                case 0xF7:
-                    # pattern
-                    print(
-                        bin(self.registers[register_address])[2:]
-                        .replace("0", " ")
-                        .replace("1", "█")
-                        .rjust(16, " ")
-                    )
-                case 0xF8:
-                    # dump
-                    print(f"\n{self.dump()}")
-                case 0xF9:
-                    # state
-                    print(f"\n{self.state_to_machine_language()}")
-                case _ if memory_address < 0x100:
-                    self.memory[memory_address] = self.registers[register_address]
-                case _:
-                    raise ToyException(
-                        f"Trying to store to address {hex(memory_address)[2:]}..."
-                    )
-
-        def load(memory_address: int, register_address: int) -> None:
-            """
-            Loads value into register or performs special input operation.
-            """
-            match memory_address:
-                case 0xF0:
-                    # Load an integer value.
-                    self.registers[register_address] = readInteger()
-                case 0xFA:
-                    # Load a random word.
-                    self.registers[register_address] = randrange(0x10000)
-                case 0xFB:
-                    # Store a string starting at address in register.
-                    data = [x for c in input() if (x := ord(c)) >= 0x20 and x <= 0x7F]
-                    start = self.registers[register_address]
-                    for i, v in enumerate(data):
-                        if (address := start + i) < len(self.memory):
-                            self.memory[address] = v
-                        else:
-                            break
-                case _ if memory_address < 0x100:
-                    # R[d] <- M[addr]
-                    self.registers[register_address] = self.memory[memory_address]
-                case _:
-                    raise ToyException(
-                        f"Trying to load from address {hex(memory_address)[2:]}..."
-                    )
-
         ir = self.memory[self.pc]
         op, d, s, t, addr = ToyComputer.decode(ir)
         self.pc += 1
+        self.steps += 1
 
         match op:
             case 0x0:
@@ -269,16 +598,16 @@ class ToyComputer:
                 self.registers[d] = addr
             case 0x8:
                 # R[D] <- mem[addr]
-                load(addr, d)
+                self.load(addr, d)
             case 0x9:
                 # mem[addr] <- R[D]
-                store(addr, d)
+                self.store(addr, d)
             case 0xA:
                 # R[D] <- mem[R[T]]
-                load(self.registers[t] & 0x00FF, d)
+                self.load(self.registers[t] & 0x00FF, d)
             case 0xB:
                 # mem[R[T]] < R[D]
-                store(self.registers[t] & 0x00FF, d)
+                self.store(self.registers[t] & 0x00FF, d)
             case 0xC:
                 # R[D] == 0 ? PC <- addr
                 if self.registers[d] == 0:
@@ -295,14 +624,25 @@ class ToyComputer:
                 self.registers[d] = self.pc
                 self.pc = addr
 
+        if op and self.interrupt_at is not None and self.steps >= self.interrupt_at:
+            self.interrupt()
         return (self.memory[self.pc] & 0xF000) != 0
 
-    def run(self) -> None:
+    def run(self, max_steps: int | None = None) -> bool:
         """
-        Repeats fetch-decode-execute cycle until halt is encountered.
+        Repeats fetch-decode-execute cycle until halt is encountered
+        or, if `max_steps` is given, until that many steps have been
+        performed. Returns whether the program halted.
         """
-        while self.step():
-            pass
+        if max_steps is None:
+            while self.step():
+                pass
+            return True
+        limit = self.steps + max_steps
+        while self.steps < limit:
+            if not self.step():
+                return True
+        return self.halted
 
     def clear(self) -> None:
         for i, _ in enumerate(self.memory):
@@ -310,26 +650,77 @@ class ToyComputer:
                 self.registers[i] = 0
             self.memory[i] = 0
             self.pc = 0
+        self.steps = 0
+        if self.banks is not None:
+            self.banks = {}
+        self.bank = 0
+        if self.operands is not None:
+            self.operands = [0, 0]
+        self.set_timer(0, 0)
+        self.stop_reader()
 
     def set_state(
         self,
         pc: int,
-        ram: list[int],
+        ram: list[int] | ProgramImage,
         registers: list[int] = [],
+        banks: dict[int, list[int]] = {},
+        coprocessor: bool = False,
+        dma: bool = False,
+        timer: bool = False,
+        polling: bool = False,
     ) -> None:
         """
         Sets the program counter, memory contents and register contents.
+
+        If `ram` is a `ProgramImage`, memory is shared with the image
+        (and any other computers loaded with it) until it is stored to,
+        when only the page of memory stored to is copied. This saves
+        memory and setup time when a program is loaded into many
+        computers at once, but every fetch and load then goes through
+        Python code, so each step runs roughly a third slower than
+        with a list.
+
+        Any `banks` are loaded as pages of banked memory (enabling
+        banking, which is disabled if there are none), with bank 0
+        mapped in. The optional devices are enabled or disabled to suit
+        the program: the arithmetic coprocessor by `coprocessor`, the
+        block copy and fill device by `dma`, the timer by `timer` and
+        the input status and non-blocking read by `polling`. Any
+        background reader is stopped (see `stop_reader`).
         """
         if pc < 0 or pc > 0xFF:
             raise ToyException("Bad program counter.")
         if len(ram) > 0x100:
             raise ToyException("Not enough memory.")
+        if any(len(page) > BANK_SIZE for page in banks.values()):
+            raise ToyException("Not enough memory in bank.")
+        if 0 in banks:
+            raise ToyException("Bank 0 is the memory set by ram.")
+        self.banks = (
+            {
+                n: [*page, *(0 for _ in range(BANK_SIZE - len(page)))]
+                for n, page in banks.items()
+            }
+            if banks
+            else None
+        )
+        self.bank = 0
+        self.operands = [0, 0] if coprocessor else None
+        self.dma = dma
+        self.timer = timer
+        self.polling = polling
+        self.stop_reader()
         self.pc = pc
-        for i in range(0x100):
-            if i < len(ram):
-                self.memory[i] = ram[i]
-            else:
-                self.memory[i] = 0
+        self.steps = 0
+        self.set_timer(0, 0)
+        if isinstance(ram, ProgramImage):
+            self.memory = CopyOnWriteMemory(ram)
+        else:
+            if type(self.memory) is not list:
+                self.memory = [0] * 0x100
+            self.memory[: len(ram)] = ram
+            self.memory[len(ram) :] = [0] * (0x100 - len(ram))
         for i in range(0x10):
             if i < len(registers):
                 self.registers[i] = registers[i]
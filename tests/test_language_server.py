@@ -0,0 +1,46 @@
+from io import BytesIO
+from json import dumps, loads
+
+from toy.lib.language_server import LanguageServer
+
+
+def frame(body: bytes) -> bytes:
+    return f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+
+
+def replies(data: bytes) -> list[dict]:
+    output = BytesIO()
+    LanguageServer(BytesIO(data), output).serve()
+    result = []
+    for part in output.getvalue().split(b"Content-Length: ")[1:]:
+        result.append(loads(part.split(b"\r\n\r\n", 1)[1]))
+    return result
+
+
+def test_survives_garbage_before_a_request():
+    request = {"jsonrpc": "2.0", "id": 1, "method": "shutdown"}
+    data = (
+        frame(b"{not json")
+        + b"Content-Length: twelve\r\n\r\n"
+        + b"garbage\r\n\r\n"
+        + frame(dumps(request).encode())
+    )
+    *errors, last = replies(data)
+    assert [error["error"]["code"] for error in errors] == [-32700] * 3
+    assert last == {"jsonrpc": "2.0", "id": 1, "result": None}
+
+
+def test_failing_request_gets_an_internal_error():
+    change = {
+        "jsonrpc": "2.0",
+        "method": "textDocument/didChange",
+        "params": {
+            "textDocument": {"uri": "file:///unknown.asm"},
+            "contentChanges": [{"text": "halt"}],
+        },
+    }
+    hover = {"jsonrpc": "2.0", "id": 2, "method": "textDocument/hover"}
+    data = frame(dumps(change).encode()) + frame(dumps(hover).encode())
+    (reply,) = replies(data)
+    assert reply["id"] == 2
+    assert reply["error"]["code"] == -32603
@@ -0,0 +1,69 @@
+from queue import Queue
+
+from toy.lib.assembler import assemble
+from toy.lib.toy_computer import ToyComputer
+
+# R[1] <- 5, M[FA] <- R[1], halt.
+PLAIN = [0x7105, 0x91FA, 0x0000]
+
+
+def test_plain_program_after_a_dma_program():
+    computer = ToyComputer()
+    assembled = assemble(".main\n.memcpy %1 %2 %3\nhalt", show_addresses=False)
+    computer.set_state(assembled.pc, assembled.words, **assembled.devices)
+    assert computer.run()
+    computer.set_state(0, PLAIN)
+    assert computer.run()
+    assert computer.memory[0xFA] == 5
+
+
+def test_plain_program_after_a_banked_program():
+    computer = ToyComputer()
+    computer.set_state(0, [0x0000], banks={1: [1, 2, 3]})
+    assert computer.run()
+    computer.set_state(0, [0x7105, 0x91FF, 0x0000])
+    assert computer.run()
+    assert computer.banks is None
+    assert computer.memory[0xFF] == 5
+
+
+def test_plain_program_after_a_coprocessor_program():
+    computer = ToyComputer()
+    assembled = assemble(
+        ".coprocessor\n.main\nmul %1 %2 %3\nhalt", show_addresses=False
+    )
+    computer.set_state(assembled.pc, assembled.words, **assembled.devices)
+    assert computer.operands is not None
+    assert computer.run()
+    # R[1] <- 3, M[FC] <- R[1], R[2] <- M[FC], halt.
+    computer.set_state(0, [0x7103, 0x91FC, 0x82FC, 0x0000])
+    assert computer.run()
+    assert computer.operands is None
+    assert computer.registers[2] == 3
+
+
+def test_devices_match_the_program_loaded():
+    computer = ToyComputer()
+    for code in (".timer %1 %2\nhalt", "halt", ".coprocessor\nhalt"):
+        assembled = assemble(f".main\n{code}", show_addresses=False)
+        computer.set_state(assembled.pc, assembled.words, **assembled.devices)
+        assert computer.devices == assembled.devices
+
+
+def test_reader_still_reading_is_handed_back_when_stopped():
+    lines = Queue[str]()
+
+    class Computer(ToyComputer):
+        def read_line(self) -> str:
+            return lines.get()
+
+    computer = Computer()
+    # R[1] <- input status, halt.
+    computer.set_state(0, [0x81F1, 0x0000], polling=True)
+    assert computer.run()
+    assert computer.registers[1] == 0
+    reader = computer.stop_reader()
+    assert reader is not None
+    assert computer.reader is None
+    lines.put("next")
+    assert reader.take() == "next"